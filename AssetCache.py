@@ -0,0 +1,61 @@
+# AssetCache - loads each model and texture once and shares it
+# Every sprite in the game is the same plane model with a different texture,
+# so the plane is loaded once as a template and each sprite is a placeholder
+# node with that template instanced under it. Textures are kept by file name,
+# and can be read from disk on a worker thread before they are first needed.
+import threading
+
+from panda3d.core import Filename, TexturePool, VirtualFileSystem, getModelPath
+
+TEXTURE_DIR = "textures/"
+
+
+class AssetCache:
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.templates = {}  # model path -> NodePath that is never drawn itself
+        self.textures = {}  # texture file name -> Texture
+        self.preloader = None
+
+    def template(self, modelPath):
+        template = self.templates.get(modelPath)
+        if template is None:
+            template = self.templates[modelPath] = self.loader.loadModel(modelPath)
+        return template
+
+    def texture(self, name):
+        texture = self.textures.get(name)
+        if texture is None:
+            # a texture the preloader has already read comes straight from the pool
+            texture = self.textures[name] = self.loader.loadTexture(TEXTURE_DIR + name)
+        return texture
+
+    # where a texture's file is, found along the model path as loadTexture would
+    def texturePath(self, name):
+        path = Filename(TEXTURE_DIR + name)
+        if not VirtualFileSystem.getGlobalPtr().resolveFilename(path, getModelPath().getValue()):
+            raise IOError("texture %s not found on the model path" % name)
+        return path
+
+    # a new node under parent that shares the model's geometry with every other
+    # instance; position, scale, texture and render state are set on this node
+    def instance(self, modelPath, parent):
+        node = parent.attachNewNode(modelPath)
+        self.template(modelPath).instanceTo(node)
+        return node
+
+    # starts reading the named textures into Panda's texture pool on a worker
+    # thread, so the first sprites to use them do not wait for the disk
+    def preloadTextures(self, names):
+        def load():
+            for name in names:
+                TexturePool.loadTexture(TEXTURE_DIR + name)
+
+        self.preloader = threading.Thread(target=load, name="TexturePreload", daemon=True)
+        self.preloader.start()
+
+    def waitForPreload(self):
+        if self.preloader is not None:
+            self.preloader.join()
+            self.preloader = None
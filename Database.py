@@ -1,11 +1,7 @@
-import sqlite3
+from leaderboard import Leaderboard
 
-db = sqlite3.connect('data.db')
-
-#Get a cursor object
-cursor = db.cursor()
-cursor.execute('''CREATE TABLE users(name TEXT, score NUMBER)''')
-db.commit()
+# scores entered here are kept until option 4 clears them down
+leaderboard = Leaderboard(keep=None)
 
 
 ans = True
@@ -18,49 +14,32 @@ while ans:
     print("5. Quit database")
 
     selection = int(input("Select one number:  "))
-    # Get a cursor object
-    cursor = db.cursor()
 
     if selection == 1:
-        cursor = db.cursor()
         name1 = str(input("name: "))
-        score1 = str(input("score: "))
+        score1 = float(input("score: "))
 
         # Insert user 1
-        cursor.execute('''INSERT INTO users(name,score)
-                          VALUES(?,?,?)''', (name1, score1))
+        leaderboard.submit(name1, score1)
         print('User information inserted')
 
-        db.commit()
-
-        res = cursor.execute('''SELECT * FROM users''')
-        print(res.fetchall())
+        print(leaderboard.all())
 
     elif selection == 2:
         # view top 5
-        res = cursor.execute('''SELECT * FROM users order by score desc limit 5 ''')
-        print(res.fetchall())
+        print(leaderboard.top(5))
 
     elif selection == 3:
         # view all
-        res = cursor.execute('''SELECT * FROM users''')
-        print(res.fetchall())
+        print(leaderboard.all())
 
     elif selection == 4:  # clear down scores not in top 5
-        res = cursor.execute('''SELECT * FROM users order by score desc limit 5''')
-        results = res.fetchall()
-        lowestScore = results[len(results) - 1][2]
-        print (lowestScore)
-        res = cursor.execute('''DELETE FROM users WHERE score < ?''', (lowestScore,))
+        leaderboard.prune(5)
+        print(leaderboard.all())
 
     elif selection == 5:  # quitting database, break outta loop
         print ("Quiting datatbase")
-        db.close()
+        leaderboard.close()
         break
     else:
         print ("Not a valid option")
-
-# Get a cursor object
- #cursor = db.cursor()
- #cursor.execute('''DROP TABLE users''')
- #db.commit()
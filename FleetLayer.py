@@ -0,0 +1,158 @@
+# FleetLayer - draws every boat of a fleet.Fleet in two batches
+# Each boat is two quads, its hull and its sail, like the player's ship and
+# sail sprites. All the hulls are one Geom and all the sails another, each
+# with its own texture, so the whole fleet is two draw calls however many
+# boats are racing. The quads' corners are kept in a vertex array of their
+# own, apart from the texture coordinates which never change, and once a
+# frame every corner is worked out with NumPy and written into it at once.
+# A fleet with a visible mask (see raceclient.RemoteFleet) has the quads of
+# the boats it hides drawn with no size.
+import numpy as np
+
+from panda3d.core import (Geom, GeomNode, GeomTriangles, GeomVertexArrayFormat, GeomVertexData, GeomVertexFormat,
+                          InternalName, NodePath, OmniBoundingVolume, TransparencyAttrib)
+from fleet import BOAT_RADIUS
+from shipmodel import SCREEN_X, SCREEN_Y
+
+FLEET_DEPTH = 50  # the same depth as the player's ship
+# the hull is about two thirds of its sprite's width across, so a boat drawn
+# at this scale is about as wide as fleet.py makes it; half the player's
+# ship, so a whole fleet fits on the course
+FLEET_SCALE = 3 * BOAT_RADIUS
+HULL_TEXTURE = "sailing_ship.png"
+SAIL_TEXTURE = "sail2.png"
+# where ShipController puts the sail: the mast is this far ahead of the
+# middle of the hull, and the middle of the sail this far behind the mast,
+# both as parts of the hull's size
+MAST_OFFSET = .2
+SAIL_OFFSET = -.3
+SAIL_SCALE = .9  # of the hull's size
+SAIL_NEARER = .1  # of the hull's size; the sail is drawn over the hull
+# the corners of each quad, anticlockwise from the bottom left as the camera
+# sees them, with their texture coordinates
+CORNERS = np.array([(-.5, -.5), (.5, -.5), (.5, .5), (-.5, .5)])
+
+
+def quadFormat():
+    # the corners in one array and the texture coordinates in another, so the
+    # corners are a single block of floats to write over
+    corners = GeomVertexArrayFormat()
+    corners.addColumn(InternalName.getVertex(), 3, Geom.NT_float32, Geom.C_point)
+    texcoords = GeomVertexArrayFormat()
+    texcoords.addColumn(InternalName.getTexcoord(), 2, Geom.NT_float32, Geom.C_texcoord)
+    vertexFormat = GeomVertexFormat()
+    vertexFormat.addArray(corners)
+    vertexFormat.addArray(texcoords)
+    return GeomVertexFormat.registerFormat(vertexFormat)
+
+
+# the corners of quads of size centred on (xs, zs) and rolled by headings in
+# degrees, as setR rolls a sprite, at depth; size is one value or one per
+# quad; returns a (count * 4, 3) array
+def quadCorners(xs, zs, headings, size, depth):
+    radians = np.radians(headings)[:, None]
+    cos, sin = np.cos(radians), np.sin(radians)
+    size = np.reshape(size, (-1, 1))
+    lx, lz = CORNERS[:, 0] * size, CORNERS[:, 1] * size
+    corners = np.empty((len(xs), 4, 3), dtype=np.float32)
+    corners[..., 0] = xs[:, None] + lx * cos + lz * sin
+    corners[..., 1] = depth
+    corners[..., 2] = zs[:, None] - lx * sin + lz * cos
+    return corners.reshape(-1, 3)
+
+
+class FleetLayer:
+
+    def __init__(self, showbaseMain, fleet, scale=FLEET_SCALE, depth=FLEET_DEPTH):
+        self.showbaseMain = showbaseMain
+        self.fleet = fleet
+        self.scale = scale
+        self.depth = depth
+        self.node = None
+        self.capture()
+
+    # a node under parent holding the hull and sail batches
+    def build(self, parent):
+        self.node = NodePath("fleetLayer")
+        self.node.reparentTo(parent)
+        self.hulls = self.batch("fleetHulls", HULL_TEXTURE)
+        self.sails = self.batch("fleetSails", SAIL_TEXTURE)
+        self.render(1.0)
+        return self.node
+
+    def batch(self, name, texture):
+        count = self.fleet.count
+        vertexData = GeomVertexData(name, quadFormat(), Geom.UH_dynamic)
+        vertexData.setNumRows(4 * count)
+        texcoords = np.tile(CORNERS + .5, (count, 1)).astype(np.float32)
+        np.frombuffer(memoryview(vertexData.modifyArray(1)), dtype=np.float32)[:] = texcoords.ravel()
+
+        triangles = GeomTriangles(Geom.UH_static)
+        triangles.setIndexType(Geom.NT_uint32)
+        first = np.arange(count, dtype=np.uint32)[:, None] * 4
+        indices = (first + np.array([0, 1, 2, 0, 2, 3], dtype=np.uint32)).ravel()
+        triangles.modifyVertices().setNumRows(len(indices))
+        np.frombuffer(memoryview(triangles.modifyVertices()), dtype=np.uint32)[:] = indices
+        geom = Geom(vertexData)
+        geom.addPrimitive(triangles)
+
+        geomNode = GeomNode(name)
+        geomNode.addGeom(geom)
+        # the boats go everywhere on the screen, so the batch is never culled
+        # and its bounds are not worked out again every time it moves
+        geomNode.setBounds(OmniBoundingVolume())
+        geomNode.setFinal(True)
+        batch = self.node.attachNewNode(geomNode)
+        # drawn like loadObject's sprites
+        batch.setBin("unsorted", 0)
+        batch.setDepthTest(True)
+        batch.setTransparency(TransparencyAttrib.MAlpha)
+        batch.setTexture(self.showbaseMain.assets.texture(texture), 1)
+        return geomNode
+
+    # the boats as they are before a physics step, to draw from towards where
+    # they are after it
+    def capture(self):
+        ships = self.fleet.ships
+        self.previous = (ships.x.copy(), ships.z.copy(), ships.heading.copy(), ships.sailAngle.copy())
+
+    # moves every quad to where its boat is between the last two physics
+    # steps; alpha is how far through that step the rendered frame is (0..1)
+    def render(self, alpha):
+        if self.node is None:
+            return
+        ships = self.fleet.ships
+        x0, z0, heading0, sail0 = self.previous
+        alpha = np.full(len(x0), alpha)
+        # a boat that wrapped round the screen edge jumps rather than sliding back across
+        alpha[(np.abs(ships.x - x0) > SCREEN_X) | (np.abs(ships.z - z0) > SCREEN_Y)] = 1.0
+        xs = x0 + (ships.x - x0) * alpha
+        zs = z0 + (ships.z - z0) * alpha
+        headings = heading0 + ((ships.heading - heading0 + 180) % 360 - 180) * alpha
+        sails = sail0 + ((ships.sailAngle - sail0 + 180) % 360 - 180) * alpha
+
+        # the sail turns about the mast, which turns with the hull
+        scale = self.scale
+        hullRadians = np.radians(headings)
+        mastXs = xs + MAST_OFFSET * scale * np.sin(hullRadians)
+        mastZs = zs + MAST_OFFSET * scale * np.cos(hullRadians)
+        sailRadians = np.radians(headings + sails)
+        sailXs = mastXs + SAIL_OFFSET * scale * np.sin(sailRadians)
+        sailZs = mastZs + SAIL_OFFSET * scale * np.cos(sailRadians)
+
+        sizes = scale
+        visible = getattr(self.fleet, "visible", None)
+        if visible is not None:
+            sizes = np.where(visible, scale, 0.0)
+        self.write(self.hulls, quadCorners(xs, zs, headings, sizes, self.depth))
+        self.write(self.sails, quadCorners(sailXs, sailZs, headings + sails, SAIL_SCALE * sizes,
+                                           self.depth - SAIL_NEARER * scale))
+
+    def write(self, geomNode, corners):
+        vertexData = geomNode.modifyGeom(0).modifyVertexData()
+        np.frombuffer(memoryview(vertexData.modifyArray(0)), dtype=np.float32)[:] = corners.ravel()
+
+    def destroy(self):
+        if self.node is not None:
+            self.node.removeNode()
+            self.node = None
@@ -0,0 +1,124 @@
+# Hud - the game's on-screen text, kept and only changed when it must be
+# Every piece of text is an OnscreenText made once and kept for the whole
+# game. A value given to a field is formatted to the string it would show,
+# and the TextNode is only given new text, and so only builds its geometry
+# again, when that string differs from the one on screen; the score moves
+# every frame but its whole number only now and then. The high score table
+# is a pool of rows that are reused, and hidden when there are fewer scores,
+# rather than made again after every race. With a rate the text is changed
+# at most that many times a second, the latest value winning.
+from direct.gui.OnscreenText import OnscreenText
+from panda3d.core import TextNode
+
+TEXT_SCALE = .1
+TEXT_COLOUR = (1, 1, 1, 1)
+TEXT_SHADOW = (0, 0, 0, 0.5)
+
+
+def makeText(parent, pos, text=""):
+    return OnscreenText(text=text, parent=parent, pos=pos, fg=TEXT_COLOUR, align=TextNode.ALeft,
+                        shadow=TEXT_SHADOW, scale=TEXT_SCALE, mayChange=True)
+
+
+class HudField:
+
+    # format turns a value into the text shown
+    def __init__(self, parent, pos, format, value=None):
+        self.format = format
+        self.shown = None
+        self.pending = None
+        self.text = makeText(parent, pos)
+        if value is not None:
+            self.set(value)
+            self.flush()
+
+    def set(self, value):
+        text = self.format(value)
+        self.pending = text if text != self.shown else None
+
+    # puts the newest text on screen, if it differs from what is there
+    def flush(self):
+        if self.pending is not None:
+            self.text.setText(self.pending)
+            self.shown = self.pending
+            self.pending = None
+
+    def destroy(self):
+        self.text.destroy()
+
+
+class HudTable:
+
+    # a heading with rows below it, rowSpacing apart
+    def __init__(self, parent, pos, heading, rowSpacing):
+        self.parent = parent
+        self.x, self.y = pos
+        self.heading = heading
+        self.rowSpacing = rowSpacing
+        self.headingText = None
+        self.rows = []  # (OnscreenText, text shown), every row ever needed
+        self.pending = None
+
+    # rows is a list of strings, one a row
+    def set(self, rows):
+        self.pending = list(rows)
+
+    def flush(self):
+        if self.pending is None:
+            return
+        if self.headingText is None:
+            self.headingText = makeText(self.parent, (self.x, self.y), self.heading)
+        rows, self.pending = self.pending, None
+        while len(self.rows) < len(rows):
+            y = self.y - .1 - len(self.rows) * self.rowSpacing
+            self.rows.append([makeText(self.parent, (self.x, y)), None])
+        for i, row in enumerate(self.rows):
+            text = row[0]
+            if i < len(rows):
+                if rows[i] != row[1]:
+                    text.setText(rows[i])
+                    row[1] = rows[i]
+                text.show()
+            else:
+                text.hide()
+
+    def destroy(self):
+        if self.headingText is not None:
+            self.headingText.destroy()
+        for text, shown in self.rows:
+            text.destroy()
+        self.rows = []
+
+
+class Hud:
+
+    # maxRate is the most times a second the text changes; 0 changes it
+    # whenever update is called
+    def __init__(self, maxRate=0):
+        self.interval = 1.0 / maxRate if maxRate > 0 else 0.0
+        self.lastUpdate = None
+        self.fields = {}
+
+    def addField(self, name, parent, pos, format, value=None):
+        self.fields[name] = HudField(parent, pos, format, value)
+        return self.fields[name]
+
+    def addTable(self, name, parent, pos, heading, rowSpacing):
+        self.fields[name] = HudTable(parent, pos, heading, rowSpacing)
+        return self.fields[name]
+
+    def set(self, name, value):
+        self.fields[name].set(value)
+
+    # called once a frame with the time in seconds
+    def update(self, now):
+        if self.lastUpdate is not None and now - self.lastUpdate < self.interval:
+            return
+        self.lastUpdate = now
+        for field in self.fields.values():
+            field.flush()
+
+    def destroy(self):
+        for field in self.fields.values():
+            field.destroy()
+        self.fields = {}
@@ -1,56 +1,67 @@
-from direct.showutil.Rope import Rope
+from panda3d.core import LineSegs
+from coursefile import loadCourse, DEFAULT_COURSE_FILE
+from StaticLayer import StaticLayer
 
 
 class Scene:
 
     def __init__(self, showbaseMain):
         self.showbaseMain = showbaseMain
+        self.routeLine = None
+
+    # courseFile is a JSON course file, or a compiled one
+    def setup(self, courseFile=DEFAULT_COURSE_FILE):
+        # the course's geometry is compiled once and cached, see coursefile.py
+        self.course = loadCourse(courseFile)
 
-    def setup(self):
         # Setting the background to 'water'
         # .self refers back to class(linking it) ensuring it's not just global
-        self.showbaseMain.setBackgroundColor((0, 0, 0, 1))
         self.bg = self.showbaseMain.loadObject("water.jpg", scale=146, depth=200, transparency=False)
 
-        # creating & positioning the green buoy
-        self.gbuoy = self.showbaseMain.loadObject("Green_buoy.png", scale=4, depth=50)
-        self.gbuoy.setPos(-7, 50, 7)
-
-        # Second green buoy
-        self.sgbuoy = self.showbaseMain.loadObject("Green_buoy.png", scale=4, depth=50)
-        self.sgbuoy.setPos(9, 50, 3)
-
-        # creating & positioning the red buoy
-        self.rbuoy = self.showbaseMain.loadObject("Red_buoy.png", scale=4, depth=50)
-        self.rbuoy.setPos(2.5, 50, -6)
-
-        # Importing land
-        self.sland = self.showbaseMain.loadObject("land.png", scale=16, depth=50)
-        self.sland.setPos(3, 50, 9)
-        self.sland.setR(180)
-
-        self.land = self.showbaseMain.loadObject("land.png", scale=16, depth=50)
-        self.land.setPos(-5, 50, -9)
-
-        self.Finflag = self.showbaseMain.loadObject("Finflag.png", scale=4, depth=50)
-        self.Finflag.setPos(15, 50, -10)
-
-        # the 'rope' is the white line that is the
-        # sailing course the user must follow
-        r = Rope()
-        r.setup(4, [(None, (-18, 0, 0)),
-                    (None, (-8, 0, -20)),
-                    (None, (-15, 0, 15)),
-                    (None, (0, 0, 10)),
-                    (None, (0, 0, -25)),
-                    (None, (10, 0, 10)),
-                    (None, (10, 0, 10)),
-                    (None, (15, 0, -10))
-                    ])
-        r.ropeNode.setThickness(10)
-        r.setPos(0, 55, 0)
-        r.reparentTo(camera)
-
-        self.curve = r.ropeNode.getCurve()
-        self.curvePoints = r.getPoints(50)
-        print(self.curvePoints)
+        # the marks and the land never move, so they are drawn together in one
+        # batch from a single texture atlas, and need no texture of their own;
+        # the background is left on its own as it is opaque and bigger than all
+        # of them together
+        sprites = []
+        images = []
+        for item in self.course.marks + self.course.obstacles:
+            sprite = self.showbaseMain.loadObject(scale=item.get("scale", 1), depth=50)
+            sprite.setPos(item["x"], 50, item["z"])
+            sprite.setR(item.get("rotation", 0))
+            sprites.append(sprite)
+            images.append(self.showbaseMain.assets.texturePath(item["image"]))
+
+        self.staticLayer = StaticLayer()
+        self.staticLayer.build(camera, sprites, images)
+
+        # the white line that is the sailing course the user must follow,
+        # drawn through the compiled course's evenly spaced points
+        line = LineSegs("course")
+        line.setThickness(10)
+        first = self.course.arcPoints[0]
+        line.moveTo(first.x, 0, first.z)
+        for point in self.course.arcPoints[1:]:
+            line.drawTo(point.x, 0, point.z)
+        self.courseLine = camera.attachNewNode(line.create())
+        self.courseLine.setPos(0, 55, 0)
+
+        self.curvePoints = self.course.pathPoints
+        # compiled with the course, the ship is scored against this every frame
+        self.courseIndex = self.course.index
+
+    # the suggested line from router.py, drawn in over the course line; points
+    # holds (time, x, z) along it, and an empty list takes it away
+    def drawRoute(self, points):
+        if self.routeLine is not None:
+            self.routeLine.removeNode()
+            self.routeLine = None
+        if not points:
+            return
+        line = LineSegs("route")
+        line.setThickness(4)
+        line.setColor(1, .8, 0, 1)
+        line.moveTo(points[0][1], 0, points[0][2])
+        for t, x, z in points[1:]:
+            line.drawTo(x, 0, z)
+        self.routeLine = camera.attachNewNode(line.create())
+        self.routeLine.setPos(0, 54, 0)
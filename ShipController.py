@@ -1,30 +1,30 @@
-from pandac.PandaModules import *
-from math import sin, cos, pi, sqrt
+from panda3d.core import *
 import sys
 from sail import Sail
-from math import radians
+from shipmodel import ShipModel, ShipState, SCREEN_X, SCREEN_Y, TURN_RATE, SHIP_SCALE
 
-MAX_VEL = 10  # Maximum ship velocity in units/sec
-MAX_VEL_SQ = MAX_VEL ** 2  # Square of the ship velocity
-DEG_TO_RAD = pi / 180  # translates degrees to radians for sin and cos
-SCREEN_X = 20  # Screen goes from -20 to 20 on X
-SCREEN_Y = 15  # Screen goes from -15 to 15 on Y
-TURN_RATE = 360  # Degrees ship can turn in 1 second
-ACCELERATION = 10  # Ship acceleration in units/sec/sec
+SHIP_DEPTH = 50  # the ship sails at the same depth as the buoys
 
 
 class ShipController:
 
     def __init__(self, showbaseMain):
-        self.sailBoat = Sail()
+        # the sail model steps at the same fixed rate as the game's physics clock
+        self.sailBoat = Sail(stepRate=showbaseMain.physicsClock.stepRate)
         self.showbaseMain = showbaseMain
+        self.profiler = showbaseMain.profiler
+        self.state = ShipState()
+        self.previous = self.state.renderState()
+        self.model = None
+        self.steps = 0
+        # a recorder.RunRecorder that each physics step is written to, if any
+        self.recorder = None
         self.setupShipSprites()
         self.setupKeys()
 
     def setupShipSprites(self):
-        # Load the ship and set its initial velocity.
-        self.ship = self.showbaseMain.loadObject("sailing_ship.png", scale=3)
-        self.setVelocity(self.ship, LVector3.zero())
+        # Load the ship
+        self.ship = self.showbaseMain.loadObject("sailing_ship.png", scale=SHIP_SCALE)
 
         # creates an empty sin-graph object
         # the sail holder allows the sail to be slightly off set from the middle
@@ -70,106 +70,68 @@ class ShipController:
         self.showbaseMain.accept("r", self.setKey, ["main_sheet_right", 1])
         self.showbaseMain.accept("r-up", self.setKey, ["main_sheet_right", 0])
 
-    def getDistanceToLine(self, pos, pathPoints):
-        smallestDist = 1000000000000
-
-        for pt in pathPoints:
-            dist = sqrt(((pt.x - pos.x) ** 2.0) + ((pt.z - pos.z) ** 2.0))
-            if dist < smallestDist:
-                smallestDist = dist
-
-        return smallestDist
-
-    def nearLastPoint(self, pos, pathPoints):
-        lastPt = pathPoints[len(pathPoints) - 1]
-        dist = sqrt(abs(((lastPt.x - pos.x) ** 2.0) + ((lastPt.z - pos.z) ** 2.0)))
-        return dist
+    # Puts the ship back on the course's start line for a new race
+    def reset(self, score):
+        x, z, heading = self.showbaseMain.scene.course.start
+        self.state = ShipState(x, z, heading, score=score)
+        self.previous = self.state.renderState()
+        self.steps = 0
+        self.render(1.0)
 
     # As described earlier, this simply sets a key in the self.keys dictionary
     # to the given value.
     def setKey(self, key, val):
         self.keys[key] = val
 
-    def setVelocity(self, obj, val):
-        obj.setPythonTag("velocity", val)
-
-    def getVelocity(self, obj):
-        return obj.getPythonTag("velocity")
-
-    # Updates the positions of objects
-    def update_pos(self, obj, dt):
-        vel = self.getVelocity(obj)
-        # newpos - SOH this does the maths bit for me
-        newPos = obj.getPos() + (vel * dt)
+    # This runs one fixed physics step of the ship. The movement and scoring
+    # rules live in shipmodel.ShipModel, this reads the controls into it
 
-        # Check if the object is out of bounds. If so, wrap it
-        radius = .5 * obj.getScale().getX()
-        if newPos.getX() - radius > SCREEN_X:
-            newPos.setX(-SCREEN_X)
-        elif newPos.getX() + radius < -SCREEN_X:
-            newPos.setX(SCREEN_X)
-        if newPos.getZ() - radius > SCREEN_Y:
-            newPos.setZ(-SCREEN_Y)
-        elif newPos.getZ() + radius < -SCREEN_Y:
-            newPos.setZ(SCREEN_Y)
-
-        obj.setPos(newPos)
-
-    # This updates the ship's position. This is similar to the general update
-    # but takes into account turn and thrust
-
-    def updateShip(self, dt, pathPoints):
-        heading = self.ship.getR()  # Heading is the roll value for this model
+    def updateShip(self, dt, courseIndex):
+        if self.model is None or self.model.courseIndex is not courseIndex:
+            self.model = ShipModel(courseIndex, self.sailBoat, profiler=self.profiler,
+                                   finishDistance=self.showbaseMain.scene.course.finishRadius,
+                                   windField=self.showbaseMain.windField)
 
+        state = self.state
+        self.previous = state.renderState()
         windHeading = self.showbaseMain.wind_direction.getR()
         windStrength = self.showbaseMain.wind_strength['value']
-        mainSheetLength = self.showbaseMain.main_sheet_length['value']
-
-        pos = self.ship.getPos()
-
-        dist = self.getDistanceToLine(pos, pathPoints)
-
-        self.showbaseMain.score -= (dist * dist)
-
-        if (abs(self.nearLastPoint(pos, pathPoints)) < 1.5):
-            print("****Game finish****" + str(self.nearLastPoint(pos, pathPoints)))
+        state.mainSheetLength = self.showbaseMain.main_sheet_length['value']
+        self.profiler.mark("input")
+
+        self.model.step(state, dt, windStrength, windHeading)
+        if self.recorder is not None:
+            self.recorder.record(self.steps, self.steps * dt, state, self.sailBoat, windStrength, windHeading)
+            self.profiler.mark("record")
+        self.steps += 1
+
+        self.showbaseMain.score = state.score
+        if state.finished:
+            print("****Game finish****" + str(state.distanceToFinish))
             self.showbaseMain.finished = True
 
-        #print("Last: " + str(self.nearLastPoint(pos)))
-
-        [boatVelocity, sailAngle] = self.sailBoat.update((windStrength + .000001) / 1000.0, radians(windHeading),
-                                                         mainSheetLength, radians(heading), pos.x, pos.z)
-        self.sailHolder.setR(sailAngle)
-
-        heading_rad = DEG_TO_RAD * heading
-        # This builds a new velocity vector and adds it to the current one
-        # relative to the camera, the screen in Panda is the XZ plane.
-        # Therefore all of our Y values in our velocities are 0 to signify
-        # no change in that direction.
-        newVel = LVector3(sin(heading_rad), 0, cos(heading_rad)) * boatVelocity * dt
-
-        # newVel += (self.getVelocity(self.ship)*.99)
-        # clips vel to maximum value MAX_VEL_SQ
-        if newVel.lengthSquared() > MAX_VEL_SQ:
-            newVel.normalize()
-            newVel *= MAX_VEL
-        self.setVelocity(self.ship, newVel)
-
-        # self.velocityText.setText("Boat Velocity: " + str(round(newVel.lengthSquared(), 2)))
         # Change heading if left or right is being pressed
         if self.keys["turnRight"]:
-            heading += dt * TURN_RATE
-            self.ship.setR(heading % 360)
+            state.heading = (state.heading + dt * TURN_RATE) % 360
         elif self.keys["turnLeft"]:
-            heading -= dt * TURN_RATE
-            self.ship.setR(heading % 360)
+            state.heading = (state.heading - dt * TURN_RATE) % 360
 
         if self.keys["main_sheet_left"]:
-            mainSheetLength -= dt * 10
-            self.showbaseMain.main_sheet_length['value'] = mainSheetLength
+            self.showbaseMain.main_sheet_length['value'] = state.mainSheetLength - dt * 10
         elif self.keys["main_sheet_right"]:
-            mainSheetLength += dt * 10
-            self.showbaseMain.main_sheet_length['value'] = mainSheetLength
-
-        # Finally, update the position as with any other object
-        self.update_pos(self.ship, dt)
+            self.showbaseMain.main_sheet_length['value'] = state.mainSheetLength + dt * 10
+        self.profiler.mark("input")
+
+    # Moves the sprites to where the ship is between the last two physics steps;
+    # alpha is how far through that step the rendered frame is (0..1)
+    def render(self, alpha):
+        x0, z0, heading0, sail0 = self.previous
+        x1, z1, heading1, sail1 = self.state.renderState()
+
+        # a ship that wrapped round the screen edge jumps rather than sliding back across
+        if abs(x1 - x0) > SCREEN_X or abs(z1 - z0) > SCREEN_Y:
+            alpha = 1.0
+
+        self.ship.setPos(x0 + (x1 - x0) * alpha, SHIP_DEPTH, z0 + (z1 - z0) * alpha)
+        self.ship.setR(heading0 + (((heading1 - heading0 + 180) % 360) - 180) * alpha)
+        self.sailHolder.setR(sail0 + (((sail1 - sail0 + 180) % 360) - 180) * alpha)
@@ -0,0 +1,176 @@
+# StaticLayer - draws every sprite that never moves in a single batch
+# The sprites' images are packed into one atlas texture, each sprite's
+# texture coordinates are moved onto its part of the atlas, and the sprites
+# are flattened together, so that the buoys, land and flag all share one
+# render state and one Geom: one draw call instead of one per sprite. The
+# atlas is cached on disk, so the images themselves are only read when one
+# of them changes.
+import hashlib
+import json
+import os
+
+from panda3d.core import Filename, NodePath, PNMImage, SamplerState, Texture, TextureStage
+
+ATLAS_VERSION = 1  # bump this when the packing changes
+ATLAS_PADDING = 2  # pixels between packed images; half is filled with the edge pixels
+ATLAS_MAX_SPRITE = 512  # bigger images are scaled down to fit this once padded
+ATLAS_MAX_SIZE = 4096
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+
+def nextPowerOfTwo(n):
+    size = 1
+    while size < n:
+        size *= 2
+    return size
+
+
+# shelf packing: the images, tallest first, are placed left to right in rows.
+# Returns the atlas width and height and an (x, y) per image, in pixels from
+# the top left as PNMImage counts them
+def packImages(sizes, padding=ATLAS_PADDING, width=None):
+    if width is None:
+        # every power of two wide enough is tried, keeping the smallest atlas
+        width = nextPowerOfTwo(max(w + padding for w, h in sizes))
+        best = packImages(sizes, padding, width)
+        while width < ATLAS_MAX_SIZE:
+            width *= 2
+            packed = packImages(sizes, padding, width)
+            if (packed[0] * packed[1], max(packed[:2])) < (best[0] * best[1], max(best[:2])):
+                best = packed
+        return best
+
+    order = sorted(range(len(sizes)), key=lambda i: -sizes[i][1])
+    places = [None] * len(sizes)
+    x = y = rowHeight = 0
+    for i in order:
+        w, h = sizes[i]
+        if x + w + padding > width:
+            x, y, rowHeight = 0, y + rowHeight, 0
+        places[i] = (x + padding // 2, y + padding // 2)
+        x += w + padding
+        rowHeight = max(rowHeight, h + padding)
+    return width, nextPowerOfTwo(y + rowHeight), places
+
+
+class StaticLayer:
+
+    # a built atlas is kept in cacheDir, unless that is None, and used again
+    # until one of its images changes
+    def __init__(self, maxSprite=ATLAS_MAX_SPRITE, padding=ATLAS_PADDING, cacheDir=CACHE_DIR):
+        self.maxSprite = maxSprite
+        self.padding = padding
+        self.cacheDir = cacheDir
+        self.atlas = None
+        self.node = None
+
+    def loadImage(self, path):
+        image = PNMImage(path)
+        if not image.hasAlpha():
+            image.addAlpha()
+            image.alphaFill(1)
+        biggest = max(image.getXSize(), image.getYSize())
+        if biggest + self.padding > self.maxSprite:
+            scale = (self.maxSprite - self.padding) / float(biggest)
+            small = PNMImage(max(1, int(image.getXSize() * scale)), max(1, int(image.getYSize() * scale)), 4)
+            small.gaussianFilterFrom(1.0, image)
+            image = small
+        return image
+
+    def cachePath(self, paths):
+        sources = []
+        for path in paths:
+            path = path.toOsSpecific()
+            stat = os.stat(path)
+            sources.append((path, stat.st_size, stat.st_mtime))
+        key = repr((ATLAS_VERSION, self.maxSprite, self.padding, sources)).encode()
+        return os.path.join(self.cacheDir, "atlas_%s" % hashlib.sha1(key).hexdigest()[:12])
+
+    # the atlas and regions from the cache, packing them the first time
+    def cachedAtlas(self, paths):
+        if self.cacheDir is None:
+            return self.buildAtlas(paths)
+
+        path = self.cachePath(paths)
+        if os.path.exists(path + ".json"):
+            with open(path + ".json") as f:
+                regions = [tuple(region) for region in json.load(f)]
+            # a .txo is Panda's own texture format, which loads without decoding
+            atlas = Texture("staticAtlas")
+            atlas.read(Filename.fromOsSpecific(path + ".txo"))
+            return self.setSampling(atlas), regions
+
+        atlas, regions = self.buildAtlas(paths)
+        os.makedirs(self.cacheDir, exist_ok=True)
+        # the regions are written last, so the image is complete whenever they exist
+        atlas.write(Filename.fromOsSpecific(path + ".txo"))
+        with open(path + ".json.tmp", "w") as f:
+            json.dump(regions, f)
+        os.replace(path + ".json.tmp", path + ".json")
+        return atlas, regions
+
+    def setSampling(self, atlas):
+        atlas.setWrapU(SamplerState.WM_clamp)
+        atlas.setWrapV(SamplerState.WM_clamp)
+        atlas.setMinfilter(SamplerState.FT_linear)
+        atlas.setMagfilter(SamplerState.FT_linear)
+        return atlas
+
+    # packs the image files into one atlas and returns it along with each
+    # image's (u offset, v offset, u scale, v scale) within it
+    def buildAtlas(self, paths):
+        images = [self.loadImage(path) for path in paths]
+        width, height, places = packImages([(image.getXSize(), image.getYSize()) for image in images],
+                                           self.padding)
+        if max(width, height) > ATLAS_MAX_SIZE:
+            raise ValueError("static sprites need a %dx%d atlas, more than %d" % (width, height, ATLAS_MAX_SIZE))
+
+        atlasImage = PNMImage(width, height, 4)
+        regions = []
+        for image, (x, y) in zip(images, places):
+            w, h = image.getXSize(), image.getYSize()
+            atlasImage.copySubImage(image, x, y)
+            # its edge pixels are repeated one pixel out, so filtering at the
+            # edges blends with the image itself and not with its neighbour
+            atlasImage.copySubImage(image, x - 1, y, 0, 0, 1, h)
+            atlasImage.copySubImage(image, x + w, y, w - 1, 0, 1, h)
+            atlasImage.copySubImage(atlasImage, x - 1, y - 1, x - 1, y, w + 2, 1)
+            atlasImage.copySubImage(atlasImage, x - 1, y + h, x - 1, y + h - 1, w + 2, 1)
+            # texture v runs up from the bottom row of the image
+            regions.append((x / float(width), (height - y - h) / float(height), w / float(width), h / float(height)))
+
+        atlas = Texture("staticAtlas")
+        atlas.load(atlasImage)
+        return self.setSampling(atlas), regions
+
+    # replaces the sprites, which must all share a render state, with one
+    # flattened node under parent, and returns it. imagePaths holds the
+    # Filename of each sprite's image; the sprites need no texture of their own
+    def build(self, parent, sprites, imagePaths):
+        paths = []
+        for path in imagePaths:
+            if path not in paths:
+                paths.append(path)
+        self.atlas, regions = self.cachedAtlas(paths)
+
+        self.node = NodePath("staticLayer")
+        self.node.reparentTo(parent)
+        stage = TextureStage.getDefault()
+        for sprite, path in zip(sprites, imagePaths):
+            u, v, su, sv = regions[paths.index(path)]
+            copy = sprite.copyTo(self.node)
+            # the model's root node would otherwise stop the copies merging
+            copy.clearModelNodes()
+            copy.setTexture(self.atlas, 1)
+            copy.setTexOffset(stage, u, v)
+            copy.setTexScale(stage, su, sv)
+            sprite.removeNode()
+
+        # flattening bakes each copy's transform into its vertices and its
+        # texture transform into its texture coordinates, after which every
+        # copy has the same state and they are merged together
+        self.node.flattenStrong()
+        return self.node
+
+    def countGeoms(self):
+        return sum(geomNode.node().getNumGeoms() for geomNode in self.node.findAllMatches("**/+GeomNode"))
@@ -0,0 +1,174 @@
+# Lookup tables for the sail's drag and lift coefficients
+# The table is a grid over attack angle (0 to pi) and apparent wind speed, built
+# once from Sail.getFluidCoefs (or from measured data), saved to disk and then
+# sampled by bilinear interpolation instead of evaluating the polynomials.
+# Usage: python aerotable.py [--attack-steps 1024] [--speed-steps 16] [--max-speed 0.2]
+import argparse
+import hashlib
+import os
+
+import numpy as np
+
+from sail import Sail, PI
+
+TABLE_VERSION = 1  # bump this when the analytic curves in Sail change
+DEFAULT_ATTACK_STEPS = 1024
+DEFAULT_SPEED_STEPS = 16
+DEFAULT_MAX_SPEED = 0.2  # the wind slider tops out at an apparent speed of about 0.1
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+
+class AeroTable:
+
+    def __init__(self, dragCoef, liftCoef, maxSpeed=DEFAULT_MAX_SPEED):
+        # dragCoef and liftCoef are [attack, speed] grids, evenly spaced over
+        # 0..pi and 0..maxSpeed
+        self.dragCoef = np.ascontiguousarray(dragCoef, dtype=float)
+        self.liftCoef = np.ascontiguousarray(liftCoef, dtype=float)
+        if self.dragCoef.shape != self.liftCoef.shape or min(self.dragCoef.shape) < 2:
+            raise ValueError("drag and lift tables must have the same shape, with at least 2x2 points")
+
+        self.attackSteps, self.speedSteps = self.dragCoef.shape
+        self.maxSpeed = float(maxSpeed)
+        self.attackScale = (self.attackSteps - 1) / PI
+        self.speedScale = (self.speedSteps - 1) / self.maxSpeed
+
+        # plain lists are much quicker than NumPy for one value at a time
+        self._drag = self.dragCoef.tolist()
+        self._lift = self.liftCoef.tolist()
+
+    @classmethod
+    def build(cls, attackSteps=DEFAULT_ATTACK_STEPS, speedSteps=DEFAULT_SPEED_STEPS,
+              maxSpeed=DEFAULT_MAX_SPEED):
+        # samples the analytic curves; they do not depend on speed, so every speed
+        # column is the same
+        sail = Sail()
+        drag = np.empty((attackSteps, speedSteps))
+        lift = np.empty((attackSteps, speedSteps))
+        for i, attack in enumerate(np.linspace(0, PI, attackSteps)):
+            drag[i, :], lift[i, :] = sail.getFluidCoefs(float(attack))
+        return cls(drag, lift, maxSpeed)
+
+    @classmethod
+    def fromMeasured(cls, attackAngles, speeds, dragCoef, liftCoef,
+                     attackSteps=DEFAULT_ATTACK_STEPS, speedSteps=DEFAULT_SPEED_STEPS):
+        # resamples measured [attack, speed] coefficients (on any increasing
+        # grid) onto the evenly spaced grid used for lookups
+        attackAngles = np.asarray(attackAngles, dtype=float)
+        speeds = np.asarray(speeds, dtype=float)
+        dragCoef = np.asarray(dragCoef, dtype=float).reshape(len(attackAngles), len(speeds))
+        liftCoef = np.asarray(liftCoef, dtype=float).reshape(len(attackAngles), len(speeds))
+        maxSpeed = speeds[-1] if len(speeds) > 1 else DEFAULT_MAX_SPEED
+
+        attackGrid = np.linspace(0, PI, attackSteps)
+        speedGrid = np.linspace(0, maxSpeed, speedSteps)
+        tables = []
+        for measured in (dragCoef, liftCoef):
+            alongAttack = np.array([np.interp(attackGrid, attackAngles, measured[:, j])
+                                    for j in range(len(speeds))]).T
+            if len(speeds) == 1:
+                tables.append(np.repeat(alongAttack, speedSteps, axis=1))
+            else:
+                tables.append(np.array([np.interp(speedGrid, speeds, row) for row in alongAttack]))
+        return cls(tables[0], tables[1], maxSpeed)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["dragCoef"], data["liftCoef"], float(data["maxSpeed"]))
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # written beside the target first so a reader never sees half a file
+        tmpPath = path + ".tmp.npz"
+        np.savez(tmpPath, dragCoef=self.dragCoef, liftCoef=self.liftCoef, maxSpeed=self.maxSpeed)
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def cached(cls, attackSteps=DEFAULT_ATTACK_STEPS, speedSteps=DEFAULT_SPEED_STEPS,
+               maxSpeed=DEFAULT_MAX_SPEED, cacheDir=CACHE_DIR):
+        # loads the analytic table from the cache, building it the first time
+        key = repr((TABLE_VERSION, attackSteps, speedSteps, float(maxSpeed))).encode()
+        path = os.path.join(cacheDir, "aero_%dx%d_%s.npz" % (attackSteps, speedSteps,
+                                                             hashlib.sha1(key).hexdigest()[:12]))
+        if os.path.exists(path):
+            return cls.load(path)
+
+        table = cls.build(attackSteps, speedSteps, maxSpeed)
+        table.save(path)
+        return table
+
+    # one attack angle (radians, 0..pi) and apparent wind speed at a time
+    def coefs(self, attack, speed=0.0):
+        a = attack * self.attackScale
+        if a < 0:
+            a = 0.0
+        elif a > self.attackSteps - 1:
+            a = self.attackSteps - 1.0
+        s = speed * self.speedScale
+        if s < 0:
+            s = 0.0
+        elif s > self.speedSteps - 1:
+            s = self.speedSteps - 1.0
+        i = min(int(a), self.attackSteps - 2)
+        j = min(int(s), self.speedSteps - 2)
+        fa = a - i
+        fs = s - j
+
+        result = []
+        for table in (self._drag, self._lift):
+            row0 = table[i]
+            row1 = table[i + 1]
+            low = row0[j] + (row1[j] - row0[j]) * fa
+            high = row0[j + 1] + (row1[j + 1] - row0[j + 1]) * fa
+            result.append(low + (high - low) * fs)
+        return result
+
+    # the same lookup for whole arrays of attack angles and speeds
+    def coefsBatch(self, attack, speed=0.0):
+        a = np.clip(np.asarray(attack, dtype=float) * self.attackScale, 0.0, self.attackSteps - 1.0)
+        s = np.clip(np.asarray(speed, dtype=float) * self.speedScale, 0.0, self.speedSteps - 1.0)
+        a, s = np.broadcast_arrays(a, s)
+        i = np.minimum(a.astype(int), self.attackSteps - 2)
+        j = np.minimum(s.astype(int), self.speedSteps - 2)
+        fa = a - i
+        fs = s - j
+
+        result = []
+        for table in (self.dragCoef, self.liftCoef):
+            low = table[i, j] + (table[i + 1, j] - table[i, j]) * fa
+            high = table[i, j + 1] + (table[i + 1, j + 1] - table[i, j + 1]) * fa
+            result.append(low + (high - low) * fs)
+        return result
+
+    # the largest difference from the analytic curves, checked half way
+    # between the grid points where interpolation is worst
+    def maxError(self, samples=4096):
+        sail = Sail()
+        attacks = (np.arange(samples) + .5) * (PI / samples)
+        speeds = (np.arange(self.speedSteps - 1) + .5) * (self.maxSpeed / (self.speedSteps - 1))
+        attackGrid, speedGrid = np.meshgrid(attacks, speeds, indexing="ij")
+        drag, lift = self.coefsBatch(attackGrid, speedGrid)
+
+        exact = np.array([sail.getFluidCoefs(float(attack)) for attack in attacks])
+        return {"dragCoef": float(np.abs(drag - exact[:, :1]).max()),
+                "liftCoef": float(np.abs(lift - exact[:, 1:]).max())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the cached drag and lift lookup table")
+    parser.add_argument("--attack-steps", type=int, default=DEFAULT_ATTACK_STEPS)
+    parser.add_argument("--speed-steps", type=int, default=DEFAULT_SPEED_STEPS)
+    parser.add_argument("--max-speed", type=float, default=DEFAULT_MAX_SPEED)
+    args = parser.parse_args(argv)
+
+    table = AeroTable.cached(args.attack_steps, args.speed_steps, args.max_speed)
+    errors = table.maxError()
+    print("table %dx%d, max error: drag %.3g, lift %.3g" % (table.attackSteps, table.speedSteps,
+                                                            errors["dragCoef"], errors["liftCoef"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# Benchmarks for the physics, scoring and game loop hot paths
+# Each benchmark is timed several times and the fastest repeat is kept, as the
+# slower ones only measure interference from the rest of the machine.
+# Usage: python benchmark.py [--output bench.json] [--baseline old.json] [--threshold 0.1] [--filter sail]
+import argparse
+import json
+import platform
+import sys
+import time
+from math import radians
+
+from course import CourseIndex, CoursePoint, DEFAULT_COURSE, getDistanceToLine, sampleCurve
+from headless import HeadlessSimulator
+from sail import Sail, stepBoat
+
+DEFAULT_REPEAT = 5
+DEFAULT_MIN_TIME = .2  # seconds each repeat should take at least
+DEFAULT_THRESHOLD = .1  # fractional slow-down that counts as a regression
+COURSE_SIZES = (50, 500, 5000, 50000)
+BATCH_SIZE = 1000
+FLEET_SIZE = 200
+FLEET_STEPS = 1200  # 20 seconds of race time
+SERVER_PLAYERS = 64
+
+# typical in-game inputs: wind slider at 12, arrow at 90 degrees, sheet 10, heading 170
+WIND_VELOCITY = (12 + .000001) / 1000.0
+WIND_ANGLE = radians(90)
+MAIN_SHEET = 10
+BOAT_ANGLE = radians(170)
+
+BENCHMARKS = []
+
+
+def benchmark(name, opsPerCall=1):
+    # registers a setup function that returns the function to time; each call
+    # of that function counts as opsPerCall operations
+    def register(setup):
+        BENCHMARKS.append((name, setup, opsPerCall))
+        return setup
+    return register
+
+
+def warmSail():
+    sail = Sail()
+    for _ in range(600):
+        sail.update(WIND_VELOCITY, WIND_ANGLE, MAIN_SHEET, BOAT_ANGLE, 0, 0)
+    return sail
+
+
+@benchmark("sail.update")
+def benchSailUpdate():
+    sail = warmSail()
+    return lambda: sail.update(WIND_VELOCITY, WIND_ANGLE, MAIN_SHEET, BOAT_ANGLE, 0, 0)
+
+
+@benchmark("sail.stepBoat")
+def benchStepBoat():
+    sail = warmSail()
+    state, constants = sail.state, sail.constants
+    return lambda: stepBoat(state, constants, WIND_VELOCITY, WIND_ANGLE, MAIN_SHEET, BOAT_ANGLE)
+
+
+@benchmark("sail.getAppVector")
+def benchAppVector():
+    sail = warmSail()
+    return lambda: sail.getAppVector(sail.boatVelocity, BOAT_ANGLE, WIND_VELOCITY, WIND_ANGLE)
+
+
+@benchmark("sail.rotateMainsail")
+def benchRotateMainsail():
+    sail = warmSail()
+    appVelocity, appAngle = sail.getAppVector(sail.boatVelocity, BOAT_ANGLE, WIND_VELOCITY, WIND_ANGLE)
+    return lambda: sail.rotateMainsail(appAngle, appVelocity, BOAT_ANGLE, sail.mainAngle, sail.mainLength, MAIN_SHEET)
+
+
+@benchmark("sail.getFluidCoefs")
+def benchFluidCoefs():
+    sail = warmSail()
+    return lambda: sail.getFluidCoefs(1.2)
+
+
+@benchmark("sail.getForces")
+def benchForces():
+    sail = warmSail()
+    appVelocity, appAngle = sail.getAppVector(sail.boatVelocity, BOAT_ANGLE, WIND_VELOCITY, WIND_ANGLE)
+    dragCoef, liftCoef = sail.getFluidCoefs(1.2)
+    return lambda: sail.getForces(False, appAngle, BOAT_ANGLE, dragCoef, liftCoef,
+                                  sail.mainArea, sail.sealvlAirDens, appVelocity)
+
+
+@benchmark("sail.limitMainsail")
+def benchLimitMainsail():
+    sail = warmSail()
+    return lambda: sail.limitMainsail(MAIN_SHEET, 1.0)
+
+
+@benchmark("sailbatch.update[%d]" % BATCH_SIZE, opsPerCall=BATCH_SIZE)
+def benchSailBatch():
+    import numpy as np
+    from sailbatch import SailBatch
+    batch = SailBatch(BATCH_SIZE)
+    boatAngles = np.linspace(0, 2 * np.pi, BATCH_SIZE)
+    return lambda: batch.update(WIND_VELOCITY, WIND_ANGLE, MAIN_SHEET, boatAngles)
+
+
+@benchmark("windfield.sample")
+def benchWindField():
+    from windfield import WindField
+    field = WindField()
+    return lambda: field.sample(1.5, -2.5, 10.0, 12, 90)
+
+
+@benchmark("windfield.sampleBatch[%d]" % BATCH_SIZE, opsPerCall=BATCH_SIZE)
+def benchWindFieldBatch():
+    import numpy as np
+    from windfield import WindField
+    field = WindField()
+    rng = np.random.default_rng(0)
+    xs = rng.uniform(-20, 20, BATCH_SIZE)
+    zs = rng.uniform(-15, 15, BATCH_SIZE)
+    return lambda: field.sampleBatch(xs, zs, 10.0, 12, 90)
+
+
+@benchmark("vecenv.step[%d]" % BATCH_SIZE, opsPerCall=BATCH_SIZE)
+def benchBatchEnv():
+    import numpy as np
+    from vecenv import BatchEnv
+    env = BatchEnv(BATCH_SIZE)
+    env.reset()
+    env.actions[:] = np.random.default_rng(0).uniform(-5, 5, env.actions.shape)
+    return env.step
+
+
+@benchmark("fleet.step[%d]" % FLEET_SIZE, opsPerCall=FLEET_SIZE)
+def benchFleet():
+    from coursefile import loadCourse
+    from fleet import Fleet, CourseFollower
+    fleet = Fleet(loadCourse(), FLEET_SIZE)
+    driver = CourseFollower(fleet)
+
+    # the first seconds of the race over and over, before the leaders finish
+    def step():
+        if fleet.steps >= FLEET_STEPS:
+            fleet.reset()
+            driver.reset()
+        driver.drive(fleet)
+        fleet.step()
+    return step
+
+
+@benchmark("raceserver.tick[%d]" % SERVER_PLAYERS)
+def benchRaceServer():
+    import numpy as np
+    from coursefile import loadCourse
+    from raceserver import RaceServer
+    server = RaceServer(loadCourse(), SERVER_PLAYERS)
+    rng = np.random.default_rng(0)
+    turn = rng.integers(-1, 2, SERVER_PLAYERS)
+    sheet = rng.integers(-1, 2, SERVER_PLAYERS)
+    server.simulate([("join", boat) for boat in range(SERVER_PLAYERS)], turn, sheet, {})
+
+    # every player a delta from the tick before, as on a quiet network
+    def tick():
+        acks = dict.fromkeys(range(SERVER_PLAYERS), server.tick)
+        server.simulate([], turn, sheet, acks)
+    return tick
+
+
+@benchmark("router.route")
+def benchRouter():
+    from coursefile import loadCourse
+    from router import Router
+    router = Router(loadCourse())
+    return router.route
+
+
+def coursePositions(pathPoints, count=256):
+    # positions near the course, visited in order as a sailing boat would
+    positions = []
+    for i in range(count):
+        pt = pathPoints[i * (len(pathPoints) - 1) // (count - 1)]
+        positions.append(CoursePoint(pt.x + 1.5, 0, pt.z - 1.0))
+    return positions
+
+
+def benchCourse(size, indexed):
+    def setup():
+        pathPoints = sampleCurve(DEFAULT_COURSE, size)
+        positions = coursePositions(pathPoints)
+        if indexed:
+            courseIndex = CourseIndex(pathPoints)
+            query = courseIndex.distance
+        else:
+            query = lambda pos: getDistanceToLine(pos, pathPoints)
+        state = {"i": 0}
+
+        def run():
+            i = state["i"]
+            query(positions[i])
+            state["i"] = (i + 1) % len(positions)
+        return run
+    return setup
+
+
+for size in COURSE_SIZES:
+    benchmark("course.CourseIndex.distance[%d]" % size)(benchCourse(size, True))
+    if size <= 5000:
+        # the old scan over every point, for comparison
+        benchmark("course.getDistanceToLine[%d]" % size)(benchCourse(size, False))
+
+
+@benchmark("headless.frame")
+def benchFrame():
+    # one game loop frame without rendering: input, physics, scoring, movement
+    sim = HeadlessSimulator()
+
+    def frame():
+        if sim.step(heading=170, mainSheetLength=MAIN_SHEET):
+            sim.reset()
+    return frame
+
+
+def timeBenchmark(setup, opsPerCall, repeat=DEFAULT_REPEAT, minTime=DEFAULT_MIN_TIME):
+    run = setup()
+
+    # find a call count that takes at least minTime
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= minTime:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(minTime / elapsed * 1.2))
+
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        best = min(best, time.perf_counter() - start)
+
+    ops = number * opsPerCall
+    return {"opsPerSec": ops / best, "nsPerOp": best / ops * 1e9, "calls": number}
+
+
+def runBenchmarks(nameFilter=None, repeat=DEFAULT_REPEAT, minTime=DEFAULT_MIN_TIME, log=None):
+    results = {}
+    for name, setup, opsPerCall in BENCHMARKS:
+        if nameFilter and nameFilter not in name:
+            continue
+        results[name] = timeBenchmark(setup, opsPerCall, repeat, minTime)
+        if log is not None:
+            log("%-40s %12.0f ops/s %10.0f ns/op" % (name, results[name]["opsPerSec"], results[name]["nsPerOp"]))
+
+    return {"meta": {"python": sys.version.split()[0], "platform": platform.platform(),
+                     "machine": platform.machine(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "repeat": repeat, "minTime": minTime},
+            "results": results}
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    # returns (name, baseline ns/op, current ns/op, change) for every benchmark
+    # that got slower by more than threshold
+    regressions = []
+    for name, result in report["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            continue
+        change = result["nsPerOp"] / old["nsPerOp"] - 1
+        if change > threshold:
+            regressions.append((name, old["nsPerOp"], result["nsPerOp"], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulator's hot paths")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slow-down (0.1 = 10%%) that counts as a regression")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME)
+    args = parser.parse_args(argv)
+
+    report = runBenchmarks(args.filter, args.repeat, args.min_time, log=print)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for name, old, new, change in regressions:
+            print("REGRESSION %s: %.0f -> %.0f ns/op (+%.0f%%)" % (name, old, new, change * 100))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+# Course geometry - the line the user must follow, without needing Panda3D
+from collections import namedtuple
+from math import sqrt
+
+# a sampled point on the course; like Panda's Point3 the screen is the XZ plane
+CoursePoint = namedtuple("CoursePoint", ["x", "y", "z"])
+
+# control points of the 'rope' drawn in Scene.setup
+DEFAULT_COURSE = [(-18, 0, 0),
+                  (-8, 0, -20),
+                  (-15, 0, 15),
+                  (0, 0, 10),
+                  (0, 0, -25),
+                  (10, 0, 10),
+                  (10, 0, 10),
+                  (15, 0, -10)]
+CURVE_ORDER = 4
+CURVE_SAMPLES = 50
+
+
+def getKnots(numVerts, order=CURVE_ORDER):
+    # the same default knot string as Panda's Rope: the first and last
+    # 'order' knots are equal and the ones in between go up by 1
+    knots = []
+    for i in range(numVerts + order):
+        knots.append(float(min(max(i - order + 1, 0), numVerts - order + 1)))
+    return knots
+
+
+def evalCurve(controlPoints, knots, order, t):
+    # de Boor's algorithm for one parameter value
+    span = order - 1
+    while span < len(controlPoints) - 1 and t >= knots[span + 1]:
+        span += 1
+
+    d = [list(controlPoints[j + span - order + 1]) for j in range(order)]
+    for r in range(1, order):
+        for j in range(order - 1, r - 1, -1):
+            i = j + span - order + 1
+            denom = knots[i + order - r] - knots[i]
+            alpha = 0 if denom == 0 else (t - knots[i]) / denom
+            d[j] = [(1 - alpha) * a + alpha * b for a, b in zip(d[j - 1], d[j])]
+    return d[order - 1]
+
+
+def sampleCurve(controlPoints=DEFAULT_COURSE, numPoints=CURVE_SAMPLES, order=CURVE_ORDER):
+    # points evenly spread in parametric space, the same as Rope.getPoints
+    knots = getKnots(len(controlPoints), order)
+    startT = knots[order - 1]
+    sizeT = knots[len(controlPoints)] - startT
+
+    points = []
+    for i in range(numPoints):
+        x, y, z = evalCurve(controlPoints, knots, order, sizeT * i / float(numPoints - 1) + startT)
+        points.append(CoursePoint(x, y, z))
+    return points
+
+
+def getDistanceToLine(pos, pathPoints):
+    smallestDist = 1000000000000
+
+    for pt in pathPoints:
+        dist = sqrt(((pt.x - pos.x) ** 2.0) + ((pt.z - pos.z) ** 2.0))
+        if dist < smallestDist:
+            smallestDist = dist
+
+    return smallestDist
+
+
+LEAF_SEGMENTS = 8  # course segments kept together in each leaf of the CourseIndex tree
+# the lists that make up a CourseIndex, which a compiled course file stores
+# so the tree is not built again every time the course is loaded
+INDEX_FLOAT_TABLES = ("xs", "zs", "dxs", "dzs", "lengthsSq", "minXs", "minZs", "maxXs", "maxZs")
+INDEX_INT_TABLES = ("lefts", "rights", "firsts", "lasts")
+
+
+class CourseIndex:
+
+    # A bounding box tree over runs of consecutive course segments, so the
+    # nearest segment is found by skipping every box that is further away than
+    # the best segment so far, instead of measuring against every course point
+    def __init__(self, pathPoints):
+        self.pathPoints = pathPoints
+        self.xs = [float(pt.x) for pt in pathPoints]
+        self.zs = [float(pt.z) for pt in pathPoints]
+        if len(pathPoints) < 2:
+            # a single point behaves as a segment of zero length
+            self.xs = self.xs * 2
+            self.zs = self.zs * 2
+        self.segmentCount = len(self.xs) - 1
+
+        # start, direction and squared length of each segment
+        self.dxs = [self.xs[i + 1] - self.xs[i] for i in range(self.segmentCount)]
+        self.dzs = [self.zs[i + 1] - self.zs[i] for i in range(self.segmentCount)]
+        self.lengthsSq = [dx * dx + dz * dz for dx, dz in zip(self.dxs, self.dzs)]
+
+        # node boxes and children; leaves have no children and cover the
+        # segments first..last-1
+        self.minXs = []
+        self.minZs = []
+        self.maxXs = []
+        self.maxZs = []
+        self.lefts = []
+        self.rights = []
+        self.firsts = []
+        self.lasts = []
+        self.buildNode(0, self.segmentCount)
+
+        # the segment the last distance() call found, a good first guess next frame
+        self.lastSegment = None
+
+    # a CourseIndex from the lists tables() returned, without building anything
+    @classmethod
+    def fromTables(cls, pathPoints, tables):
+        index = cls.__new__(cls)
+        index.pathPoints = pathPoints
+        for name in INDEX_FLOAT_TABLES + INDEX_INT_TABLES:
+            setattr(index, name, list(tables[name]))
+        index.segmentCount = len(index.xs) - 1
+        index.lastSegment = None
+        return index
+
+    def tables(self):
+        return {name: getattr(self, name) for name in INDEX_FLOAT_TABLES + INDEX_INT_TABLES}
+
+    def buildNode(self, first, last):
+        node = len(self.minXs)
+        xs = self.xs[first:last + 1]
+        zs = self.zs[first:last + 1]
+        self.minXs.append(min(xs))
+        self.minZs.append(min(zs))
+        self.maxXs.append(max(xs))
+        self.maxZs.append(max(zs))
+        self.firsts.append(first)
+        self.lasts.append(last)
+        self.lefts.append(-1)
+        self.rights.append(-1)
+
+        if last - first > LEAF_SEGMENTS:
+            middle = (first + last) // 2
+            self.lefts[node] = self.buildNode(first, middle)
+            self.rights[node] = self.buildNode(middle, last)
+        return node
+
+    def segmentDistanceSq(self, i, x, z):
+        px = x - self.xs[i]
+        pz = z - self.zs[i]
+        lengthSq = self.lengthsSq[i]
+        if lengthSq > 0:
+            # project onto the segment, clamped to its ends
+            t = (px * self.dxs[i] + pz * self.dzs[i]) / lengthSq
+            if t > 1:
+                t = 1
+            if t > 0:
+                px -= t * self.dxs[i]
+                pz -= t * self.dzs[i]
+        return px * px + pz * pz
+
+    # returns (segment index, distance) of the segment closest to (x, z);
+    # hint is a segment that is probably close, such as last frame's answer
+    def nearestSegment(self, x, z, hint=None):
+        best = None
+        bestDistSq = float("inf")
+        if hint is not None and 0 <= hint < self.segmentCount:
+            for i in range(max(hint - 1, 0), min(hint + 2, self.segmentCount)):
+                distSq = self.segmentDistanceSq(i, x, z)
+                if distSq < bestDistSq:
+                    best, bestDistSq = i, distSq
+
+        # the loop is written out by hand, it runs every frame
+        xs, zs, dxs, dzs, lengthsSq = self.xs, self.zs, self.dxs, self.dzs, self.lengthsSq
+        minXs, minZs, maxXs, maxZs = self.minXs, self.minZs, self.maxXs, self.maxZs
+        lefts, rights, firsts, lasts = self.lefts, self.rights, self.firsts, self.lasts
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            # distance to the node's box, zero when (x, z) is inside it
+            boxX = minXs[node] - x if x < minXs[node] else (x - maxXs[node] if x > maxXs[node] else 0)
+            boxZ = minZs[node] - z if z < minZs[node] else (z - maxZs[node] if z > maxZs[node] else 0)
+            if boxX * boxX + boxZ * boxZ >= bestDistSq:
+                continue
+
+            left = lefts[node]
+            if left >= 0:
+                # the child nearer the query goes on the stack last so it is searched first
+                right = rights[node]
+                if abs(x - (minXs[left] + maxXs[left]) * .5) + abs(z - (minZs[left] + maxZs[left]) * .5) < \
+                        abs(x - (minXs[right] + maxXs[right]) * .5) + abs(z - (minZs[right] + maxZs[right]) * .5):
+                    stack.append(right)
+                    stack.append(left)
+                else:
+                    stack.append(left)
+                    stack.append(right)
+                continue
+
+            for i in range(firsts[node], lasts[node]):
+                px = x - xs[i]
+                pz = z - zs[i]
+                lengthSq = lengthsSq[i]
+                if lengthSq > 0:
+                    t = (px * dxs[i] + pz * dzs[i]) / lengthSq
+                    if t > 1:
+                        t = 1
+                    if t > 0:
+                        px -= t * dxs[i]
+                        pz -= t * dzs[i]
+                distSq = px * px + pz * pz
+                if distSq < bestDistSq:
+                    best, bestDistSq = i, distSq
+
+        return best, sqrt(bestDistSq)
+
+    # distance from pos (anything with .x and .z) to the course line, using
+    # the segment found last time as the starting guess
+    def distance(self, pos):
+        self.lastSegment, dist = self.nearestSegment(pos.x, pos.z, self.lastSegment)
+        return dist
+
+    def distanceToEnd(self, pos):
+        dx = self.xs[-1] - pos.x
+        dz = self.zs[-1] - pos.z
+        return sqrt(dx * dx + dz * dz)
@@ -0,0 +1,268 @@
+# Course files - races described in JSON and compiled to a binary geometry cache
+# A course file (see courses/default.json) gives the control points of the
+# course curve, the start, the finish, the marks and the obstacles. Compiling
+# it samples the curve the way the game scores it, samples it again densely at
+# even arc-length steps for drawing, works out every segment's direction and
+# length, and builds the CourseIndex tree. The compiled course is stored with
+# a hash of the course's content and loaded from then on, until that changes.
+#
+# Compiled layout: an 8 byte magic string, the version and the metadata length
+# as little-endian uint32s, the 20 byte SHA-1 content hash, the metadata as
+# JSON (the course itself and the name, type and length of each table),
+# padding up to a multiple of 8 bytes, and then each table as little-endian
+# doubles or int32s, padded to 8 bytes.
+# Usage: python coursefile.py courses/*.json [--out compiled/]
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+from array import array
+from math import sqrt
+
+from course import (CourseIndex, CoursePoint, INDEX_FLOAT_TABLES, INDEX_INT_TABLES, CURVE_ORDER, CURVE_SAMPLES,
+                    evalCurve, getKnots, sampleCurve)
+from shipmodel import START_X, START_Z, START_HEADING, FINISH_DISTANCE
+
+MAGIC = b"SAILCRS\0"
+VERSION = 1  # bump this when compiling changes, so old compiled courses are rebuilt
+HEADER = struct.Struct("<8sII20s")
+COMPILED_EXTENSION = ".sailcourse"
+ARC_STEP = .25  # course units between the dense, evenly spaced samples
+ARC_SUBDIVISIONS = 64  # curve evaluations per knot span when measuring arc length
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(PACKAGE_DIR, "cache")
+DEFAULT_COURSE_FILE = os.path.join(PACKAGE_DIR, "courses", "default.json")
+
+
+def contentHash(description, arcStep=ARC_STEP):
+    # the same course gives the same hash however its file is laid out
+    key = json.dumps([VERSION, arcStep, description], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(key.encode()).digest()
+
+
+def controlPoints(description):
+    curve = description.get("curve")
+    if not curve or "controlPoints" not in curve:
+        raise ValueError("a course needs curve.controlPoints")
+    points = [CoursePoint(float(x), 0.0, float(z)) for x, z in curve["controlPoints"]]
+    if len(points) < curve.get("order", CURVE_ORDER):
+        raise ValueError("a curve of order %d needs at least that many control points"
+                         % curve.get("order", CURVE_ORDER))
+    return points
+
+
+def arcSamples(points, order, arcStep):
+    # the curve measured along many small chords, then sampled every arcStep
+    # along that length, with the very end added if it falls between steps
+    knots = getKnots(len(points), order)
+    startT = knots[order - 1]
+    sizeT = knots[len(points)] - startT
+    count = int(sizeT * ARC_SUBDIVISIONS) + 1
+    fine = [evalCurve(points, knots, order, sizeT * i / float(count - 1) + startT) for i in range(count)]
+
+    xs = [fine[0][0]]
+    zs = [fine[0][2]]
+    travelled = 0.0  # arc length up to the start of the current chord
+    target = arcStep
+    for i in range(1, count):
+        x0, z0 = fine[i - 1][0], fine[i - 1][2]
+        dx, dz = fine[i][0] - x0, fine[i][2] - z0
+        length = sqrt(dx * dx + dz * dz)
+        while length > 0 and target <= travelled + length:
+            t = (target - travelled) / length
+            xs.append(x0 + t * dx)
+            zs.append(z0 + t * dz)
+            target += arcStep
+        travelled += length
+    if travelled > target - arcStep:
+        xs.append(fine[-1][0])
+        zs.append(fine[-1][2])
+    return xs, zs
+
+
+def segmentTables(pathPoints):
+    # each segment's length and unit direction, and the distance along the
+    # course to each point
+    lengths, dirXs, dirZs, distances = [], [], [], [0.0]
+    for a, b in zip(pathPoints, pathPoints[1:]):
+        dx, dz = b.x - a.x, b.z - a.z
+        length = sqrt(dx * dx + dz * dz)
+        lengths.append(length)
+        dirXs.append(dx / length if length > 0 else 0.0)
+        dirZs.append(dz / length if length > 0 else 0.0)
+        distances.append(distances[-1] + length)
+    return {"segmentLengths": lengths, "segmentDirXs": dirXs, "segmentDirZs": dirZs, "distances": distances}
+
+
+def compileCourse(description, arcStep=ARC_STEP):
+    # returns the tables a Course is made from, as {name: (typecode, values)}
+    points = controlPoints(description)
+    curve = description["curve"]
+    order = curve.get("order", CURVE_ORDER)
+    pathPoints = sampleCurve(points, curve.get("samples", CURVE_SAMPLES), order)
+
+    tables = {"pathXs": ("d", [pt.x for pt in pathPoints]),
+              "pathZs": ("d", [pt.z for pt in pathPoints])}
+    arcXs, arcZs = arcSamples(points, order, arcStep)
+    tables["arcXs"] = ("d", arcXs)
+    tables["arcZs"] = ("d", arcZs)
+    for name, values in segmentTables(pathPoints).items():
+        tables[name] = ("d", values)
+    indexTables = CourseIndex(pathPoints).tables()
+    for name in INDEX_FLOAT_TABLES:
+        tables["index." + name] = ("d", indexTables[name])
+    for name in INDEX_INT_TABLES:
+        tables["index." + name] = ("i", indexTables[name])
+    return tables
+
+
+class Course:
+
+    def __init__(self, description, tables, hash):
+        self.description = description
+        self.tables = tables  # {name: (array typecode, values)}, as compileCourse makes them
+        self.hash = hash
+        self.name = description.get("name", "")
+        self.controlPoints = controlPoints(description)
+        self.order = description["curve"].get("order", CURVE_ORDER)
+
+        start = description.get("start", {})
+        self.start = (start.get("x", START_X), start.get("z", START_Z), start.get("heading", START_HEADING))
+        self.finishRadius = description.get("finish", {}).get("radius", FINISH_DISTANCE)
+        # each a dict with an image, x, z, scale and optionally a rotation in
+        # degrees; obstacles can also have an outline, a list of [x, z] points
+        self.marks = description.get("marks", [])
+        self.obstacles = description.get("obstacles", [])
+
+        values = {name: value for name, (typecode, value) in tables.items()}
+        # the points the ship is scored against, as the game has always sampled them
+        self.pathPoints = [CoursePoint(x, 0.0, z) for x, z in zip(values["pathXs"], values["pathZs"])]
+        # points evenly spaced along the curve, for drawing it
+        self.arcPoints = [CoursePoint(x, 0.0, z) for x, z in zip(values["arcXs"], values["arcZs"])]
+        self.segmentLengths = values["segmentLengths"]
+        self.segmentDirXs = values["segmentDirXs"]
+        self.segmentDirZs = values["segmentDirZs"]
+        self.distances = values["distances"]
+        self.length = self.distances[-1]
+        self.index = CourseIndex.fromTables(self.pathPoints, {name[len("index."):]: value
+                                                              for name, value in values.items()
+                                                              if name.startswith("index.")})
+
+    @property
+    def hexHash(self):
+        return self.hash.hex()
+
+    @classmethod
+    def compile(cls, description, arcStep=ARC_STEP):
+        return cls(description, compileCourse(description, arcStep), contentHash(description, arcStep))
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tables = []
+        blobs = []
+        for name, (typecode, values) in sorted(self.tables.items()):
+            data = array(typecode, values)
+            if sys.byteorder == "big":
+                data.byteswap()
+            blob = data.tobytes()
+            blobs.append(blob + b"\0" * (-len(blob) % 8))
+            tables.append([name, typecode, len(values)])
+
+        meta = json.dumps({"course": self.description, "tables": tables}).encode()
+        header = HEADER.pack(MAGIC, VERSION, len(meta), self.hash) + meta
+        # written beside the target first so a reader never sees half a file
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "wb") as f:
+            f.write(header + b"\0" * (-len(header) % 8))
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError("%s is not a compiled course" % path)
+        magic, version, metaLength, hash = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("%s is not a compiled course" % path)
+        if version != VERSION:
+            raise ValueError("%s was compiled in an unsupported format (version %d)" % (path, version))
+        meta = json.loads(data[HEADER.size:HEADER.size + metaLength].decode())
+
+        offset = HEADER.size + metaLength
+        offset += -offset % 8
+        tables = {}
+        for name, typecode, count in meta["tables"]:
+            values = array(typecode)
+            end = offset + values.itemsize * count
+            if end > len(data):
+                raise ValueError("%s is cut short" % path)
+            values.frombytes(data[offset:end])
+            if sys.byteorder == "big":
+                values.byteswap()
+            tables[name] = (typecode, values.tolist())
+            offset = end + (-end % 8)
+        return cls(meta["course"], tables, hash)
+
+
+def compiledPath(path, hash, cacheDir=CACHE_DIR):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cacheDir, "course_%s_%s%s" % (name, hash.hex()[:12], COMPILED_EXTENSION))
+
+
+# loads a course from a JSON course file, using its compiled form from
+# cacheDir when the content has not changed and compiling it (and saving that,
+# unless cacheDir is None) when it has; a compiled file is loaded directly
+def loadCourse(path=DEFAULT_COURSE_FILE, cacheDir=CACHE_DIR, arcStep=ARC_STEP):
+    if path.endswith(COMPILED_EXTENSION):
+        return Course.load(path)
+
+    with open(path) as f:
+        description = json.load(f)
+    hash = contentHash(description, arcStep)
+    cachePath = compiledPath(path, hash, cacheDir) if cacheDir is not None else None
+    if cachePath is not None and os.path.exists(cachePath):
+        try:
+            course = Course.load(cachePath)
+            if course.hash == hash:
+                return course
+        except ValueError:
+            pass  # left over from another version, compiled again below
+
+    course = Course.compile(description, arcStep)
+    if cachePath is not None:
+        try:
+            course.save(cachePath)
+        except OSError as error:
+            # a read-only install still runs, it just compiles every time
+            print("Could not cache the compiled course: %s" % error)
+    return course
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile course files to the binary course format")
+    parser.add_argument("courses", nargs="+", help="JSON course files")
+    parser.add_argument("--out", help="folder to write the compiled courses to (default: beside each file)")
+    parser.add_argument("--arc-step", type=float, default=ARC_STEP,
+                        help="distance between the evenly spaced curve samples")
+    args = parser.parse_args(argv)
+
+    for path in args.courses:
+        with open(path) as f:
+            course = Course.compile(json.load(f), args.arc_step)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        outPath = os.path.join(args.out or os.path.dirname(path), stem + COMPILED_EXTENSION)
+        course.save(outPath)
+        print("%s: %d points, %d arc samples, length %.2f, hash %s -> %s"
+              % (path, len(course.pathPoints), len(course.arcPoints), course.length, course.hexHash[:12], outPath))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+# Fleet racing - many boats on one course, each with its own sail state
+# The boats are a vecenv.ShipBatch, so every boat scores, finishes and moves
+# as the game's ship does, and they are stepped together as NumPy arrays.
+# After each step the boats are filed in a uniform grid spatial hash; only
+# the boats that crossed into a new cell are filed again, and only boats in
+# the same or neighbouring cells are measured against each other. Boats that
+# touch are pushed apart, and slowed as they run into each other. The land
+# has its own grid of the cells that reach the coast, and only boats in those
+# are tested against the obstacle outlines; a boat that runs aground goes
+# back to where it was and stops. A boat that finishes stays where it
+# crossed the line.
+#
+# Boats are driven by CourseFollower, an autopilot that sails the best
+# heading towards a point a little way along the course line, or by
+# ReplayDriver, which plays the inputs of a recorded run back.
+# Usage: python fleet.py [--boats 100] [--replay run.sailrun ...] [--max-time 120] [--seed 0]
+import argparse
+import json
+import time
+from math import ceil
+
+import numpy as np
+
+from coursefile import loadCourse, ARC_STEP, DEFAULT_COURSE_FILE
+from headless import DEFAULT_DT, DEFAULT_MAX_TIME, DEFAULT_WIND_STRENGTH, DEFAULT_WIND_HEADING
+from router import headingTable, loadPolar
+from shipmodel import SCREEN_X, SCREEN_Y, TURN_RATE
+from vecenv import ShipBatch, SHEET_MIN
+
+BOAT_RADIUS = .5  # course units; two boats closer than twice this are touching
+CELL_SIZE = 1.0  # of the spatial hash; at least twice BOAT_RADIUS so neighbours are enough
+CONTACT_MARGIN = .25  # boats this much further apart than touching still count as in contact
+COLLISION_SPEED_KEPT = .7  # the part of its speed a boat keeps when it runs into another
+START_SPACING = 1.25  # between boats on the start grid
+START_ROW = 16  # boats side by side in each row of the start grid
+SHOAL_CELL_SIZE = .25  # of the grid the autopilots look ahead for land on
+SHOAL_MARGIN = .25  # and how much further off than BOAT_RADIUS they keep
+LOOKAHEAD = (2.0, 5.0)  # the range the autopilots aim ahead along the course line
+HEADING_JITTER = 3.0  # degrees; each autopilot steers a little differently
+LANE_WIDTH = 6.0  # the autopilots spread this wide across the course line
+LANE_MERGE = 6.0  # and close up onto it over the last this far to the finish
+PROGRESS_WINDOW = 16  # course points a boat can get along in one step
+LAND_PROBES = (.5, 1.0, 1.5)  # headings that would be near land at any of these distances ahead are not sailed
+
+
+class SpatialHash:
+
+    # a uniform grid over the screen; boats off the screen are kept in the
+    # edge cells. The boats are kept sorted by cell, so a cell's boats are a
+    # run in order found by binary search
+    def __init__(self, cellSize=CELL_SIZE):
+        self.cellSize = cellSize
+        self.cols = int(ceil(2 * SCREEN_X / cellSize))
+        self.rows = int(ceil(2 * SCREEN_Y / cellSize))
+        self.boatCells = np.zeros(0, dtype=int)  # the cell each boat is filed under, -1 for none
+        self.order = np.zeros(0, dtype=int)  # the filed boats, by cell
+        self.sortedCells = np.zeros(0, dtype=int)  # and their cells
+        self.pairs = None  # candidatePairs, until a boat changes cell
+
+    def cellsOf(self, xs, zs):
+        col = np.clip(((xs + SCREEN_X) / self.cellSize).astype(int), 0, self.cols - 1)
+        row = np.clip(((zs + SCREEN_Y) / self.cellSize).astype(int), 0, self.rows - 1)
+        return row * self.cols + col
+
+    # files the boats at (xs, zs); the boats not in present are taken out.
+    # Only the boats whose cell changed are moved, and when none did the
+    # order and the candidate pairs are kept. Returns how many moved
+    def update(self, xs, zs, present=None):
+        cells = self.cellsOf(xs, zs)
+        if present is not None:
+            cells[~present] = -1
+        if len(self.boatCells) != len(cells):
+            self.boatCells = np.full(len(cells), -1)
+        moved = np.flatnonzero(cells != self.boatCells)
+        if len(moved):
+            self.boatCells[moved] = cells[moved]
+            filed = np.flatnonzero(self.boatCells >= 0)
+            self.order = filed[np.argsort(self.boatCells[filed], kind="stable")]
+            self.sortedCells = self.boatCells[self.order]
+            self.pairs = None
+        return len(moved)
+
+    # the boats in each of cells, as the start and end of their run in order
+    def runs(self, cells):
+        return (np.searchsorted(self.sortedCells, cells, "left"),
+                np.searchsorted(self.sortedCells, cells, "right"))
+
+    # every pair of boats in the same or neighbouring cells, once each, as two arrays
+    def candidatePairs(self):
+        if self.pairs is not None:
+            return self.pairs
+        order, cells, cols = self.order, self.sortedCells, self.cols
+        col = cells % cols
+        position = np.arange(len(order))
+        firsts = []
+        seconds = []
+        # the boats after each one in its own cell, then those in half of the
+        # neighbouring cells, so each pair of cells is visited once
+        for offset, valid in ((0, True), (1, col + 1 < cols), (cols - 1, col > 0), (cols, True),
+                              (cols + 1, col + 1 < cols)):
+            starts, ends = self.runs(cells + offset)
+            if offset == 0:
+                starts = position + 1
+            counts = np.where(valid, np.maximum(ends - starts, 0), 0)
+            total = counts.sum()
+            if total == 0:
+                continue
+            # each boat's run written out: its start, counting up, once per boat in it
+            runStarts = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            firsts.append(np.repeat(order, counts))
+            seconds.append(order[runStarts + np.arange(total)])
+        if firsts:
+            self.pairs = np.concatenate(firsts), np.concatenate(seconds)
+        else:
+            self.pairs = np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        return self.pairs
+
+
+class LandMap:
+
+    # the obstacles' outlines, and the cells of a grid like SpatialHash's that
+    # come within radius of one, the only cells a boat can run aground in; and
+    # a finer grid of where a boat would be aground or nearly, for looking ahead
+    def __init__(self, obstacles, radius=BOAT_RADIUS, cellSize=CELL_SIZE):
+        self.radius = radius
+        self.grid = SpatialHash(cellSize)
+        self.outlines = []
+        for obstacle in obstacles:
+            outline = np.array(obstacle.get("outline", []), dtype=float).reshape(-1, 2)
+            if len(outline) >= 3:
+                self.outlines.append((outline, np.roll(outline, -1, axis=0)))
+
+        # a boat anywhere in a cell is within half the diagonal of its centre
+        self.coastCells = self.aground(*self.centres(self.grid), radius + cellSize * np.sqrt(.5))
+        self.shoalGrid = SpatialHash(SHOAL_CELL_SIZE)
+        self.shoals = self.aground(*self.centres(self.shoalGrid), radius + SHOAL_MARGIN)
+
+    @staticmethod
+    def centres(grid):
+        xs = (np.arange(grid.cols) + .5) * grid.cellSize - SCREEN_X
+        zs = (np.arange(grid.rows) + .5) * grid.cellSize - SCREEN_Y
+        return [values.ravel() for values in np.meshgrid(xs, zs)]
+
+    # True for each point inside an outline or within reach of its edge
+    def aground(self, xs, zs, reach=None):
+        if reach is None:
+            reach = self.radius
+        result = np.zeros(len(xs), dtype=bool)
+        px, pz = xs[:, None], zs[:, None]
+        for starts, ends in self.outlines:
+            ax, az = starts[:, 0], starts[:, 1]
+            bx, bz = ends[:, 0], ends[:, 1]
+            # inside by the even-odd rule, counting edges crossed going along +x
+            crosses = ((az > pz) != (bz > pz)) & (px < ax + (pz - az) * (bx - ax) / np.where(bz == az, 1, bz - az))
+            inside = crosses.sum(axis=1) % 2 == 1
+            # or near an edge
+            edgeX, edgeZ = bx - ax, bz - az
+            lengthSq = np.maximum(edgeX * edgeX + edgeZ * edgeZ, 1e-12)
+            t = np.clip(((px - ax) * edgeX + (pz - az) * edgeZ) / lengthSq, 0, 1)
+            nearX = px - (ax + t * edgeX)
+            nearZ = pz - (az + t * edgeZ)
+            near = (nearX * nearX + nearZ * nearZ).min(axis=1) < reach * reach
+            result |= inside | near
+        return result
+
+    # True for the boats at (xs, zs) that are aground; only the ones in a
+    # coast cell are tested against the outlines
+    def check(self, xs, zs):
+        result = np.zeros(len(xs), dtype=bool)
+        if not self.outlines:
+            return result
+        coastal = np.flatnonzero(self.coastCells[self.grid.cellsOf(xs, zs)])
+        if len(coastal):
+            result[coastal] = self.aground(xs[coastal], zs[coastal])
+        return result
+
+    # True for the points where a boat would be aground or close to it, to the
+    # nearest shoal grid cell
+    def nearLand(self, xs, zs):
+        return self.shoals[self.shoalGrid.cellsOf(xs, zs)]
+
+
+class Fleet:
+
+    # count boats on course (a coursefile.Course) lined up on a start grid
+    # behind the course's start; windStrength and windHeading can be one
+    # value for everyone or one per boat
+    def __init__(self, course, count, dt=DEFAULT_DT, windStrength=DEFAULT_WIND_STRENGTH,
+                 windHeading=DEFAULT_WIND_HEADING, windField=None, cellSize=CELL_SIZE, radius=BOAT_RADIUS):
+        self.course = course
+        self.count = count
+        self.dt = dt
+        self.radius = radius
+        self.ships = ShipBatch(count, course, dt, windStrength, windHeading, windField)
+        self.hash = SpatialHash(cellSize)
+        self.land = LandMap(course.obstacles, radius, cellSize)
+
+        # each step's inputs; drivers fill these in, and NaN keeps what the boat had
+        self.headings = np.full(count, np.nan)
+        self.sheets = np.full(count, np.nan)
+        self.reset()
+
+    def startGrid(self):
+        # rows of boats across the start heading, each row further back, the
+        # whole grid moved onto the screen if it reaches off it; places on
+        # land are left out and more rows added behind instead
+        x, z, heading = self.course.start
+        angle = np.radians(heading)
+        edgeX, edgeZ = SCREEN_X - START_SPACING, SCREEN_Y - START_SPACING
+        places = self.count
+        while True:
+            index = np.arange(places)
+            across = (index % START_ROW - (min(places, START_ROW) - 1) * .5) * START_SPACING
+            back = (index // START_ROW) * START_SPACING
+            xs = x + across * np.cos(angle) - back * np.sin(angle)
+            zs = z - across * np.sin(angle) - back * np.cos(angle)
+            xs += max(0, -edgeX - xs.min()) - max(0, xs.max() - edgeX)
+            zs += max(0, -edgeZ - zs.min()) - max(0, zs.max() - edgeZ)
+            water = ~self.land.aground(xs, zs)
+            if water.sum() >= self.count or places > 4 * self.count:
+                return xs[water][:self.count], zs[water][:self.count]
+            places += START_ROW
+
+    def reset(self):
+        self.ships.reset()
+        self.ships.place(*self.startGrid())
+        self.steps = 0
+        self.finishTimes = np.full(self.count, np.nan)
+        self.finalScores = np.full(self.count, np.nan)
+        self.racing = np.ones(self.count, dtype=bool)
+        self.contacts = 0  # times one boat has run into another so far
+        self.touching = np.zeros(0, dtype=int)  # the pairs touching after the last step, as pairKeys
+        self.groundings = 0  # times a boat has run aground so far
+        self.grounded = np.zeros(self.count, dtype=bool)  # the boats held off the land last step
+        self.hash.update(self.ships.x, self.ships.z)
+
+    def step(self):
+        ships = self.ships
+        given = ~np.isnan(self.headings)
+        ships.heading[given] = np.mod(self.headings[given], 360)
+        given = ~np.isnan(self.sheets)
+        ships.mainSheetLength[given] = self.sheets[given]
+
+        lastX, lastZ = ships.x, ships.z
+        ships.advance()
+        self.steps += 1
+        xs, zs = ships.x.copy(), ships.z.copy()
+        racing = self.racing
+
+        # the boats that are done stay where they finished
+        xs[~racing] = lastX[~racing]
+        zs[~racing] = lastZ[~racing]
+
+        # only the boats that would go onto the land; one already touching it,
+        # pushed there by another, can still sail off
+        aground = self.land.check(xs, zs) & racing
+        if aground.any():
+            aground &= ~self.land.check(lastX, lastZ)
+        if aground.any():
+            xs[aground] = lastX[aground]
+            zs[aground] = lastZ[aground]
+            self.stop(aground)
+            self.groundings += int((aground & ~self.grounded).sum())
+        self.grounded = aground
+
+        self.hash.update(xs, zs, racing)
+        self.separate(xs, zs)
+        ships.place(xs, zs)
+
+        finished = ships.finished & racing
+        if finished.any():
+            self.finishTimes[finished] = self.steps * self.dt
+            self.finalScores[finished] = ships.score[finished]
+            self.racing = racing & ~finished
+        return finished
+
+    def stop(self, mask):
+        self.ships.sail.boatVelocity[mask] = 0
+        self.ships.boatVelocity[mask] = 0
+        self.ships.velX[mask] = 0
+        self.ships.velZ[mask] = 0
+
+    # pushes touching boats apart, each by half the overlap, and slows them
+    def separate(self, xs, zs):
+        firsts, seconds = self.hash.candidatePairs()
+        if len(firsts) == 0:
+            self.touching = firsts
+            return
+        dx = xs[seconds] - xs[firsts]
+        dz = zs[seconds] - zs[firsts]
+        distance = np.sqrt(dx * dx + dz * dz)
+        # pairs just apart are remembered as touching too, so boats pushed
+        # apart and straight back together are not hit over and over
+        near = distance < 2 * self.radius + CONTACT_MARGIN
+        keys = self.pairKeys(firsts[near], seconds[near])
+        touching = distance < 2 * self.radius
+        if not touching.any():
+            self.touching = keys
+            return
+        new = ~np.isin(self.pairKeys(firsts[touching], seconds[touching]), self.touching)
+        self.touching = keys
+        firsts, seconds = firsts[touching], seconds[touching]
+        dx, dz, distance = dx[touching], dz[touching], distance[touching]
+        overlap = 2 * self.radius - distance
+        # boats exactly on top of each other are pushed apart sideways
+        same = distance == 0
+        dx[same], distance[same] = 1.0, 1.0
+        push = overlap * .5 / distance
+        np.add.at(xs, firsts, -dx * push)
+        np.add.at(zs, firsts, -dz * push)
+        np.add.at(xs, seconds, dx * push)
+        np.add.at(zs, seconds, dz * push)
+
+        # a boat is slowed as it runs into another, not again each step they
+        # stay touching
+        hit = np.zeros(len(xs), dtype=bool)
+        hit[firsts[new]] = True
+        hit[seconds[new]] = True
+        self.ships.sail.boatVelocity[hit] *= COLLISION_SPEED_KEPT
+        self.ships.boatVelocity[hit] *= COLLISION_SPEED_KEPT
+        self.contacts += int(new.sum())
+
+    def pairKeys(self, firsts, seconds):
+        return np.minimum(firsts, seconds) * self.count + np.maximum(firsts, seconds)
+
+    # steps until every boat has finished or the time limit, asking each
+    # driver (anything with a drive(fleet) method) for the inputs first
+    def run(self, drivers, maxTime=DEFAULT_MAX_TIME):
+        maxSteps = int(round(maxTime / self.dt))
+        while self.steps < maxSteps and self.racing.any():
+            for driver in drivers:
+                driver.drive(self)
+            self.step()
+        return self.standings()
+
+    # (boat, finish time or None, score) in finishing order, then the boats
+    # still racing, nearest the finish first
+    def standings(self):
+        finished = np.flatnonzero(~np.isnan(self.finishTimes))
+        finished = finished[np.argsort(self.finishTimes[finished], kind="stable")]
+        racing = np.flatnonzero(np.isnan(self.finishTimes))
+        racing = racing[np.argsort(self.ships.distanceToFinish[racing], kind="stable")]
+        return ([(int(boat), float(self.finishTimes[boat]), float(self.finalScores[boat])) for boat in finished] +
+                [(int(boat), None, float(self.ships.score[boat])) for boat in racing])
+
+
+class CourseFollower:
+
+    # steers boats (indexes into the fleet) towards a point lookahead units
+    # along the course line, each in its own lane beside it, on whichever
+    # heading closes on that fastest for the wind, which means tacking when it
+    # is upwind, and keeps off the land. polar is a
+    # polars.PolarResult, the one for the wind by default
+    def __init__(self, fleet, boats=None, polar=None, windStrength=DEFAULT_WIND_STRENGTH,
+                 windHeading=DEFAULT_WIND_HEADING, seed=0):
+        if boats is None:
+            boats = np.arange(fleet.count)
+        if polar is None:
+            polar = loadPolar(windStrength)
+        self.boats = np.asarray(boats, dtype=int)
+        self.polar = polar
+        self.setWind(windStrength, windHeading)
+        self.pointXs = np.array([point.x for point in fleet.course.arcPoints])
+        self.pointZs = np.array([point.z for point in fleet.course.arcPoints])
+        # the course line's left hand side at each point
+        alongX = np.gradient(self.pointXs)
+        alongZ = np.gradient(self.pointZs)
+        length = np.maximum(np.hypot(alongX, alongZ), 1e-12)
+        self.sideXs = -alongZ / length
+        self.sideZs = alongX / length
+
+        rng = np.random.default_rng(seed)
+        self.lookahead = (rng.uniform(LOOKAHEAD[0], LOOKAHEAD[1], len(self.boats)) / ARC_STEP).astype(int)
+        self.jitter = rng.normal(0, HEADING_JITTER, len(self.boats))
+        self.lanes = rng.uniform(-.5, .5, len(self.boats)) * LANE_WIDTH
+        self.reset()
+
+    def reset(self):
+        self.progress = np.zeros(len(self.boats), dtype=int)  # the course point each boat has reached
+
+    # the headings to choose from for a new wind; the polar stays the one
+    # given, so this is quick enough to call whenever the wind changes
+    def setWind(self, windStrength, windHeading):
+        self.windHeading = windHeading
+        self.headings, self.speeds, self.sheets = headingTable(self.polar, windStrength, windHeading)
+        self.dirXs = np.sin(np.radians(self.headings))
+        self.dirZs = np.cos(np.radians(self.headings))
+
+    def drive(self, fleet):
+        if len(self.headings) == 0:
+            return
+        boats = self.boats
+        ships = fleet.ships
+        xs, zs = ships.x[boats], ships.z[boats]
+        last = len(self.pointXs) - 1
+
+        # the nearest course point a little way on from where the boat was
+        # last, so it follows the course round and does not skip across loops
+        window = np.minimum(self.progress[:, None] + np.arange(PROGRESS_WINDOW), last)
+        dx = self.pointXs[window] - xs[:, None]
+        dz = self.pointZs[window] - zs[:, None]
+        self.progress = window[np.arange(len(boats)), (dx * dx + dz * dz).argmin(axis=1)]
+
+        # aiming lookahead along the course from there, in the boat's lane
+        target = np.minimum(self.progress + self.lookahead, last)
+        lanes = self.lanes * np.minimum(1, (last - target) * ARC_STEP / LANE_MERGE)
+        targetXs = self.pointXs[target] + lanes * self.sideXs[target]
+        targetZs = self.pointZs[target] + lanes * self.sideZs[target]
+        # a lane that runs by the land closes up onto the course line there
+        onLand = fleet.land.nearLand(targetXs, targetZs)
+        targetXs[onLand] = self.pointXs[target[onLand]]
+        targetZs[onLand] = self.pointZs[target[onLand]]
+        dx = targetXs - xs
+        dz = targetZs - zs
+
+        # the speed made good towards the point on every heading, leaving out
+        # the headings that run into land unless every one of them does
+        madeGood = (np.outer(dx, self.dirXs) + np.outer(dz, self.dirZs)) * self.speeds
+        blocked = np.zeros(madeGood.shape, dtype=bool)
+        for distance in LAND_PROBES:
+            blocked |= fleet.land.nearLand(xs[:, None] + distance * self.dirXs, zs[:, None] + distance * self.dirZs)
+        blocked[blocked.all(axis=1)] = False
+        madeGood[blocked] = -np.inf
+        best = madeGood.argmax(axis=1)
+        wanted = self.headings[best] + self.jitter
+
+        # turning no faster than the keys allow
+        current = ships.heading[boats]
+        turn = (wanted - current + 180) % 360 - 180
+        limit = TURN_RATE * fleet.dt
+        headings = (current + np.clip(turn, -limit, limit)) % 360
+        fleet.headings[boats] = headings
+        # the sail is let go to the middle as the bow crosses the wind, or it
+        # would be held on the side the wind has just left
+        sheets = self.sheets[best]
+        sheets[self.windSide(current) != self.windSide(headings)] = SHEET_MIN
+        fleet.sheets[boats] = sheets
+
+    def windSide(self, headings):
+        return np.sin(np.radians(self.windHeading - headings - 180)) > 0
+
+
+class ReplayDriver:
+
+    # plays the inputs of a recorded run (a recorder.RunReader) on one boat;
+    # once the recording ends the boat keeps its last inputs
+    def __init__(self, reader, boat):
+        self.boat = boat
+        records = reader.records
+        self.inputs = {name: np.array(records[name], dtype=float)
+                       for name in ("heading", "mainSheetLength", "windStrength", "windHeading")}
+        self.length = len(reader)
+
+    def drive(self, fleet):
+        if self.length == 0:
+            return
+        i = min(fleet.steps, self.length - 1)
+        fleet.headings[self.boat] = self.inputs["heading"][i]
+        fleet.sheets[self.boat] = self.inputs["mainSheetLength"][i]
+        fleet.ships.windStrength[self.boat] = self.inputs["windStrength"][i]
+        fleet.ships.windHeading[self.boat] = self.inputs["windHeading"][i]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Race a fleet of boats round a course without a window")
+    parser.add_argument("--boats", type=int, default=100, help="boats in the fleet, including the replays")
+    parser.add_argument("--replay", nargs="*", default=[], help="run files whose boats race too")
+    parser.add_argument("--dt", type=float, default=DEFAULT_DT, help="fixed time step in seconds")
+    parser.add_argument("--max-time", type=float, default=DEFAULT_MAX_TIME, help="race time limit in seconds")
+    parser.add_argument("--wind", type=float, default=DEFAULT_WIND_STRENGTH, help="wind strength")
+    parser.add_argument("--wind-heading", type=float, default=DEFAULT_WIND_HEADING, help="wind heading in degrees")
+    parser.add_argument("--course", default=DEFAULT_COURSE_FILE, help="JSON or compiled course file")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the autopilots")
+    args = parser.parse_args(argv)
+
+    from recorder import RunReader
+    count = max(args.boats, len(args.replay))
+    fleet = Fleet(loadCourse(args.course), count, args.dt, args.wind, args.wind_heading)
+    drivers = [ReplayDriver(RunReader(path), boat) for boat, path in enumerate(args.replay)]
+    drivers.append(CourseFollower(fleet, np.arange(len(args.replay), count), windStrength=args.wind,
+                                  windHeading=args.wind_heading, seed=args.seed))
+
+    start = time.perf_counter()
+    standings = fleet.run(drivers, args.max_time)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"boats": count, "finished": int((~np.isnan(fleet.finishTimes)).sum()),
+                      "steps": fleet.steps, "contacts": fleet.contacts, "groundings": fleet.groundings,
+                      "stepsPerSecond": fleet.steps / elapsed if elapsed > 0 else 0,
+                      "podium": standings[:3]}))
+
+
+if __name__ == "__main__":
+    main()
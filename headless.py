@@ -0,0 +1,231 @@
+# Headless simulator - runs the sail physics, ship movement and scoring with
+# no window and no Panda3D, using a fixed time step and scripted controls.
+# Usage: python headless.py [--script inputs.json] [--dt 0.0166] [--max-time 120] [--record run.sailrun]
+#                           [--course courses/default.json] [--wind-field SEED] [--integrator rk4]
+import argparse
+import json
+import time
+
+from course import CourseIndex
+from coursefile import loadCourse, DEFAULT_COURSE_FILE
+from recorder import RunRecorder
+from sail import Sail
+from shipmodel import ShipModel, ShipState, FINISH_DISTANCE
+
+DEFAULT_DT = 1 / 60.0
+DEFAULT_MAX_TIME = 120.0  # seconds of race time before a run is abandoned
+DEFAULT_WIND_STRENGTH = 12  # the starting value of the wind strength slider
+DEFAULT_WIND_HEADING = 90  # the starting roll of the wind direction arrow
+
+# the controls a script can set; each keeps its value until the script changes it
+INPUT_NAMES = ("heading", "mainSheetLength", "windStrength", "windHeading")
+
+
+class ScriptedInputs:
+
+    # keyframes is a list of (time, {input name: value}) pairs
+    def __init__(self, keyframes=()):
+        for t, values in keyframes:
+            for name in values:
+                if name not in INPUT_NAMES:
+                    raise ValueError("unknown input '%s' at time %s" % (name, t))
+        self.keyframes = sorted(keyframes, key=lambda keyframe: keyframe[0])
+        self.rewind()
+
+    def rewind(self):
+        self.index = 0
+        self.values = {}
+
+    # returns the inputs that apply at time t; t must not go backwards between calls
+    def at(self, t):
+        while self.index < len(self.keyframes) and self.keyframes[self.index][0] <= t:
+            self.values.update(self.keyframes[self.index][1])
+            self.index += 1
+        return self.values
+
+    @classmethod
+    def fromJson(cls, data):
+        # [{"time": 0, "heading": 170, "mainSheetLength": 20}, {"time": 5, "heading": 120}, ...]
+        keyframes = []
+        for entry in data:
+            entry = dict(entry)
+            t = entry.pop("time", 0)
+            keyframes.append((t, entry))
+        return cls(keyframes)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.fromJson(json.load(f))
+
+
+class HeadlessSimulator:
+
+    # course is a coursefile.Course, the default course if neither it nor a
+    # list of sampled pathPoints is given
+    # recorder is an optional recorder.RunRecorder that every step is written to
+    # windField is an optional windfield.WindField that the wind varies over
+    # integrator names one of integrators.py's schemes to step the physics
+    # with; None steps it as the game does
+    def __init__(self, pathPoints=None, dt=DEFAULT_DT,
+                 windStrength=DEFAULT_WIND_STRENGTH, windHeading=DEFAULT_WIND_HEADING, recorder=None,
+                 course=None, windField=None, integrator=None):
+        if pathPoints is None and course is None:
+            course = loadCourse()
+        self.course = course
+        self.windField = windField
+        if pathPoints is not None:
+            self.pathPoints = pathPoints
+            self.courseIndex = CourseIndex(pathPoints)
+        else:
+            self.pathPoints = course.pathPoints
+            self.courseIndex = course.index
+        self.dt = dt
+        self.integrator = integrator
+        self.recorder = recorder
+        self.startWindStrength = windStrength
+        self.startWindHeading = windHeading
+        self.reset()
+
+    def reset(self):
+        finishDistance = FINISH_DISTANCE
+        if self.course is not None:
+            x, z, heading = self.course.start
+            self.state = ShipState(x, z, heading)
+            finishDistance = self.course.finishRadius
+        else:
+            self.state = ShipState()
+        if self.integrator is not None:
+            # imported here as it brings in numpy
+            from integrators import IntegratedShipModel, makeIntegrator
+            self.model = IntegratedShipModel(self.courseIndex, makeIntegrator(self.integrator),
+                                             Sail(stepRate=1.0 / self.dt), finishDistance=finishDistance,
+                                             windField=self.windField)
+        else:
+            self.model = ShipModel(self.courseIndex, Sail(stepRate=1.0 / self.dt), finishDistance=finishDistance,
+                                   windField=self.windField)
+        self.courseIndex.lastSegment = None
+        self.windStrength = self.startWindStrength
+        self.windHeading = self.startWindHeading
+        self.steps = 0
+        self.time = 0.0
+
+    # advances the race by one fixed step; any input left as None keeps its value
+    def step(self, heading=None, mainSheetLength=None, windStrength=None, windHeading=None):
+        self.applyInputs(heading, mainSheetLength, windStrength, windHeading)
+        self.model.step(self.state, self.dt, self.windStrength, self.windHeading)
+        return self.endStep()
+
+    # step with the scripted inputs changed part way through it, at the time
+    # of every keyframe that falls inside it; the game only reads its controls
+    # at the start of a step, but an integrator can step to any time
+    def stepThrough(self, inputs, values):
+        self.applyInputs(**values)
+        start = self.time
+        end = (self.steps + 1) * self.dt
+        while inputs.index < len(inputs.keyframes) and inputs.keyframes[inputs.index][0] < end:
+            t = inputs.keyframes[inputs.index][0]
+            self.model.step(self.state, t - start, self.windStrength, self.windHeading)
+            self.applyInputs(**inputs.at(t))
+            start = t
+        self.model.step(self.state, end - start, self.windStrength, self.windHeading)
+        return self.endStep()
+
+    def applyInputs(self, heading=None, mainSheetLength=None, windStrength=None, windHeading=None):
+        state = self.state
+        if heading is not None:
+            state.heading = heading % 360
+        if mainSheetLength is not None:
+            state.mainSheetLength = mainSheetLength
+        if windStrength is not None:
+            self.windStrength = windStrength
+        if windHeading is not None:
+            self.windHeading = windHeading
+
+    def endStep(self):
+        state = self.state
+        if self.recorder is not None:
+            self.recorder.record(self.steps, self.time, state, self.model.sailBoat,
+                                 self.windStrength, self.windHeading)
+        self.steps += 1
+        self.time = self.steps * self.dt
+        return state.finished
+
+    # steps through the inputs of a recorded run (a recorder.RunReader) from the
+    # start; with the same dt and course the race comes out exactly the same
+    def replay(self, reader):
+        self.reset()
+        for i in range(len(reader)):
+            self.step(**reader.inputs(i))
+        return self.result()
+
+    # runs until the finish or the time limit; inputs is a ScriptedInputs or a
+    # function taking the simulator and returning a dict of inputs (or None)
+    def run(self, inputs=None, maxTime=DEFAULT_MAX_TIME):
+        scripted = isinstance(inputs, ScriptedInputs)
+        if scripted:
+            inputs.rewind()
+            getInputs = lambda sim: inputs.at(sim.time)
+        else:
+            getInputs = inputs
+
+        maxSteps = int(round(maxTime / self.dt))
+        while self.steps < maxSteps and not self.state.finished:
+            values = getInputs(self) if getInputs is not None else None
+            if scripted and self.integrator is not None:
+                self.stepThrough(inputs, values)
+            elif values:
+                self.step(**values)
+            else:
+                self.step()
+
+        return self.result()
+
+    def result(self):
+        state = self.state
+        return {"score": state.score, "finished": state.finished,
+                "time": self.time, "steps": self.steps,
+                "x": state.x, "z": state.z, "heading": state.heading}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the sailing simulator without a window")
+    parser.add_argument("--script", help="JSON list of timed input keyframes")
+    parser.add_argument("--dt", type=float, default=DEFAULT_DT, help="fixed time step in seconds")
+    parser.add_argument("--max-time", type=float, default=DEFAULT_MAX_TIME, help="race time limit in seconds")
+    parser.add_argument("--wind", type=float, default=DEFAULT_WIND_STRENGTH, help="starting wind strength")
+    parser.add_argument("--wind-heading", type=float, default=DEFAULT_WIND_HEADING,
+                        help="starting wind heading in degrees")
+    parser.add_argument("--record", help="write every step to this run file")
+    parser.add_argument("--course", default=DEFAULT_COURSE_FILE, help="JSON or compiled course file")
+    parser.add_argument("--wind-field", type=int, metavar="SEED",
+                        help="vary the wind over the course and in time, with this random seed")
+    parser.add_argument("--integrator", choices=("euler", "semi-implicit", "rk4", "adaptive"),
+                        help="step the physics with this scheme instead of the game's own")
+    args = parser.parse_args(argv)
+
+    inputs = ScriptedInputs.load(args.script) if args.script else None
+    course = loadCourse(args.course)
+    windField = None
+    if args.wind_field is not None:
+        from windfield import WindField
+        windField = WindField(args.wind_field)
+    recorder = None
+    if args.record:
+        recorder = RunRecorder(args.record, {"dt": args.dt, "source": "headless", "course": course.hexHash,
+                                             "windField": args.wind_field})
+    sim = HeadlessSimulator(dt=args.dt, windStrength=args.wind, windHeading=args.wind_heading,
+                            recorder=recorder, course=course, windField=windField, integrator=args.integrator)
+
+    start = time.perf_counter()
+    result = sim.run(inputs, maxTime=args.max_time)
+    elapsed = time.perf_counter() - start
+    if recorder is not None:
+        recorder.close()
+    result["stepsPerSecond"] = result["steps"] / elapsed if elapsed > 0 else 0
+
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
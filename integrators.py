@@ -0,0 +1,457 @@
+# Integrators - the sail and ship equations stepped with a choice of scheme
+# sail.stepBoat is explicit Euler at the game's step rate: the boat speeds
+# up by one step of the sail's force, slows by one of the water's, and the
+# ship then moves one step at the new speed. Here the same physics is written
+# as rates of change in time, and one of these steps it:
+#
+#   ExplicitEuler       one evaluation a step, first order
+#   SemiImplicitEuler   the speeds first, then the positions moved at the new
+#                       speeds, as the game does; two evaluations, first order
+#   RK4                 four evaluations, fourth order
+#   AdaptiveRK          Dormand-Prince 5(4), cutting each step into as many
+#                       pieces as keep the estimated error within tolerance
+#
+# A system's state is a tuple of components, each a float or a NumPy array,
+# so the same integrators step one ship (ShipSystem, for headless.py) or a
+# whole batch of them (ShipBatchSystem, for vecenv.ShipBatch). After every
+# step the system projects the state back onto what the model allows: the
+# sail is held at the length of its sheet and the boat never goes backwards
+# faster than stepBoat lets it. The sail's angle to the boat is stepped from
+# -PI to PI rather than from 0 to TWO_PI as Sail keeps it, and a stage that
+# swings it past its sheet finds it stopped there, on the side it swung to;
+# it swings at tens of radians a second, and stepped freely over a long step
+# it would go round past the wind and come to rest against the wrong side.
+#
+# ShipModel wraps a ship that has gone past a screen edge to the far one at
+# the end of the step, losing however far past it went, which is up to a
+# step's sailing. Here a ship past an edge is at the far edge moved on by as
+# much, both in the state and wherever the course and the wind are looked up,
+# so the screen repeats and a crossing part way through a step lands just
+# where wrapping at that very moment would have put it.
+#
+# The sail only drives the boat while it is pressed against its sheet, so
+# the forces switch on and off within a step. The adaptive scheme shortens
+# its steps around those switches instead of stepping over them; the fixed
+# step schemes step over them, and are only first order across one.
+# Usage: python integrators.py [--script inputs.json] [--time 30] [--reference-tolerance 1e-12] [--rates 60,30,12,6]
+import argparse
+import json
+import time
+from math import sin, cos, sqrt, atan2, radians, degrees
+
+import numpy as np
+
+from sail import (Sail, SailConstants, HALF_PI, TWO_PI, PI, BASE_STEP_RATE, BOAT_MASS, WATER_RESISTANCE,
+                  SPEED_SCALE)
+from course import CourseIndex
+from shipmodel import (MAX_VEL, MAX_VEL_SQ, SCREEN_X, SCREEN_Y, SHIP_SCALE, REFERENCE_DT, FINISH_DISTANCE,
+                       NULL_PROFILER)
+
+MIN_BOAT_VELOCITY = -.03  # the floor stepBoat puts under the boat's velocity
+DEFAULT_RTOL = 1e-6
+DEFAULT_ATOL = 1e-6  # of each component's scale
+# the Dormand-Prince tableau: stage times, stage weights, the fifth order
+# weights and the difference of the fourth order ones from them
+DP_C = (0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1, 1)
+DP_A = ((),
+        (1 / 5,),
+        (3 / 40, 9 / 40),
+        (44 / 45, -56 / 15, 32 / 9),
+        (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+        (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656),
+        (35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84))
+DP_E = (71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40)
+SAFETY = .9
+MIN_SHRINK = .2
+MAX_GROWTH = 5.0
+MAX_SUBSTEPS = 10000
+
+
+# y + sum of dt * weight * k over the stages
+def combine(y, dt, weights, stages):
+    result = list(y)
+    for weight, k in zip(weights, stages):
+        if weight:
+            scale = dt * weight
+            for i, value in enumerate(k):
+                result[i] = result[i] + scale * value
+    return tuple(result)
+
+
+class ExplicitEuler:
+    name = "euler"
+
+    def step(self, system, t, y, dt):
+        return system.project(combine(y, dt, (1,), (system.derivatives(t, y),)))
+
+
+class SemiImplicitEuler:
+    name = "semi-implicit"
+
+    # the first system.velocities components are stepped on their own, and
+    # the rest with the rates worked out from the new ones
+    def step(self, system, t, y, dt):
+        n = system.velocities
+        k = system.derivatives(t, y)
+        moved = tuple(value + dt * rate for value, rate in zip(y[:n], k[:n])) + tuple(y[n:])
+        k = system.derivatives(t, moved)
+        return system.project(moved[:n] + tuple(value + dt * rate for value, rate in zip(y[n:], k[n:])))
+
+
+class RK4:
+    name = "rk4"
+
+    def step(self, system, t, y, dt):
+        k1 = system.derivatives(t, y)
+        k2 = system.derivatives(t + .5 * dt, combine(y, dt, (.5,), (k1,)))
+        k3 = system.derivatives(t + .5 * dt, combine(y, dt, (.5,), (k2,)))
+        k4 = system.derivatives(t + dt, combine(y, dt, (1,), (k3,)))
+        return system.project(combine(y, dt, (1 / 6, 1 / 3, 1 / 3, 1 / 6), (k1, k2, k3, k4)))
+
+
+class AdaptiveRK:
+    name = "adaptive"
+
+    # the error of a piece is kept within atol times each component's scale
+    # plus rtol times its size; a batch takes the same pieces for every boat
+    def __init__(self, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+        self.rtol = rtol
+        self.atol = atol
+        self.h = None  # the piece length the last step ended on, to start the next with
+        self.substeps = 0
+        self.rejected = 0
+
+    def step(self, system, t, y, dt):
+        h = dt if self.h is None else self.h
+        done = 0.0
+        for _ in range(MAX_SUBSTEPS):
+            if done >= dt:
+                break
+            h = min(h, dt - done)
+            stages = [system.derivatives(t + done, y)]
+            for c, a in zip(DP_C[1:], DP_A[1:]):
+                stages.append(system.derivatives(t + done + c * h, combine(y, h, a, stages)))
+            # the seventh stage is taken at the fifth order result
+            moved = combine(y, h, DP_A[6], stages)
+            errors = combine([0 * value for value in y], h, DP_E, stages)
+            error = 0.0
+            for value, estimate, scale in zip(moved, errors, system.scales):
+                tolerance = self.atol * scale + self.rtol * np.abs(value)
+                error = max(error, float(np.max(np.abs(estimate) / tolerance)))
+            # a piece too short to matter is taken whatever its error, so a
+            # switch of the sail's forces cannot stall the step
+            accepted = error <= 1.0 or h <= dt * 1e-6
+            if accepted:
+                y = system.project(moved)
+                done += h
+                self.substeps += 1
+            else:
+                self.rejected += 1
+            growth = SAFETY * error ** -.2 if error > 0 else MAX_GROWTH
+            h *= min(MAX_GROWTH, max(MIN_SHRINK, growth))
+            if accepted:
+                self.h = h
+        return y
+
+
+INTEGRATORS = {integrator.name: integrator for integrator in (ExplicitEuler, SemiImplicitEuler, RK4, AdaptiveRK)}
+
+
+def makeIntegrator(name):
+    if name not in INTEGRATORS:
+        raise ValueError("unknown integrator '%s', expected one of %s" % (name, ", ".join(INTEGRATORS)))
+    return INTEGRATORS[name]()
+
+
+# one ship and its sail, the state being (boat velocity, sail angle to the
+# boat from -PI to PI, x, z, score); the controls and wind are held over each
+# step
+class ShipSystem:
+    velocities = 2
+    scales = (1e-7, 1.0, 1.0, 1.0, 100.0)
+
+    def __init__(self, courseIndex, constants=None, windField=None, scale=SHIP_SCALE):
+        self.courseIndex = courseIndex
+        self.constants = constants if constants is not None else SailConstants(Sail())
+        self.windField = windField
+        self.periodX = 2 * SCREEN_X + .5 * scale  # from the edge a ship wraps at to the one it comes back at
+        self.periodZ = 2 * SCREEN_Y + .5 * scale
+        self.radius = .5 * scale
+        self.segment = None  # where the course search starts
+        self.setInputs(0, 0, 0, 0)
+
+    # heading in degrees as ShipState has it, the main sheet length, and the wind
+    def setInputs(self, heading, mainSheetLength, windStrength, windHeading):
+        self.heading = heading
+        self.boatAngle = radians(heading)
+        self.limit = (mainSheetLength / self.constants.mainSheetLimit) * HALF_PI
+        self.windStrength = windStrength
+        self.windHeading = windHeading
+
+    # x and z past a screen edge put past the far one by as much
+    def wrap(self, x, z):
+        radius = self.radius
+        if x - radius > SCREEN_X:
+            x -= self.periodX
+        elif x + radius < -SCREEN_X:
+            x += self.periodX
+        if z - radius > SCREEN_Y:
+            z -= self.periodZ
+        elif z + radius < -SCREEN_Y:
+            z += self.periodZ
+        return x, z
+
+    def derivatives(self, t, y):
+        boatVelocity, mainAngle, x, z, score = y
+        x, z = self.wrap(x, z)
+        limit = self.limit
+        mainAngle = (-limit if mainAngle < -limit else limit if mainAngle > limit else mainAngle) % TWO_PI
+        constants = self.constants
+        windStrength, windHeading = self.windStrength, self.windHeading
+        if self.windField is not None:
+            windStrength, windHeading = self.windField.sample(x, z, t, windStrength, windHeading)
+        windVelocity = (windStrength + .000001) / 1000.0
+        windAngle = radians(windHeading)
+        boatAngle = self.boatAngle
+
+        # the apparent wind and the sail's swing towards it, as in stepBoat
+        appX = 5 * boatVelocity * sin(boatAngle + PI) + windVelocity * sin(windAngle)
+        appY = 5 * boatVelocity * cos(boatAngle + PI) + windVelocity * cos(windAngle)
+        appVelocity = sqrt(appX * appX + appY * appY)
+        appAngle = atan2(appX, appY) % TWO_PI
+        absolute = (boatAngle + mainAngle + PI) % TWO_PI
+        mainAttack = abs(absolute - appAngle)
+        mainAttack2 = TWO_PI - mainAttack if mainAttack > PI else mainAttack
+        windPressure = .00256 * (appVelocity * appVelocity)
+        if constants.aeroTable is not None:
+            dragCoef, liftCoef = constants.aeroTable.coefs(mainAttack2, appVelocity)
+        else:
+            square = mainAttack2 * mainAttack2
+            dragCoef = max(.16, -.45361 * square + 1.64225 * mainAttack2 - .27701)
+            liftCoef = .5626 * (square * mainAttack2) - 3.1881 * square + 4.4150 * mainAttack2 - .6614
+        swing = constants.mainArea * windPressure * dragCoef * sin(mainAttack) * constants.mainLength \
+            / constants.windPower * BASE_STEP_RATE
+        if absolute > appAngle:
+            swing = -swing
+        elif absolute == appAngle:
+            swing = 0.0
+
+        # the sail only drives the boat while the wind holds it against its sheet
+        pinned = (limit <= mainAngle <= PI and swing >= 0) or (PI < mainAngle <= TWO_PI - limit and swing <= 0)
+        forwardForce = 0.0
+        if pinned:
+            swing = 0.0
+            appAngle = (appAngle + PI) % TWO_PI
+            boatAttack = abs(appAngle - boatAngle)
+            if boatAttack > PI:
+                boatAttack = TWO_PI - boatAttack
+            boatAttack %= TWO_PI
+            appSquared = appVelocity * appVelocity
+            dragForce = constants.halfArea * dragCoef * constants.sealvlAirDens * appSquared
+            liftForce = constants.halfArea * liftCoef * constants.sealvlAirDens * appSquared
+            forwardForce = liftForce * sin(boatAttack) - dragForce * cos(boatAttack)
+        self.forwardForce = forwardForce
+        acceleration = (forwardForce - WATER_RESISTANCE * boatVelocity) / BOAT_MASS
+
+        # ShipModel's velocity, limited to MAX_VEL
+        speed = boatVelocity * SPEED_SCALE * REFERENCE_DT
+        velX = sin(boatAngle) * speed
+        velZ = cos(boatAngle) * speed
+        lengthSquared = velX * velX + velZ * velZ
+        if lengthSquared > MAX_VEL_SQ:
+            length = sqrt(lengthSquared)
+            velX = velX / length * MAX_VEL
+            velZ = velZ / length * MAX_VEL
+
+        self.segment, distance = self.courseIndex.nearestSegment(x, z, self.segment)
+        return acceleration, swing, velX, velZ, -(distance * distance) * BASE_STEP_RATE
+
+    def project(self, y):
+        boatVelocity, mainAngle, x, z, score = y
+        if boatVelocity < MIN_BOAT_VELOCITY:
+            boatVelocity = MIN_BOAT_VELOCITY
+        limit = self.limit
+        if mainAngle > limit:
+            mainAngle = limit
+        elif mainAngle < -limit:
+            mainAngle = -limit
+        x, z = self.wrap(x, z)
+        return boatVelocity, mainAngle, x, z, score
+
+
+# ShipModel.step with the physics stepped by an integrator instead of stepBoat
+class IntegratedShipModel:
+
+    def __init__(self, course, integrator, sail=None, scale=SHIP_SCALE, profiler=NULL_PROFILER,
+                 finishDistance=FINISH_DISTANCE, windField=None):
+        self.courseIndex = course if isinstance(course, CourseIndex) else CourseIndex(course)
+        self.sailBoat = sail if sail is not None else Sail()
+        self.finishDistance = finishDistance
+        self.windField = windField
+        self.profiler = profiler
+        self.integrator = integrator
+        self.system = ShipSystem(self.courseIndex, self.sailBoat.constants, windField, scale)
+
+    def step(self, state, dt, windStrength, windHeading):
+        state.distanceToFinish = self.courseIndex.distanceToEnd(state)
+        if state.distanceToFinish < self.finishDistance:
+            state.finished = True
+
+        boat = self.sailBoat.state
+        system = self.system
+        system.setInputs(state.heading, state.mainSheetLength, windStrength, windHeading)
+        mainAngle = boat.mainAngle - TWO_PI if boat.mainAngle > PI else boat.mainAngle
+        y = (boat.boatVelocity, mainAngle, state.x, state.z, state.score)
+        boat.boatVelocity, mainAngle, state.x, state.z, state.score = self.integrator.step(system, state.time, y, dt)
+        boat.mainAngle = mainAngle % TWO_PI
+        self.profiler.mark("sail")
+
+        # what stepBoat would have left in the sail for the step's end
+        system.derivatives(state.time + dt, (boat.boatVelocity, mainAngle, state.x, state.z, state.score))
+        boat.boatAngle = system.boatAngle
+        boat.forwardForce = system.forwardForce
+        boat.speed = boat.boatVelocity * SPEED_SCALE
+        boat.sailAngle = round(degrees(boat.mainAngle), 2)
+        state.boatVelocity = boat.speed
+        state.sailAngle = boat.sailAngle
+        speed = boat.speed * REFERENCE_DT
+        state.velX = sin(system.boatAngle) * speed
+        state.velZ = cos(system.boatAngle) * speed
+        state.time += dt
+        self.profiler.mark("position")
+
+
+# every boat of a vecenv.ShipBatch, the state being arrays of the same five
+# components as ShipSystem's
+class ShipBatchSystem:
+    velocities = 2
+    scales = ShipSystem.scales
+
+    def __init__(self, ships):
+        self.ships = ships
+        self.sail = ships.sail
+        self.limit = np.zeros(ships.count)
+        self.periodX = 2 * SCREEN_X + ships.radius
+        self.periodZ = 2 * SCREEN_Y + ships.radius
+
+    def setInputs(self):
+        ships = self.ships
+        self.boatAngle = np.radians(ships.heading)
+        self.limit = (ships.mainSheetLength / self.sail.mainSheetLimit) * HALF_PI
+
+    # ShipSystem.wrap for every boat
+    def wrap(self, x, z):
+        radius = self.ships.radius
+        x = np.where(x - radius > SCREEN_X, x - self.periodX, np.where(x + radius < -SCREEN_X, x + self.periodX, x))
+        z = np.where(z - radius > SCREEN_Y, z - self.periodZ, np.where(z + radius < -SCREEN_Y, z + self.periodZ, z))
+        return x, z
+
+    def derivatives(self, t, y):
+        boatVelocity, mainAngle, x, z, score = y
+        x, z = self.wrap(x, z)
+        limit = self.limit
+        mainAngle = np.mod(np.clip(mainAngle, -limit, limit), TWO_PI)
+        ships, sail = self.ships, self.sail
+        windStrength, windHeading = ships.windStrength, ships.windHeading
+        if ships.windField is not None:
+            windStrength, windHeading = ships.windField.sampleBatch(x, z, t, windStrength, windHeading)
+        self.localWindStrength, self.localWindHeading = windStrength, windHeading
+        windVelocity = (windStrength + .000001) / 1000.0
+        windAngle = np.radians(windHeading)
+        boatAngle = self.boatAngle
+
+        appX = 5 * boatVelocity * np.sin(boatAngle + PI) + windVelocity * np.sin(windAngle)
+        appY = 5 * boatVelocity * np.cos(boatAngle + PI) + windVelocity * np.cos(windAngle)
+        appVelocity = np.sqrt(appX * appX + appY * appY)
+        appAngle = np.mod(np.arctan2(appX, appY), TWO_PI)
+        absolute = np.mod(boatAngle + mainAngle + PI, TWO_PI)
+        mainAttack = np.abs(absolute - appAngle)
+        mainAttack2 = np.where(mainAttack > PI, TWO_PI - mainAttack, mainAttack)
+        windPressure = .00256 * (appVelocity * appVelocity)
+        dragCoef, liftCoef = sail.getFluidCoefs(mainAttack2, appVelocity)
+        swing = sail.mainArea * windPressure * dragCoef * np.sin(mainAttack) * sail.mainLength \
+            / sail.windPower * BASE_STEP_RATE
+        swing = np.sign(appAngle - absolute) * swing
+
+        pinned = (((limit <= mainAngle) & (mainAngle <= PI) & (swing >= 0)) |
+                  ((PI < mainAngle) & (mainAngle <= TWO_PI - limit) & (swing <= 0)))
+        swing = np.where(pinned, 0.0, swing)
+        appAngle = np.mod(appAngle + PI, TWO_PI)
+        boatAttack = np.abs(appAngle - boatAngle)
+        boatAttack = np.mod(np.where(boatAttack > PI, TWO_PI - boatAttack, boatAttack), TWO_PI)
+        appSquared = appVelocity * appVelocity
+        dragForce = (.5 * sail.mainArea) * dragCoef * sail.sealvlAirDens * appSquared
+        liftForce = (.5 * sail.mainArea) * liftCoef * sail.sealvlAirDens * appSquared
+        forwardForce = np.where(pinned, liftForce * np.sin(boatAttack) - dragForce * np.cos(boatAttack), 0.0)
+        self.forwardForce = forwardForce
+        acceleration = (forwardForce - WATER_RESISTANCE * boatVelocity) / BOAT_MASS
+
+        speed = boatVelocity * SPEED_SCALE * REFERENCE_DT
+        velX = np.sin(boatAngle) * speed
+        velZ = np.cos(boatAngle) * speed
+        length = np.sqrt(velX * velX + velZ * velZ)
+        cap = np.where(length > MAX_VEL, MAX_VEL / np.maximum(length, MAX_VEL), 1.0)
+        distance = ships.courseDistances(x, z)
+        self.courseDistance = distance
+        return acceleration, swing, velX * cap, velZ * cap, -(distance * distance) * BASE_STEP_RATE
+
+    def project(self, y):
+        boatVelocity, mainAngle, x, z, score = y
+        boatVelocity = np.maximum(boatVelocity, MIN_BOAT_VELOCITY)
+        mainAngle = np.clip(mainAngle, -self.limit, self.limit)
+        x, z = self.wrap(x, z)
+        return boatVelocity, mainAngle, x, z, score
+
+
+# sails the inputs for seconds with the integrator at stepRate; returns the
+# simulator, and the seconds and derivative evaluations it took. A tolerance
+# steps with AdaptiveRK held to it instead of the integrator's defaults
+def runWith(integratorName, stepRate, inputs, seconds, course, tolerance=None):
+    from headless import HeadlessSimulator
+    sim = HeadlessSimulator(course=course, dt=1.0 / stepRate, integrator=integratorName)
+    if tolerance is not None:
+        sim.model.integrator = AdaptiveRK(tolerance, tolerance)
+    evaluations = [0]
+    if integratorName is not None:
+        derivatives = sim.model.system.derivatives
+
+        def counted(t, y):
+            evaluations[0] += 1
+            return derivatives(t, y)
+        sim.model.system.derivatives = counted
+    start = time.perf_counter()
+    sim.run(inputs, maxTime=seconds)
+    return sim, time.perf_counter() - start, evaluations[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the integrators' accuracy and cost at several step rates")
+    parser.add_argument("--script", help="JSON list of timed input keyframes")
+    parser.add_argument("--time", type=float, default=30.0, help="seconds of race to sail")
+    parser.add_argument("--reference-tolerance", type=float, default=1e-12,
+                        help="tolerance of the adaptive race the others are measured against")
+    parser.add_argument("--rates", default="60,30,12,6", help="step rates to compare, per second")
+    args = parser.parse_args(argv)
+
+    from coursefile import loadCourse
+    from headless import ScriptedInputs, DEFAULT_DT
+    course = loadCourse()
+    inputs = ScriptedInputs.load(args.script) if args.script else None
+    reference, seconds, evaluations = runWith("adaptive", 1.0 / DEFAULT_DT, inputs, args.time, course,
+                                              args.reference_tolerance)
+    rows = []
+    for name in [None] + list(INTEGRATORS):
+        for rate in [int(rate) for rate in args.rates.split(",")]:
+            if name is None and rate != 60:
+                continue
+            sim, seconds, evaluations = runWith(name, rate, inputs, args.time, course)
+            rows.append({"integrator": name or "game", "stepRate": rate, "seconds": seconds,
+                         "evaluations": evaluations, "finished": sim.state.finished,
+                         "positionError": float(np.hypot(sim.state.x - reference.state.x,
+                                                         sim.state.z - reference.state.z)),
+                         "scoreError": abs(sim.state.score - reference.state.score)})
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
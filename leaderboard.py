@@ -0,0 +1,71 @@
+# Leaderboard - the high score table in data.db
+# One connection is kept open for the whole game, in write-ahead-log mode so
+# that reading the table never waits for a write. The statements are fixed
+# strings, so sqlite3 prepares each of them once and reuses it, and the top
+# scores are kept in memory until a new score is written.
+import sqlite3
+
+DB_PATH = "data.db"
+KEEP_SCORES = 5  # scores kept after pruning; the rest can never reach the table
+CACHED_SCORES = 5  # top scores held in memory
+
+CREATE_TABLE = "CREATE TABLE IF NOT EXISTS users(name TEXT, score NUMBER)"
+CREATE_INDEX = "CREATE INDEX IF NOT EXISTS users_score ON users(score DESC)"
+INSERT_SCORE = "INSERT INTO users(name, score) VALUES(?, ?)"
+SELECT_TOP = "SELECT name, score FROM users ORDER BY score DESC LIMIT ?"
+SELECT_ALL = "SELECT name, score FROM users ORDER BY score DESC"
+PRUNE = "DELETE FROM users WHERE rowid NOT IN (SELECT rowid FROM users ORDER BY score DESC LIMIT ?)"
+
+
+class Leaderboard:
+
+    # keep is how many scores prune() leaves; None keeps every score
+    def __init__(self, path=DB_PATH, keep=KEEP_SCORES, cachedScores=CACHED_SCORES, checkSameThread=True):
+        self.db = sqlite3.connect(path, check_same_thread=checkSameThread)
+        try:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            # with a write-ahead log this is still safe against crashes, and
+            # only a power cut can lose the last few commits
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            with self.db:
+                self.db.execute(CREATE_TABLE)
+                self.db.execute(CREATE_INDEX)
+        except sqlite3.Error:
+            # a locked database; the caller may try again with a new connection
+            self.db.close()
+            raise
+
+        self.keep = keep
+        self.cachedScores = cachedScores
+        self.cache = None
+        self.cacheLimit = 0  # rows asked for when the cache was filled
+
+    def submit(self, name, score):
+        self.submitMany([(name, score)])
+
+    # writes many (name, score) rows in one transaction, then prunes
+    def submitMany(self, rows):
+        with self.db:
+            self.db.executemany(INSERT_SCORE, rows)
+            if self.keep is not None:
+                self.db.execute(PRUNE, (self.keep,))
+        self.cache = None
+
+    # the n best (name, score) rows, best first
+    def top(self, n=CACHED_SCORES):
+        if self.cache is None or n > self.cacheLimit:
+            self.cacheLimit = max(self.cachedScores, n)
+            self.cache = self.db.execute(SELECT_TOP, (self.cacheLimit,)).fetchall()
+        return self.cache[:n]
+
+    def all(self):
+        return self.db.execute(SELECT_ALL).fetchall()
+
+    # removes every score below the best `keep`, in one statement
+    def prune(self, keep=None):
+        with self.db:
+            self.db.execute(PRUNE, (self.keep if keep is None else keep,))
+        self.cache = None
+
+    def close(self):
+        self.db.close()
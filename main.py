@@ -1,17 +1,28 @@
 # Sailing Simulator - A level coursework
 # Author: Ella Norman
 
+# taken before anything else is imported, so a startup profile counts the imports
+import time
+STARTED = time.perf_counter()
+
 # ShowBase class loads most of the other Panda3D modules
 from direct.showbase.ShowBase import ShowBase
 from direct.task.Task import Task
 # importing maths for physics engine
-from pandac.PandaModules import *
+from panda3d.core import *
 from direct.gui.DirectGui import *
-from panda3d.core import TextNode
 
-import sqlite3
+import argparse
+import atexit
+import os
+from datetime import datetime
 from ShipController import ShipController
+from shipmodel import START_SCORE, START_MAIN_SHEET
+from simclock import FixedStepClock, DEFAULT_STEP_RATE, DEFAULT_MAX_STEPS
+from profiler import FrameProfiler, StartupProfile
+from AssetCache import AssetCache
 from Scene import Scene
+from Hud import Hud
 
 # Constants that will control the behavior of the game. It is good to
 # group constants like this so that they can be changed once without
@@ -19,53 +30,115 @@ from Scene import Scene
 
 SPRITE_POS = 55  # At default field of view and a depth of 55, the screen
 
+SPRITE_MODEL = "models/plane"
+# the textures of the sprites that move, and of the background, which are read
+# in the background at startup; the course marks come from the static atlas
+SPRITE_TEXTURES = ("water.jpg", "arrow.png", "sailing_ship.png", "sail2.png")
+
+# physics steps per second, and the most steps run for one rendered frame;
+# both can be changed in Config.prc, e.g. "physics-rate 120"
+PHYSICS_RATE = ConfigVariableInt("physics-rate", DEFAULT_STEP_RATE)
+PHYSICS_MAX_STEPS = ConfigVariableInt("physics-max-steps", DEFAULT_MAX_STEPS)
+
+# the course raced, a JSON course file (see coursefile.py) or a compiled one;
+# empty means courses/default.json
+COURSE_FILE = ConfigVariableString("course-file", "")
+
+# wind that varies over the course and in time around the slider and arrow
+# values (see windfield.py), the same every race for the same seed
+WIND_FIELD = ConfigVariableBool("wind-field", False)
+WIND_FIELD_SEED = ConfigVariableInt("wind-field-seed", 0)
+
+# draws the fastest line to the finish for the wind (see router.py) over the
+# course, worked out again in the background whenever the wind changes
+ROUTE_OVERLAY = ConfigVariableBool("route-overlay", False)
+
+# boats sailed by the computer that race the player round the course (see
+# fleet.py), bumping into each other but not into the player's ship
+FLEET_SIZE = ConfigVariableInt("fleet-size", 0)
+
+# a race server (see raceserver.py) as "host:port" to race other players on;
+# its physics moves every boat and this game only sends the keys and draws
+NET_SERVER = ConfigVariableString("net-server", "")
+
+# the most times a second the on-screen text changes (see Hud.py); 0 changes
+# it on any frame that what it shows has changed
+HUD_RATE = ConfigVariableDouble("hud-rate", 0)
+
+# every race is written step by step to a run file in this folder
+RECORD_RUNS = ConfigVariableBool("record-runs", True)
+RECORD_DIR = ConfigVariableString("record-dir", "runs")
+
+# times every phase of the game loop; F9 switches it on and off and F10 prints
+# the results, which are also printed (and saved, if a file is named) on exit
+FRAME_PROFILER = ConfigVariableBool("frame-profiler", False)
+FRAME_PROFILE_FILE = ConfigVariableString("frame-profile-file", "")
+
 # start of class
 class SailingSimulator(ShowBase):
     # __init__ is an object constructor
-    def __init__(self):  # self is a special variable which refers to the class of the object
+    def __init__(self, startup=None):  # self is a special variable which refers to the class of the object
+        # a profiler.StartupProfile that each phase of starting up is timed with
+        self.startup = startup or StartupProfile(STARTED, enabled=False)
+        self.startup.mark("imports")
+
         # Initialize the ShowBase class from which we inherit, which will
         # create a window and sets up everything I need for rendering into it.
         ShowBase.__init__(self)
+        self.startup.mark("window")
+
+        # the physics runs at a fixed rate whatever the frame rate is
+        self.physicsClock = FixedStepClock(PHYSICS_RATE.getValue(), PHYSICS_MAX_STEPS.getValue())
+        self.profiler = FrameProfiler(enabled=FRAME_PROFILER.getValue())
+        self.accept("f9", self.profiler.toggle)
+        self.accept("f10", self.dumpProfile)
+
+        # models and textures are loaded once and shared by every sprite
+        self.assets = AssetCache(loader)
+        self.assets.preloadTextures(SPRITE_TEXTURES)
+
+        # the ship, the course and the high score database are all set up by
+        # loadGame, after the start screen has been drawn
+        self.loaded = False
+        self.loadSteps = [self.loadCourse, self.loadShip, self.loadScores]
+        self.shipController = None
+        self.windField = None
+        self.router = None
+        self.fleet = None
+        self.fleetDriver = None
+        self.fleetLayer = None
+        self.fleetWind = None
+        self.raceClient = None
+        self.remoteFleet = None
+        self.snapshotAge = 0.0
+        self.restarting = False
+        self.scoreWriter = None
+        self.highscores = []
 
-        self.shipController = ShipController(self)
-
-        self.highScoreTextRow = [10]
         self.scene = Scene(self)
 
         # Disable default mouse-based camera control. This is a method on the
         # ShowBase class from which we inherit.
         self.disableMouse()
+        self.setBackgroundColor((0, 0, 0, 1))
+
+        # coding in on screen text; the text is made once and only changed
+        # when what it shows changes
+        self.hud = Hud(HUD_RATE.getValue())
+        self.hud.addField("wind", base.a2dTopLeft, (2.2, -.06 * 2 - 0.1), lambda value: "Wind:" + str(int(value)), 12)
+        self.hud.addField("mainSheet", base.a2dTopLeft, (1.5, -.06 * 2 - 0.1),
+                          lambda value: "Main: " + str(int(value)), 10)
+        self.hud.addField("score", base.a2dTopLeft, (0.1, -.5 * 1.3 - 1.3),
+                          lambda value: "Score: " + str(int(value)), 0)
+        self.hud.addTable("highscores", base.a2dTopLeft, (0.10, -.1), "Highscores", .08)
 
-        self.scene.setup()
-
-        # This 'sprite' shows the direction of the wind to the user
-        self.wind_direction = self.loadObject("arrow.png", scale=2, depth=50)
-
-        self.wind_direction.setPos(11, 50, 11)
-        self.wind_direction.setR(90)
-
-        # coding in on screen text
         self.wind_strength = DirectSlider(range=(0, 100), value=12, command=self.show_wind_strength,
                                           pos=LPoint3(1, 1, 0.9), scale=0.2)
-        self.wind_strength_text = OnscreenText(text=str(int(self.wind_strength['value'])), parent=base.a2dTopLeft,
-                                               pos=(2.2, -.06 * 2 - 0.1),
-                                               fg=(1, 1, 1, 1), align=TextNode.ALeft, shadow=(0, 0, 0, 0.5), scale=.1)
 
         self.main_sheet_length = DirectSlider(range=(0, 100), value=10, command=self.show_main_sheet_length,
                                               pos=LPoint3(.3, 1, 0.9),
                                               scale=0.2)
 
-        self.main_sheet_length_text = OnscreenText(text=str(int(self.main_sheet_length['value'])),
-                                                   parent=base.a2dTopLeft,
-                                                   pos=(1.5, -.06 * 2 - 0.1),
-                                                   fg=(1, 1, 1, 1), align=TextNode.ALeft, shadow=(0, 0, 0, 0.5),
-                                                   scale=.1)
-
-        self.scoreText = OnscreenText(text="Score: 0", parent=base.a2dTopLeft,
-                                      pos=(0.1, -.5 * 1.3 - 1.3),
-                                      fg=(1, 1, 1, 1), align=TextNode.ALeft, shadow=(0, 0, 0, 0.5), scale=.1,
-                                      mayChange=True)
-
 
         # Created the task. taskMgr is the task manager that actually
         # calls the function each frame. The add method creates a new task.
@@ -77,51 +150,172 @@ class SailingSimulator(ShowBase):
 
         self.startButton = DirectButton(text=("Start Game"), scale=0.09, command=self.startGame)
 
-        self.showHighscoreTable()
+        # a run still being recorded when the game quits is written out
+        atexit.register(self.stopRecording)
+        atexit.register(self.dumpProfile)
+        self.startup.mark("start screen")
+
+        # igLoop draws the frame at sort 50, so these run straight after the
+        # first frame is on screen
+        taskMgr.add(self.firstFrameDrawn, "firstFrameDrawn", sort=55)
+        taskMgr.add(self.loadGameTask, "loadGame", sort=60)
+
+    def firstFrameDrawn(self, task):
+        self.startup.mark("first frame")
+        self.startup.firstFrame()
+        return Task.done
+
+    # loads one part of the game each frame, so the start screen keeps drawing
+    def loadGameTask(self, task):
+        if self.loadSteps:
+            self.loadSteps.pop(0)()
+        if self.loadSteps:
+            return Task.cont
+        self.finishLoading()
+        return Task.done
+
+    # everything the start screen does not need; startGame calls it too, in
+    # case the button is pressed before it has all loaded
+    def loadGame(self):
+        while self.loadSteps:
+            self.loadSteps.pop(0)()
+        self.finishLoading()
+
+    def finishLoading(self):
+        if not self.loaded:
+            self.loaded = True
+            self.startup.ready()
+
+    def loadCourse(self):
+        # the sprites below take their textures from the pool the preload
+        # thread fills, so it is finished with before any are made
+        self.assets.waitForPreload()
+        if COURSE_FILE.getValue():
+            self.scene.setup(COURSE_FILE.getValue())
+        else:
+            self.scene.setup()
+        # This 'sprite' shows the direction of the wind to the user
+        self.wind_direction = self.loadObject("arrow.png", scale=2, depth=50)
 
+        self.wind_direction.setPos(11, 50, 11)
+        self.wind_direction.setR(90)
+        if ROUTE_OVERLAY.getValue():
+            from router import LiveRouter
+            self.router = LiveRouter(self.scene.course)
+        self.startup.mark("course")
+
+    def loadShip(self):
+        if WIND_FIELD.getValue():
+            # imported here as it brings in numpy
+            from windfield import WindField
+            self.windField = WindField(WIND_FIELD_SEED.getValue())
+        self.shipController = ShipController(self)
+        if NET_SERVER.getValue():
+            self.loadNetwork(NET_SERVER.getValue())
+        elif FLEET_SIZE.getValue() > 0:
+            self.loadFleet(FLEET_SIZE.getValue())
         self.restartGame()
+        self.startup.mark("ship")
+
+    def loadFleet(self, count):
+        # imported here as they bring in numpy
+        from fleet import Fleet, CourseFollower
+        from FleetLayer import FleetLayer
+        windStrength, windHeading = self.wind_strength['value'], self.wind_direction.getR()
+        self.fleet = Fleet(self.scene.course, count, self.physicsClock.stepDt, windStrength, windHeading,
+                           self.windField)
+        self.fleetDriver = CourseFollower(self.fleet, windStrength=windStrength, windHeading=windHeading)
+        self.fleetWind = (windStrength, windHeading)
+        self.fleetLayer = FleetLayer(self, self.fleet)
+        self.fleetLayer.build(camera)
+
+    def loadNetwork(self, address):
+        # imported here as they bring in numpy
+        from raceclient import RaceClient, RemoteFleet
+        from FleetLayer import FleetLayer
+        host, port = address.rsplit(":", 1)
+        self.raceClient = RaceClient(host, int(port))
+        welcome = self.raceClient.connect()
+        atexit.register(self.raceClient.close)
+        if welcome.courseHash != self.scene.course.hash:
+            print("The server is racing a different course to " + self.scene.course.hexHash)
+        # every player races in the server's wind
+        self.wind_strength['value'] = welcome.windStrength
+        self.wind_direction.setR(welcome.windHeading)
+        self.remoteFleet = RemoteFleet(welcome.capacity, welcome.boat)
+        self.fleetLayer = FleetLayer(self, self.remoteFleet)
+        self.fleetLayer.build(camera)
+
+    def loadScores(self):
+        # scores are saved on a background thread, so the frame that ends a
+        # race does not wait for the database
+        from scorewriter import ScoreWriter
+        self.scoreWriter = ScoreWriter()
+        self.scoreWriter.requestTop(self.showHighscoreTable)
+        # any score still queued is saved when the game quits
+        atexit.register(self.scoreWriter.close)
+        self.startup.mark("scores")
 
     def restartGame(self):
-        self.score = 10000
-        self.main_sheet_length['value'] = 10
-        self.shipController.ship.setPos(-16, 50, 0)
-        self.shipController.ship.setR(170)
+        self.score = START_SCORE
+        self.main_sheet_length['value'] = START_MAIN_SHEET
+        self.shipController.reset(self.score)
+        if self.fleet is not None:
+            self.fleet.reset()
+            self.fleetDriver.reset()
+            self.fleetLayer.capture()
+            self.fleetLayer.render(1.0)
+        if self.raceClient is not None:
+            self.raceClient.restart()
+            self.restarting = True
+        self.physicsClock.reset()
 
     def finishGame(self):
+        # the table is redrawn once the score has been saved
         self.insertNewscore("Name", self.score)
-        self.showHighscoreTable()
-
-    def showHighscoreTable(self):
-        highscoreList = self.getHighscores()
-
-        self.highscoreTextHeading = OnscreenText(text="Highscores", parent=base.a2dTopLeft,
-                                                 pos=(0.10, -.1),
-                                                 fg=(1, 1, 1, 1), align=TextNode.ALeft, shadow=(0, 0, 0, 0.5), scale=.1,
-                                                 mayChange=True)
-        self.highScoreTextRow = []
-        for f in range(len(highscoreList)):
-            self.highScoreTextRow.append(
-                OnscreenText(text=highscoreList[f][0] + " " + str(int(highscoreList[f][1])), parent=base.a2dTopLeft,
-                             pos=(0.10, -.2 - (f * .08)),
-                             fg=(1, 1, 1, 1), align=TextNode.ALeft, shadow=(0, 0, 0, 0.5), scale=.1,
-                             mayChange=True))
 
-    def show_score(self):
-        self.scoreText['text'] = "Score: " + str(int(self.score))
+    def showHighscoreTable(self, highscoreList):
+        self.highscores = highscoreList
+        # the rows already on screen are given the new scores
+        self.hud.set("highscores", [name + " " + str(int(score)) for name, score in highscoreList])
 
     def startGame(self):
+        self.loadGame()
         self.restartGame()
+        self.startRecording()
         self.finished = False
         self.startButton.hide()
 
+    def startRecording(self):
+        self.stopRecording()
+        # a race on a server is not recorded, as its physics is not run here
+        if RECORD_RUNS.getValue() and self.raceClient is None:
+            # imported here as it brings in numpy, which the start screen does not need
+            from recorder import RunRecorder
+            path = os.path.join(RECORD_DIR.getValue(), datetime.now().strftime("run-%Y%m%d-%H%M%S-%f.sailrun"))
+            self.shipController.recorder = RunRecorder(path, {"dt": self.physicsClock.stepDt, "source": "game",
+                                                              "course": self.scene.course.hexHash,
+                                                              "windField": WIND_FIELD_SEED.getValue()
+                                                              if self.windField is not None else None})
+
+    def dumpProfile(self):
+        if self.profiler.frames.count:
+            self.profiler.dump(FRAME_PROFILE_FILE.getValue() or None)
+
+    def stopRecording(self):
+        if self.shipController is not None and self.shipController.recorder is not None:
+            self.shipController.recorder.close()
+            self.shipController.recorder = None
+
     def show_wind_strength(self):
-        self.wind_strength_text['text'] = "Wind:" + str(int(self.wind_strength['value']))
+        self.hud.set("wind", self.wind_strength['value'])
 
     def show_main_sheet_length(self):
-        self.main_sheet_length_text['text'] = "Main: " + str(int(self.main_sheet_length['value']))
+        self.hud.set("mainSheet", self.main_sheet_length['value'])
 
     def show_score(self):
-        self.scoreText['text'] = "Score: " + str(int(self.score))
+        self.hud.set("score", self.score)
+        self.hud.update(globalClock.getFrameTime())
 
 
 
@@ -136,37 +330,105 @@ class SailingSimulator(ShowBase):
         # signify that the task should continue running. If Task.done were
         # returned instead, the task would be removed and would no longer be
         # called every frame.
-        if self.finished:
+        # draw the high score table when the writer thread has sent new scores
+        if self.scoreWriter is not None:
+            self.scoreWriter.poll()
+        if self.router is not None:
+            self.updateRoute()
+        if self.finished or not self.loaded:
             self.startButton.show()
+            self.hud.update(globalClock.getFrameTime())
             return Task.cont
-        # update ship position
-        self.shipController.updateShip(dt, self.scene.curvePoints)
+        self.profiler.beginFrame()
+        if self.raceClient is not None:
+            alpha = self.updateNetwork(dt)
+        else:
+            # run as many fixed physics steps as the frame times have added up to,
+            # then draw the ship part way between the last two of them
+            for i in range(self.physicsClock.advance(dt)):
+                self.shipController.updateShip(self.physicsClock.stepDt, self.scene.courseIndex)
+                if self.fleet is not None:
+                    self.updateFleet()
+                if self.finished:
+                    self.stopRecording()
+                    self.finishGame()
+                    break
+            alpha = self.physicsClock.alpha
+        self.shipController.render(alpha)
+        if self.fleetLayer is not None:
+            self.fleetLayer.render(alpha)
+        self.profiler.mark("render")
         self.show_score()
+        self.profiler.mark("hud")
+        self.profiler.endFrame(dt)
         # Since every return is Task.cont, the task will
         return Task.cont
         # continue indefinitely
 
 
+    # one physics step of the computer's boats, in the wind the player has
+    def updateFleet(self):
+        wind = (self.wind_strength['value'], self.wind_direction.getR())
+        if wind != self.fleetWind:
+            self.fleetWind = wind
+            self.fleetDriver.setWind(*wind)
+        self.fleet.ships.windStrength[:] = wind[0]
+        self.fleet.ships.windHeading[:] = wind[1]
+        self.fleetLayer.capture()
+        self.fleetDriver.drive(self.fleet)
+        self.fleet.step()
+        self.profiler.mark("fleet")
+
+    # sends the keys held down to the race server and shows the newest
+    # snapshot it has sent; returns how far the frame is between the last two
+    # snapshots (0..1). Nothing is predicted, so the ship answers the keys a
+    # round trip to the server late
+    def updateNetwork(self, dt):
+        keys = self.shipController.keys
+        turn = 1 if keys["turnRight"] else -1 if keys["turnLeft"] else 0
+        sheet = -1 if keys["main_sheet_left"] else 1 if keys["main_sheet_right"] else 0
+        self.raceClient.setInput(turn, sheet)
+        self.profiler.mark("input")
+
+        snapshot = self.raceClient.poll()
+        if snapshot is None:
+            self.snapshotAge += dt
+        else:
+            tick, ids, fields = snapshot
+            self.snapshotAge = 0.0
+            self.fleetLayer.capture()
+            own = self.remoteFleet.apply(ids, fields)
+            # until the server has put the ship back on the start line, a
+            # finished ship is the race before the restart
+            if own is not None and not (self.restarting and own["finished"]):
+                self.restarting = False
+                state = self.shipController.state
+                self.shipController.previous = state.renderState()
+                for name in ("x", "z", "heading", "sailAngle", "boatVelocity", "mainSheetLength", "score"):
+                    setattr(state, name, own[name])
+                state.finished = bool(own["finished"])
+                self.main_sheet_length['value'] = state.mainSheetLength
+                self.score = state.score
+                if state.finished:
+                    self.finished = True
+                    self.finishGame()
+        self.profiler.mark("network")
+        return min(self.snapshotAge * self.raceClient.welcome.tickRate, 1.0)
+
+    # asks for a new suggested line when the wind has changed, and draws it once it is found
+    def updateRoute(self):
+        self.router.request(int(self.wind_strength['value']), self.wind_direction.getR())
+        if self.router.poll():
+            self.scene.drawRoute(self.router.route.points if self.router.route is not None else [])
+
     def insertNewscore(self, name, score):
-        # Insert user 1
-        cursor.execute('''INSERT INTO users(name,score) VALUES(?,?)''', (name, score))
-        print("New user score inserted")
-        db.commit()
-        self.keepTop5ScoresOnly()
-
-    def keepTop5ScoresOnly(self):
-        res = cursor.execute('''SELECT * FROM users order by score desc limit 5''')
-        results = res.fetchall()
-        if len(results) > 5:
-            lowestScore = results[len(results) - 1][2]
-            print (lowestScore)
-            cursor.execute('''DELETE FROM users WHERE score < ?''', (lowestScore,))
+        # the leaderboard drops everything below the top 5 as it writes
+        self.scoreWriter.submit(name, score, self.showHighscoreTable)
+        print("New user score queued")
 
+    # the top scores as last read by the writer thread
     def getHighscores(self):
-        cursor = db.cursor()
-        res = cursor.execute('''SELECT * FROM users order by score desc limit 5 ''')
-        highscores = res.fetchall()
-        return highscores
+        return self.highscores
 
 
     # This helps reduce the amount of code used by loading objects, since all of
@@ -174,9 +436,9 @@ class SailingSimulator(ShowBase):
     def loadObject(self, tex=None, pos=LPoint3(0, 0), depth=SPRITE_POS, scale=1,
                    transparency=True):
         # Every object uses the plane model and is parented to the camera
-        # so that it faces the screen.
-        obj = loader.loadModel("models/plane")
-        obj.reparentTo(camera)
+        # so that it faces the screen. The model is loaded once and every
+        # object is an instance of it.
+        obj = self.assets.instance(SPRITE_MODEL, camera)
 
         # Set the initial position and scale.
         obj.setPos(pos.getX(), depth, pos.getY())
@@ -192,24 +454,22 @@ class SailingSimulator(ShowBase):
             obj.setTransparency(TransparencyAttrib.MAlpha)
 
         if tex:
-            # Load and set the requested texture.
-            tex = loader.loadTexture("textures/" + tex)
-            obj.setTexture(tex, 1)
+            # Set the requested texture, loading it the first time it is used.
+            obj.setTexture(self.assets.texture(tex), 1)
 
         return obj
 
-db = sqlite3.connect('data.db')
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sailing Simulator")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long each phase of starting up takes")
+    args = parser.parse_args(argv)
 
+    # We now have everything we need. Make an instance of the class and start
+    # 3D rendering
+    sailingSimulator = SailingSimulator(StartupProfile(STARTED, enabled=args.profile_startup))
+    sailingSimulator.run()
 
-try:
-    cursor = db.cursor()
-    cursor.execute('''CREATE TABLE users(name TEXT, score NUMBER)''')
-    db.commit()
-    print("Table created")
-except:
-    print("Table already created")
 
-# We now have everything we need. Make an instance of the class and start
-# 3D rendering
-sailingSimulator = SailingSimulator()
-sailingSimulator.run()
+if __name__ == "__main__":
+    main()
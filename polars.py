@@ -0,0 +1,204 @@
+# Polar diagram generator - sweeps the sail model over true wind angle, wind
+# strength and main sheet length, runs every combination to a steady boat speed
+# and records the best sheet setting for each angle and wind.
+# Usage: python polars.py polar.npy [--angles 0:180:5] [--winds 5:100:5] [--sheets 0:100:5] [--workers 4]
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from sail import PI
+from sailbatch import SailBatch
+
+DEFAULT_CHUNK = 4096  # combinations stepped together by one worker
+DEFAULT_WINDOW = 600  # steps averaged for each speed reading (10 seconds at 60 Hz)
+DEFAULT_MAX_STEPS = 12000
+DEFAULT_TOLERANCE = .005  # relative change between readings that counts as steady
+
+
+def parseRange(text):
+    # "start:stop:step" including stop, or a comma separated list of values
+    if ":" in text:
+        start, stop, step = [float(part) for part in text.split(":")]
+        return np.arange(start, stop + step * .5, step)
+    return np.array([float(part) for part in text.split(",")])
+
+
+def steadySpeeds(angles, winds, sheets, window=DEFAULT_WINDOW, maxSteps=DEFAULT_MAX_STEPS,
+                 tolerance=DEFAULT_TOLERANCE):
+    # angles (degrees off the wind), winds (slider units) and sheets are arrays
+    # of the same length, one entry per run. The free mainsail flutters, so the
+    # speed is averaged over a window of steps and a run is steady once two
+    # windows in a row agree. Returns the last window's average boat speed, in
+    # the units Sail.update returns, and whether each run settled.
+    count = len(angles)
+    batch = SailBatch(count)
+    # the boat points along 0 and the wind blows from the given angle off its bow
+    windAngle = np.radians(angles) + PI
+    windVelocity = (np.asarray(winds, dtype=float) + .000001) / 1000.0
+    sheets = np.asarray(sheets, dtype=float)
+
+    previous = None
+    steady = np.zeros(count, dtype=bool)
+    for _ in range(max(maxSteps // window, 1)):
+        total = np.zeros(count)
+        for _ in range(window):
+            speed, _ = batch.update(windVelocity, windAngle, sheets, 0.0)
+            total += speed
+        average = total / window
+
+        if previous is not None:
+            steady = np.abs(average - previous) <= tolerance * np.maximum(np.abs(average), 1.0)
+            if steady.all():
+                break
+        previous = average
+
+    return average, steady
+
+
+def runChunk(task):
+    # one unit of work for the process pool
+    first, angles, winds, sheets, window, maxSteps, tolerance = task
+    speeds, steady = steadySpeeds(angles, winds, sheets, window, maxSteps, tolerance)
+    return first, speeds, steady
+
+
+class PolarSweep:
+
+    def __init__(self, angles, winds, sheets):
+        self.angles = np.asarray(angles, dtype=float)
+        self.winds = np.asarray(winds, dtype=float)
+        self.sheets = np.asarray(sheets, dtype=float)
+        self.shape = (len(self.angles), len(self.winds), len(self.sheets))
+
+    def tasks(self, done, chunkSize, window, maxSteps, tolerance):
+        angleIndex, windIndex, sheetIndex = np.indices(self.shape).reshape(3, -1)
+        total = angleIndex.size
+        for first in range(0, total, chunkSize):
+            last = min(first + chunkSize, total)
+            if done[first:last].all():
+                continue
+            yield (first, self.angles[angleIndex[first:last]], self.winds[windIndex[first:last]],
+                   self.sheets[sheetIndex[first:last]], window, maxSteps, tolerance)
+
+    # runs the sweep, writing each chunk to the .npy file at path as soon as
+    # it finishes; chunks already in the file from a sweep with the same axes
+    # and parameters are not run again
+    def run(self, path, workers=None, chunkSize=DEFAULT_CHUNK, window=DEFAULT_WINDOW,
+            maxSteps=DEFAULT_MAX_STEPS, tolerance=DEFAULT_TOLERANCE, progress=None):
+        speeds = self.openSpeeds(path, {"window": window, "maxSteps": maxSteps, "tolerance": tolerance})
+        flat = speeds.reshape(-1)
+        done = ~np.isnan(flat)
+        tasks = list(self.tasks(done, chunkSize, window, maxSteps, tolerance))
+
+        unsteady = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(runChunk, task) for task in tasks]
+            for finished, future in enumerate(as_completed(futures), 1):
+                first, chunkSpeeds, steady = future.result()
+                flat[first:first + len(chunkSpeeds)] = chunkSpeeds
+                speeds.flush()
+                unsteady += int((~steady).sum())
+                if progress is not None:
+                    progress(finished, len(futures))
+
+        result = PolarResult(self.angles, self.winds, self.sheets, np.array(speeds))
+        del speeds
+        result.save(path)
+        return result, unsteady
+
+    def openSpeeds(self, path, parameters):
+        # unfinished entries are NaN, so an interrupted sweep can carry on; the
+        # axes and parameters it was started with are kept in name.sweep.json,
+        # and a file from a sweep with different ones is started again
+        headerPath = os.path.splitext(path)[0] + ".sweep.json"
+        header = {"angles": self.angles.tolist(), "winds": self.winds.tolist(), "sheets": self.sheets.tolist()}
+        header.update(parameters)
+        if os.path.exists(path) and os.path.exists(headerPath):
+            with open(headerPath) as file:
+                try:
+                    same = json.load(file) == header
+                except ValueError:
+                    same = False
+            if same:
+                speeds = np.load(path, mmap_mode="r+")
+                if speeds.shape == self.shape:
+                    return speeds
+        speeds = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=self.shape)
+        speeds[:] = np.nan
+        speeds.flush()
+        with open(headerPath, "w") as file:
+            json.dump(header, file)
+        return speeds
+
+
+class PolarResult:
+
+    def __init__(self, angles, winds, sheets, speeds):
+        self.angles = angles
+        self.winds = winds
+        self.sheets = sheets
+        self.speeds = speeds  # [angle, wind, sheet]
+
+        # the polar is the best speed over every sheet setting; an angle and
+        # wind with no speed at any setting is NaN in both
+        missing = np.isnan(speeds)
+        unknown = missing.all(axis=2)
+        bestIndex = np.where(missing, -np.inf, speeds).argmax(axis=2)
+        self.bestSheet = np.where(unknown, np.nan, sheets[bestIndex])  # [angle, wind]
+        self.polar = np.where(unknown, np.nan, np.take_along_axis(speeds, bestIndex[..., None], axis=2)[..., 0])
+
+    # the axes, polar and best sheet go beside the raw speeds, in name.polar.npz
+    def save(self, path):
+        np.savez(os.path.splitext(path)[0] + ".polar.npz", angles=self.angles, winds=self.winds,
+                 sheets=self.sheets, polar=self.polar, bestSheet=self.bestSheet)
+
+    @classmethod
+    def load(cls, path):
+        speeds = np.load(path)
+        with np.load(os.path.splitext(path)[0] + ".polar.npz") as axes:
+            return cls(axes["angles"], axes["winds"], axes["sheets"], speeds)
+
+    def speedAt(self, angle, wind):
+        # best speed for a true wind angle and wind strength, from the nearest
+        # wind column and interpolated across angle
+        angle = abs((angle + 180) % 360 - 180)
+        column = int(np.abs(self.winds - wind).argmin())
+        return float(np.interp(angle, self.angles, self.polar[:, column]))
+
+    def sheetAt(self, angle, wind):
+        # the sheet setting that gave that speed, from the nearest angle row
+        angle = abs((angle + 180) % 360 - 180)
+        column = int(np.abs(self.winds - wind).argmin())
+        return float(self.bestSheet[int(np.abs(self.angles - angle).argmin()), column])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep the sail model into boat speed polars")
+    parser.add_argument("output", help=".npy file for the speeds; the polar goes in a .polar.npz beside it")
+    parser.add_argument("--angles", default="0:180:5", help="true wind angles in degrees, start:stop:step")
+    parser.add_argument("--winds", default="5:100:5", help="wind strengths (slider units), start:stop:step")
+    parser.add_argument("--sheets", default="0:100:5", help="main sheet lengths, start:stop:step")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="combinations per work unit")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="steps averaged per speed reading")
+    parser.add_argument("--max-steps", type=int, default=DEFAULT_MAX_STEPS)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    sweep = PolarSweep(parseRange(args.angles), parseRange(args.winds), parseRange(args.sheets))
+    result, unsteady = sweep.run(args.output, args.workers, args.chunk, args.window, args.max_steps,
+                                 args.tolerance,
+                                 progress=lambda done, total: print("chunk %d/%d" % (done, total)))
+
+    print("angle  " + " ".join("%8g" % wind for wind in result.winds))
+    for i, angle in enumerate(result.angles):
+        print("%5g  " % angle + " ".join("%8.1f" % speed for speed in result.polar[i]))
+    if unsteady:
+        print("%d runs had not settled after %d steps" % (unsteady, args.max_steps))
+
+
+if __name__ == "__main__":
+    main()
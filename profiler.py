@@ -0,0 +1,180 @@
+# Frame profiler - times each phase of the game loop with very little overhead
+# The time between two mark() calls is added to the phase named by the second
+# one, and at the end of a frame every phase's total goes into a fixed-size
+# ring buffer, so percentiles and a frame time histogram cover the last
+# `size` frames. While disabled the timing calls do nothing at all.
+import json
+import time
+from array import array
+
+DEFAULT_SIZE = 3600  # frames kept, a minute at 60 frames per second
+HISTOGRAM_BIN_MS = 2  # frame time histogram bin width
+HISTOGRAM_BINS = 25  # the last bin also counts every longer frame
+FRAME_BUDGET_MS = 1000 / 60.0  # frames longer than this are counted as hitches
+PERCENTILES = (50, 95, 99)
+
+
+class RingBuffer:
+
+    def __init__(self, size):
+        self.values = array("d", bytes(8 * size))
+        self.size = size
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def contents(self):
+        if self.count < self.size:
+            return self.values[:self.count]
+        return self.values[self.index:] + self.values[:self.index]
+
+
+def percentile(sortedValues, p):
+    if not sortedValues:
+        return 0.0
+    rank = min(int(len(sortedValues) * p / 100.0), len(sortedValues) - 1)
+    return sortedValues[rank]
+
+
+class FrameProfiler:
+
+    def __init__(self, size=DEFAULT_SIZE, enabled=True):
+        self.size = size
+        self.frames = RingBuffer(size)
+        self.phases = {}  # phase name -> RingBuffer of seconds per frame
+        self.current = {}  # phase name -> seconds so far this frame
+        self.last = 0.0
+        self.setEnabled(enabled)
+
+    def setEnabled(self, enabled):
+        # the hot calls are swapped for ones that do nothing, rather than
+        # checking a flag every time they are called
+        self.enabled = enabled
+        if enabled:
+            self.beginFrame = self.timedBeginFrame
+            self.mark = self.timedMark
+            self.endFrame = self.timedEndFrame
+        else:
+            self.beginFrame = self.mark = self.endFrame = self.skip
+        self.current = {}
+
+    def toggle(self):
+        self.setEnabled(not self.enabled)
+
+    def skip(self, *args):
+        pass
+
+    def timedBeginFrame(self):
+        self.last = time.perf_counter()
+
+    # adds the time since the last mark (or the start of the frame) to phase
+    def timedMark(self, phase):
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0.0) + (now - self.last)
+        self.last = now
+
+    # frameDt is the whole frame's time, rendering included
+    def timedEndFrame(self, frameDt):
+        self.frames.append(frameDt)
+        for phase, ring in self.phases.items():
+            ring.append(self.current.pop(phase, 0.0))
+        for phase, seconds in self.current.items():
+            # a phase seen for the first time; earlier frames count as zero
+            ring = self.phases[phase] = RingBuffer(self.size)
+            for _ in range(self.frames.count - 1):
+                ring.append(0.0)
+            ring.append(seconds)
+        self.current = {}
+
+    def report(self):
+        frames = sorted(self.frames.contents())
+        histogram = [0] * HISTOGRAM_BINS
+        for seconds in frames:
+            histogram[min(int(seconds * 1000 / HISTOGRAM_BIN_MS), HISTOGRAM_BINS - 1)] += 1
+
+        def summary(values):
+            values = sorted(values)
+            result = {"p%d" % p: percentile(values, p) * 1000 for p in PERCENTILES}
+            result["mean"] = sum(values) / len(values) * 1000 if values else 0.0
+            result["max"] = values[-1] * 1000 if values else 0.0
+            return result
+
+        return {"frames": len(frames),
+                "hitches": sum(1 for seconds in frames if seconds * 1000 > FRAME_BUDGET_MS),
+                "frameMs": summary(frames),
+                "phaseMs": {phase: summary(ring.contents()) for phase, ring in self.phases.items()},
+                "histogram": {"binMs": HISTOGRAM_BIN_MS, "counts": histogram}}
+
+    def dump(self, path=None):
+        # prints the report, and writes it as JSON when a path is given
+        report = self.report()
+        lines = ["frame profile over %d frames, %d over %.1f ms" % (report["frames"], report["hitches"],
+                                                                   FRAME_BUDGET_MS),
+                 "%-10s %8s %8s %8s %8s %8s" % ("phase (ms)", "p50", "p95", "p99", "mean", "max")]
+        rows = [("frame", report["frameMs"])] + sorted(report["phaseMs"].items())
+        for name, stats in rows:
+            lines.append("%-10s %8.3f %8.3f %8.3f %8.3f %8.3f" % (name, stats["p50"], stats["p95"],
+                                                                  stats["p99"], stats["mean"], stats["max"]))
+        counts = report["histogram"]["counts"]
+        biggest = max(counts) if counts and max(counts) else 1
+        for i, count in enumerate(counts):
+            if count:
+                label = "%3d-%-3d ms" % (i * HISTOGRAM_BIN_MS, (i + 1) * HISTOGRAM_BIN_MS)
+                if i == len(counts) - 1:
+                    label = "%3d+    ms" % (i * HISTOGRAM_BIN_MS)
+                lines.append("%s %6d %s" % (label, count, "#" * max(1, count * 40 // biggest)))
+        print("\n".join(lines))
+
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+        return report
+
+
+class StartupProfile:
+    # times the one-off phases of starting the game; each mark() ends the
+    # phase named, which began at the previous mark or at `started`
+
+    def __init__(self, started=None, enabled=True):
+        self.started = self.last = time.perf_counter() if started is None else started
+        self.enabled = enabled
+        self.phases = []  # (phase name, seconds)
+        self.firstFrameTime = None
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def firstFrame(self):
+        self.firstFrameTime = self.last - self.started
+
+    # called once everything has loaded; prints the report when enabled
+    def ready(self):
+        if self.enabled:
+            self.dump()
+
+    def report(self):
+        return {"phaseMs": [(phase, seconds * 1000) for phase, seconds in self.phases],
+                "firstFrameMs": None if self.firstFrameTime is None else self.firstFrameTime * 1000,
+                "readyMs": (self.last - self.started) * 1000}
+
+    def dump(self):
+        report = self.report()
+        lines = ["startup profile"]
+        for phase, ms in report["phaseMs"]:
+            lines.append("%-14s %9.1f ms" % (phase, ms))
+        if report["firstFrameMs"] is not None:
+            lines.append("%-14s %9.1f ms" % ("first frame at", report["firstFrameMs"]))
+        lines.append("%-14s %9.1f ms" % ("ready at", report["readyMs"]))
+        print("\n".join(lines))
+        return report
+
+
+# stands in for a profiler wherever none is switched on
+NULL_PROFILER = FrameProfiler(size=1, enabled=False)
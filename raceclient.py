@@ -0,0 +1,214 @@
+# Race client - sails a boat in a raceserver.py race
+# RaceClient talks to the server on an asyncio event loop of its own thread,
+# so the game's frame never waits for the network. The game sets the keys it
+# has down with setInput, and poll() hands it the newest snapshot the server
+# has sent, if there is one it has not seen. Each snapshot is decoded against
+# the earlier one the server built it from, which the client has kept, and is
+# acknowledged with the keys, so the server can send the next as a delta of it.
+#
+# RemoteFleet holds the boats of the snapshots in the arrays FleetLayer draws
+# a fleet.Fleet from, so the other players are drawn the way the computer's
+# boats are.
+#
+# Run by itself, it connects bots that sail with random keys and reports how
+# big the snapshots they were sent were, next to the same boats as JSON.
+# Usage: python raceclient.py [--host 127.0.0.1] [--port 7777] [--bots 8] [--seconds 10]
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import numpy as np
+
+from raceserver import (DEFAULT_HOST, DEFAULT_PORT, HISTORY_TICKS, NAME_LENGTH, HELLO, WELCOME, INPUT, SNAPSHOT,
+                        RESTART, FULL, WELCOME_FORMAT, INPUT_FORMAT, NO_TICK, FIELD_NAMES, frame, readMessage,
+                        decodeSnapshot, dequantize)
+
+CONNECT_TIMEOUT = 5.0  # seconds to wait for the server's welcome
+
+
+class Welcome:
+
+    def __init__(self, payload):
+        (self.boat, self.capacity, self.tickRate, self.dt, self.windStrength, self.windHeading,
+         self.courseHash) = WELCOME_FORMAT.unpack(payload)
+
+
+class RaceClient:
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, name="Player"):
+        self.host = host
+        self.port = port
+        self.name = name
+        self.welcome = None
+        self.welcomed = threading.Event()
+        self.error = None  # why the connection ended, if it has
+        self.history = {}  # tick -> (ids, values) of the snapshots decoded
+        self.latest = None
+        self.lock = threading.Lock()
+        self.turn = 0
+        self.sheet = 0
+        self.ack = NO_TICK
+        self.snapshots = 0
+        self.snapshotBytes = 0
+        self.loop = asyncio.new_event_loop()
+        self.writer = None
+        self.thread = threading.Thread(target=self.run, name="RaceClient", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.talk())
+        except (OSError, asyncio.IncompleteReadError, ValueError) as error:
+            self.error = error
+        finally:
+            self.welcomed.set()
+            self.loop.close()
+
+    async def talk(self):
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(frame(HELLO, self.name.encode("utf-8")[:NAME_LENGTH]))
+        messageType, payload = await readMessage(reader)
+        if messageType == FULL:
+            raise ConnectionError("the race is full")
+        if messageType != WELCOME:
+            raise ValueError("expected a welcome, not message %d" % messageType)
+        self.welcome = Welcome(payload)
+        self.welcomed.set()
+
+        while True:
+            messageType, payload = await readMessage(reader)
+            if messageType != SNAPSHOT:
+                continue
+            self.snapshots += 1
+            self.snapshotBytes += len(payload)
+            try:
+                tick, ids, values = decodeSnapshot(payload, self.history.get)
+            except KeyError:
+                # built on a snapshot that is no longer kept: ask for a whole one
+                self.ack = NO_TICK
+                self.sendInput()
+                continue
+            self.history[tick] = (ids, values)
+            self.history.pop(tick - HISTORY_TICKS, None)
+            with self.lock:
+                self.latest = (tick, ids, values)
+            self.ack = tick
+            self.sendInput()
+
+    # waits for the server to welcome the player; returns the Welcome
+    def connect(self, timeout=CONNECT_TIMEOUT):
+        if not self.welcomed.wait(timeout):
+            raise TimeoutError("no welcome from %s:%d" % (self.host, self.port))
+        if self.welcome is None:
+            raise ConnectionError("could not join %s:%d: %s" % (self.host, self.port, self.error))
+        return self.welcome
+
+    def sendInput(self):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(frame(INPUT, INPUT_FORMAT.pack(self.ack, self.turn, self.sheet)))
+
+    # the keys held down: turn and sheet are -1, 0 or 1 each
+    def setInput(self, turn, sheet):
+        if (turn, sheet) != (self.turn, self.sheet):
+            self.turn, self.sheet = turn, sheet
+            self.call(self.sendInput)
+
+    # back to the start line
+    def restart(self):
+        self.call(lambda: self.writer.write(frame(RESTART)))
+
+    def call(self, function):
+        if self.writer is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(function)
+
+    # the newest snapshot as (tick, boat ids, {field name: array}) if one has
+    # come since the last call, otherwise None
+    def poll(self):
+        with self.lock:
+            latest, self.latest = self.latest, None
+        if latest is None:
+            return None
+        tick, ids, values = latest
+        return tick, ids, dequantize(values)
+
+    def close(self):
+        if self.writer is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.writer.close)
+        self.thread.join(1.0)
+
+
+# the other players' boats, as FleetLayer draws them
+class RemoteFleet:
+
+    def __init__(self, capacity, ownBoat):
+        self.count = capacity
+        self.ownBoat = ownBoat
+        self.ships = RemoteShips(capacity)
+        self.visible = np.zeros(capacity, dtype=bool)
+
+    # a polled snapshot's boats; returns the player's own boat's fields, or
+    # None if it is not in the snapshot
+    def apply(self, ids, fields):
+        for name in ("x", "z", "heading", "sailAngle"):
+            getattr(self.ships, name)[ids] = fields[name]
+        self.visible[:] = False
+        self.visible[ids] = True
+        self.visible[self.ownBoat] = False
+        own = np.flatnonzero(ids == self.ownBoat)
+        if not len(own):
+            return None
+        return {name: fields[name][own[0]] for name in FIELD_NAMES}
+
+
+class RemoteShips:
+
+    def __init__(self, capacity):
+        self.x = np.zeros(capacity)
+        self.z = np.zeros(capacity)
+        self.heading = np.zeros(capacity)
+        self.sailAngle = np.zeros(capacity)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Race bots against each other on a race server")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="server address")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="server port")
+    parser.add_argument("--bots", type=int, default=8, help="bots to connect")
+    parser.add_argument("--seconds", type=float, default=10.0, help="how long they sail for")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the bots' keys")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    bots = [RaceClient(args.host, args.port, "bot%d" % i) for i in range(args.bots)]
+    for bot in bots:
+        bot.connect()
+    jsonBytes = 0
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end:
+        for bot in bots:
+            if rng.random() < .1:
+                bot.setInput(int(rng.integers(-1, 2)), int(rng.integers(-1, 2)))
+        latest = bots[0].poll()
+        if latest is not None:
+            tick, ids, fields = latest
+            jsonBytes = len(json.dumps({"tick": tick, "boats": [
+                {name: float(fields[name][i]) for name in FIELD_NAMES} for i in range(len(ids))]}))
+        time.sleep(.05)
+    for bot in bots:
+        bot.close()
+
+    snapshots = sum(bot.snapshots for bot in bots)
+    snapshotBytes = sum(bot.snapshotBytes for bot in bots)
+    print(json.dumps({
+        "bots": args.bots,
+        "snapshots": snapshots,
+        "bytesPerSnapshot": snapshotBytes / snapshots if snapshots else None,
+        "jsonBytesPerSnapshot": jsonBytes,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+# Race server - one authoritative simulation that many players race in
+# Every connected player sails a boat of a vecenv.ShipBatch, so the boats
+# move and score as the game's ship does. The server steps them at a fixed
+# tick on an asyncio event loop, taking each player's keys as they arrive and
+# sending every player a snapshot of all the boats once a tick. The physics,
+# and the encoding of the snapshots, run on a thread of their own, so the
+# event loop goes on reading and writing sockets while a tick is worked out.
+#
+# A snapshot holds each boat's state rounded to integers (see FIELDS), as the
+# difference from the last snapshot that player said it had received, which
+# it keeps; boats that did not change are left out, and of the rest only the
+# fields that changed are sent, as zigzag varints. A player with no snapshot
+# yet, or one too old to still be kept here, gets every field of every boat.
+# A player whose socket is backed up misses snapshots until it has caught up,
+# which only makes its next delta a little bigger.
+#
+# Messages are a uint32 length and a type byte, then the message itself;
+# everything is little-endian.
+# Usage: python raceserver.py [--host 127.0.0.1] [--port 7777] [--tick-rate 30] [--course courses/default.json]
+#                             [--wind 12] [--wind-heading 90] [--wind-field SEED]
+import argparse
+import asyncio
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from coursefile import loadCourse, DEFAULT_COURSE_FILE
+from headless import DEFAULT_DT, DEFAULT_WIND_STRENGTH, DEFAULT_WIND_HEADING
+from shipmodel import TURN_RATE
+from vecenv import ShipBatch, SHEET_RATE
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7777
+DEFAULT_TICK_RATE = 30  # snapshots a second; the physics takes several fixed steps each tick
+MAX_BOATS = 64  # boat numbers are sent as single bytes
+HISTORY_TICKS = 64  # snapshots kept to send deltas against
+MAX_BEHIND_TICKS = 5  # a server further behind than this skips the lost ticks rather than racing through them
+WRITE_BUFFER_LIMIT = 64 * 1024  # bytes waiting to go to a player before its snapshots are skipped
+NAME_LENGTH = 32
+MAX_MESSAGE = 1 << 20
+
+# message types
+HELLO = 1  # player -> server: the player's name
+WELCOME = 2  # server -> player: WELCOME_FORMAT
+INPUT = 3  # player -> server: INPUT_FORMAT, sent for every snapshot and whenever the keys change
+SNAPSHOT = 4  # server -> player: see encodeSnapshot
+RESTART = 5  # player -> server: back to the start line
+FULL = 6  # server -> player: no boat free, and the connection is closed
+
+FRAME = struct.Struct("<IB")  # length of what follows the length, type
+# the player's boat, how many boats there can be, ticks a second, the
+# physics step, the wind strength and heading, and the course's content hash
+WELCOME_FORMAT = struct.Struct("<BBHddd20s")
+# the last snapshot's tick, then the turn and main sheet keys: -1, 0 or 1 each
+INPUT_FORMAT = struct.Struct("<Ibb")
+# the tick, the tick it is a delta from, boats that changed, boats that are gone
+SNAPSHOT_HEADER = struct.Struct("<IIBB")
+NO_TICK = 0xFFFFFFFF  # no snapshot to send a delta against
+
+# each boat's state as sent: the ShipBatch array, and what it is multiplied
+# by before being rounded
+FIELDS = (("x", 1024), ("z", 1024), ("heading", 100), ("sailAngle", 100), ("boatVelocity", 100),
+          ("mainSheetLength", 100), ("score", 1), ("finished", 1))
+FIELD_NAMES = tuple(name for name, scale in FIELDS)
+FIELD_SCALES = np.array([scale for name, scale in FIELDS], dtype=float)
+FIELD_BITS = 1 << np.arange(len(FIELDS))
+
+
+def frame(messageType, payload=b""):
+    return FRAME.pack(len(payload) + 1, messageType) + payload
+
+
+async def readMessage(reader):
+    length, messageType = FRAME.unpack(await reader.readexactly(FRAME.size))
+    if length < 1 or length > MAX_MESSAGE:
+        raise ValueError("bad message length %d" % length)
+    return messageType, await reader.readexactly(length - 1)
+
+
+# the chosen boats' state as a (boats, fields) array of integers
+def quantize(ships, boats):
+    values = np.empty((len(boats), len(FIELDS)))
+    for column, name in enumerate(FIELD_NAMES):
+        values[:, column] = getattr(ships, name)[boats]
+    return np.rint(values * FIELD_SCALES).astype(np.int64)
+
+
+# quantized values back to {field name: array}
+def dequantize(values):
+    return {name: values[:, column] / FIELD_SCALES[column] for column, name in enumerate(FIELD_NAMES)}
+
+
+# signed integers as zigzag varints: seven bits a byte, low bits first, the
+# top bit set on every byte but a number's last
+def encodeVarints(values):
+    values = np.asarray(values, dtype=np.int64)
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+    lengths = np.ones(len(zigzag), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        lengths += zigzag >= (np.uint64(1) << np.uint64(shift))
+    starts = np.cumsum(lengths) - lengths
+    out = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    for byte in range(int(lengths.max()) if len(lengths) else 0):
+        has = lengths > byte
+        chunk = (zigzag[has] >> np.uint64(7 * byte)) & np.uint64(0x7f)
+        more = np.where(lengths[has] > byte + 1, 0x80, 0)
+        out[starts[has] + byte] = chunk.astype(np.uint8) | more
+    return out.tobytes()
+
+
+def decodeVarints(data, count):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)
+    if len(ends) < count:
+        raise ValueError("snapshot is cut short")
+    ends = ends[:count]
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+    zigzag = np.zeros(count, dtype=np.uint64)
+    for byte in range(int((ends - starts).max()) + 1 if count else 0):
+        has = starts + byte <= ends
+        zigzag[has] |= (raw[starts[has] + byte] & np.uint64(0x7f)).astype(np.uint64) << np.uint64(7 * byte)
+    values = (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+    return values, int(ends[-1]) + 1 if count else 0
+
+
+# the boats' values (ids ascending) as a delta from the snapshot at baseTick,
+# whose boats were baseIds with baseValues; baseTick is NO_TICK for a full one
+def encodeSnapshot(tick, ids, values, baseTick=NO_TICK, baseIds=None, baseValues=None):
+    if baseIds is None:
+        baseIds = np.zeros(0, dtype=np.int64)
+        baseValues = np.zeros((0, len(FIELDS)), dtype=np.int64)
+    inBase = np.isin(ids, baseIds)
+    base = np.zeros_like(values)
+    base[inBase] = baseValues[np.searchsorted(baseIds, ids[inBase])]
+    deltas = values - base
+    masks = (deltas != 0) @ FIELD_BITS
+    # a boat new since the base is sent even if every field happens to be 0
+    changed = (masks != 0) | ~inBase
+    gone = baseIds[~np.isin(baseIds, ids)]
+    deltas = deltas[changed]
+    return (SNAPSHOT_HEADER.pack(tick, baseTick, int(changed.sum()), len(gone)) +
+            gone.astype(np.uint8).tobytes() + ids[changed].astype(np.uint8).tobytes() +
+            masks[changed].astype(np.uint8).tobytes() + encodeVarints(deltas[deltas != 0]))
+
+
+# a snapshot back to (tick, ids, values); base(tick) gives the (ids, values)
+# of an earlier snapshot, or None when it is not known
+def decodeSnapshot(data, base):
+    tick, baseTick, changedCount, goneCount = SNAPSHOT_HEADER.unpack_from(data)
+    offset = SNAPSHOT_HEADER.size
+    gone = np.frombuffer(data, dtype=np.uint8, count=goneCount, offset=offset).astype(np.int64)
+    offset += goneCount
+    changedIds = np.frombuffer(data, dtype=np.uint8, count=changedCount, offset=offset).astype(np.int64)
+    offset += changedCount
+    masks = np.frombuffer(data, dtype=np.uint8, count=changedCount, offset=offset).astype(np.int64)
+    offset += changedCount
+
+    if baseTick == NO_TICK:
+        baseIds = np.zeros(0, dtype=np.int64)
+        baseValues = np.zeros((0, len(FIELDS)), dtype=np.int64)
+    else:
+        known = base(baseTick)
+        if known is None:
+            raise KeyError("snapshot %d is a delta from %d, which is not kept" % (tick, baseTick))
+        baseIds, baseValues = known
+
+    present = (masks[:, None] & FIELD_BITS) != 0
+    deltas = np.zeros((changedCount, len(FIELDS)), dtype=np.int64)
+    deltas[present], used = decodeVarints(data[offset:], int(present.sum()))
+    if offset + used != len(data):
+        raise ValueError("snapshot %d has %d bytes left over" % (tick, len(data) - offset - used))
+
+    kept = ~np.isin(baseIds, gone)
+    ids = np.union1d(baseIds[kept], changedIds)
+    values = np.zeros((len(ids), len(FIELDS)), dtype=np.int64)
+    values[np.searchsorted(ids, baseIds[kept])] = baseValues[kept]
+    values[np.searchsorted(ids, changedIds)] += deltas
+    return tick, ids, values
+
+
+class Player:
+
+    def __init__(self, boat, name, writer):
+        self.boat = boat
+        self.name = name
+        self.writer = writer
+        self.ack = NO_TICK  # the last snapshot it has said it received
+
+
+class RaceServer:
+
+    def __init__(self, course, capacity=MAX_BOATS, dt=DEFAULT_DT, tickRate=DEFAULT_TICK_RATE,
+                 windStrength=DEFAULT_WIND_STRENGTH, windHeading=DEFAULT_WIND_HEADING, windField=None):
+        if capacity > MAX_BOATS:
+            raise ValueError("at most %d boats" % MAX_BOATS)
+        self.course = course
+        self.capacity = capacity
+        self.dt = dt
+        self.tickRate = tickRate
+        self.stepsPerTick = max(1, int(round(1.0 / (tickRate * dt))))
+        self.windStrength = windStrength
+        self.windHeading = windHeading
+        self.ships = ShipBatch(capacity, course, dt, windStrength, windHeading, windField)
+
+        # only the physics thread changes these, and the ships
+        self.active = np.zeros(capacity, dtype=bool)
+        self.history = {}  # tick -> (ids, values) of the snapshots that can still be a base
+        self.tick = 0
+
+        # only the event loop changes these; the physics gets copies each tick
+        self.players = {}  # boat -> Player
+        self.turn = np.zeros(capacity)
+        self.sheet = np.zeros(capacity)
+        self.events = []  # ("join" | "leave" | "restart", boat) waiting for the next tick
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="RacePhysics")
+        self.server = None
+        self.sentBytes = 0
+        self.skipped = 0  # snapshots not sent as the player's socket was backed up
+
+    # one tick on the physics thread: the joins, leaves and restarts, the
+    # physics steps, and a snapshot for each player, delta encoded from the
+    # tick it has acknowledged. Returns {boat: message}
+    def simulate(self, events, turn, sheet, acks):
+        ships = self.ships
+        for event, boat in events:
+            mask = np.arange(self.capacity) == boat
+            if event in ("join", "restart"):
+                ships.reset(mask)
+            self.active[boat] = event != "leave"
+
+        dt = self.dt
+        for step in range(self.stepsPerTick):
+            # a boat that has finished, or has no player, stays where it is
+            # with the score it had
+            held = ~self.active | ships.finished
+            x, z, score = ships.x.copy(), ships.z.copy(), ships.score.copy()
+            ships.step(turn * TURN_RATE * dt, sheet * SHEET_RATE * dt)
+            if held.any():
+                ships.score[held] = score[held]
+                x[~held], z[~held] = ships.x[~held], ships.z[~held]
+                ships.place(x, z)
+
+        self.tick += 1
+        ids = np.flatnonzero(self.active)
+        values = quantize(ships, ids)
+        self.history[self.tick] = (ids, values)
+        self.history.pop(self.tick - HISTORY_TICKS, None)
+
+        # players that have acknowledged the same tick are sent the same message
+        messages = {}
+        encoded = {}
+        for boat, ack in acks.items():
+            if ack not in self.history:
+                ack = NO_TICK
+            if ack not in encoded:
+                if ack == NO_TICK:
+                    encoded[ack] = frame(SNAPSHOT, encodeSnapshot(self.tick, ids, values))
+                else:
+                    encoded[ack] = frame(SNAPSHOT, encodeSnapshot(self.tick, ids, values, ack, *self.history[ack]))
+            messages[boat] = encoded[ack]
+        return messages
+
+    async def tickLoop(self):
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.tickRate
+        nextTick = loop.time()
+        while True:
+            events, self.events = self.events, []
+            acks = {boat: player.ack for boat, player in self.players.items()}
+            messages = await loop.run_in_executor(self.executor, self.simulate, events, self.turn.copy(),
+                                                  self.sheet.copy(), acks)
+            for boat, message in messages.items():
+                player = self.players.get(boat)
+                if player is None:
+                    continue
+                if player.writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                    self.skipped += 1
+                    continue
+                player.writer.write(message)
+                self.sentBytes += len(message)
+
+            nextTick += period
+            delay = nextTick - loop.time()
+            if delay < -MAX_BEHIND_TICKS * period:
+                nextTick = loop.time()
+            await asyncio.sleep(max(0.0, delay))
+
+    async def handlePlayer(self, reader, writer):
+        boat = None
+        try:
+            messageType, payload = await readMessage(reader)
+            if messageType != HELLO:
+                return
+            free = [boat for boat in range(self.capacity) if boat not in self.players]
+            if not free:
+                writer.write(frame(FULL))
+                await writer.drain()
+                return
+            boat = free[0]
+            self.players[boat] = Player(boat, payload[:NAME_LENGTH].decode("utf-8", "replace"), writer)
+            self.turn[boat] = self.sheet[boat] = 0
+            self.events.append(("join", boat))
+            writer.write(frame(WELCOME, WELCOME_FORMAT.pack(boat, self.capacity, self.tickRate, self.dt,
+                                                            self.windStrength, self.windHeading, self.course.hash)))
+
+            while True:
+                messageType, payload = await readMessage(reader)
+                if messageType == INPUT:
+                    ack, turn, sheet = INPUT_FORMAT.unpack(payload)
+                    self.players[boat].ack = ack
+                    self.turn[boat] = max(-1, min(1, turn))
+                    self.sheet[boat] = max(-1, min(1, sheet))
+                elif messageType == RESTART:
+                    self.events.append(("restart", boat))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, struct.error):
+            pass
+        finally:
+            if boat is not None:
+                del self.players[boat]
+                self.events.append(("leave", boat))
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handlePlayer, host, port)
+        async with self.server:
+            await self.tickLoop()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.executor.shutdown(wait=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host races that players join over the network")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument("--tick-rate", type=int, default=DEFAULT_TICK_RATE, help="snapshots a second")
+    parser.add_argument("--boats", type=int, default=MAX_BOATS, help="most players at once")
+    parser.add_argument("--dt", type=float, default=DEFAULT_DT, help="fixed physics step in seconds")
+    parser.add_argument("--course", default=DEFAULT_COURSE_FILE, help="JSON or compiled course file")
+    parser.add_argument("--wind", type=float, default=DEFAULT_WIND_STRENGTH, help="wind strength")
+    parser.add_argument("--wind-heading", type=float, default=DEFAULT_WIND_HEADING, help="wind heading in degrees")
+    parser.add_argument("--wind-field", type=int, default=None, metavar="SEED",
+                        help="wind that varies over the course, from this seed")
+    args = parser.parse_args(argv)
+
+    windField = None
+    if args.wind_field is not None:
+        from windfield import WindField
+        windField = WindField(args.wind_field)
+    server = RaceServer(loadCourse(args.course), args.boats, args.dt, args.tick_rate, args.wind, args.wind_heading,
+                        windField)
+    print("Racing on %s:%d at %d ticks a second" % (args.host, args.port, args.tick_rate))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
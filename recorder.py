@@ -0,0 +1,139 @@
+# Run recorder - writes every physics step of a race to a compact binary file
+# and reads it back through a memory map, without copying, for analysis and replay.
+#
+# File layout: an 8 byte magic string, then the version, record size and metadata
+# length as little-endian uint32s, the metadata as JSON, padding up to a multiple
+# of 8 bytes, and then one fixed-width record per step (see FIELDS).
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"SAILRUN\0"
+VERSION = 1
+BLOCK_RECORDS = 1024  # records buffered before each write to disk
+
+# name and struct code of every field, in file order
+FIELDS = [("step", "I"),
+          ("time", "d"),
+          # inputs
+          ("heading", "d"),
+          ("mainSheetLength", "d"),
+          ("windStrength", "d"),
+          ("windHeading", "d"),
+          # the Sail after the step
+          ("boatVelocity", "d"),
+          ("mainAngle", "d"),
+          ("dragForce", "d"),
+          ("liftForce", "d"),
+          ("forwardForce", "d"),
+          ("lateralForce", "d"),
+          ("boatAttack", "d"),
+          # the ship after the step
+          ("x", "d"),
+          ("z", "d"),
+          ("score", "d"),
+          ("finished", "B")]
+
+RECORD = struct.Struct("<" + "".join(code for name, code in FIELDS))
+HEADER = struct.Struct("<8sIII")
+RECORD_DTYPE = np.dtype([(name, "<" + {"I": "u4", "d": "f8", "B": "u1"}[code]) for name, code in FIELDS])
+INPUT_NAMES = ("heading", "mainSheetLength", "windStrength", "windHeading")
+
+
+class RunRecorder:
+
+    def __init__(self, path, metadata=None, blockRecords=BLOCK_RECORDS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.file = open(path, "wb")
+
+        meta = json.dumps(metadata or {}).encode()
+        header = HEADER.pack(MAGIC, VERSION, RECORD.size, len(meta)) + meta
+        self.file.write(header + b"\0" * (-len(header) % 8))
+
+        self.buffer = bytearray(RECORD.size * blockRecords)
+        self.blockRecords = blockRecords
+        self.pending = 0
+        self.count = 0
+
+    def record(self, step, time, state, sail, windStrength, windHeading):
+        RECORD.pack_into(self.buffer, self.pending * RECORD.size,
+                         step, time,
+                         state.heading, state.mainSheetLength, windStrength, windHeading,
+                         sail.boatVelocity, sail.mainAngle,
+                         sail.dragForce, sail.liftForce, sail.forwardForce, sail.lateralForce, sail.boatAttack,
+                         state.x, state.z, state.score, state.finished)
+        self.pending += 1
+        self.count += 1
+        if self.pending == self.blockRecords:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write(memoryview(self.buffer)[:self.pending * RECORD.size])
+            self.pending = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RunReader:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, recordSize, metaLength = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("%s is not a recorded run" % path)
+            if version != VERSION or recordSize != RECORD_DTYPE.itemsize:
+                raise ValueError("%s was recorded in an unsupported format (version %d)" % (path, version))
+            self.metadata = json.loads(f.read(metaLength).decode())
+
+        offset = HEADER.size + metaLength
+        offset += -offset % 8
+        # a run cut short part way through a write ends in a partial record, which is ignored
+        count = (os.path.getsize(path) - offset) // recordSize
+        if count:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=offset, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    # a field name gives that column for every step, an index or slice gives
+    # records; either way it is a view onto the file
+    def __getitem__(self, key):
+        return self.records[key]
+
+    @property
+    def fields(self):
+        return RECORD_DTYPE.names
+
+    # the controls used on step i, in the form HeadlessSimulator.step takes them
+    def inputs(self, i):
+        record = self.records[i]
+        return {name: float(record[name]) for name in INPUT_NAMES}
+
+    def close(self):
+        # the map is released once nothing refers to it any more
+        self.records = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,213 @@
+# Replay renderer - draws recorded races to images with no window
+# Each run file (see recorder.py) is replayed step by step from its recorded
+# controls through headless.HeadlessSimulator, so the race comes out as it
+# was sailed, and the ship is drawn by the game's own ShipController over the
+# course Scene.setup draws. Frames go to an offscreen buffer of Panda3D's
+# software renderer, so neither a window nor a GPU is needed, and nothing
+# waits for real time: a frame is drawn only for the steps that are kept.
+#
+# A run becomes either a folder of numbered frames, one every few steps, or
+# a contact sheet of a few frames spread evenly through the race, drawn at
+# the size they have on the sheet rather than shrunk from big ones. Runs are
+# shared out between worker processes; Panda has one ShowBase a process, so
+# each worker opens its own offscreen buffer and sets the course up once.
+# Usage: python replayrender.py runs/*.sailrun [--out renders] [--frames] [--every 2] [--tiles 16]
+#                               [--columns 4] [--size 800x600] [--workers 4] [--course courses/default.json]
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUT = "renders"
+DEFAULT_SIZE = (800, 600)  # the game's window
+DEFAULT_EVERY = 2  # steps between saved frames: 30 frames a second of race at the default 60 steps
+DEFAULT_TILES = 16  # frames on a contact sheet
+DEFAULT_COLUMNS = 4
+THUMB_WIDTH = 320  # pixels across each frame of a contact sheet
+SHEET_BACKGROUND = (0, 0, 0)
+WIND_ARROW = ((11, 11), 2)  # where the game puts the wind arrow, and its scale
+
+# one per worker process
+renderer = None
+
+
+# Panda3D is set up for drawing offscreen before ShowBase is imported
+def configurePanda(size):
+    from panda3d.core import loadPrcFileData
+    loadPrcFileData("replayrender", "\n".join([
+        "window-type offscreen",
+        "load-display p3tinydisplay",
+        "audio-library-name null",
+        "win-size %d %d" % size,
+        "model-path %s" % PACKAGE_DIR,
+        "sync-video false",
+    ]))
+
+
+def makeRenderer(size, coursePath):
+    configurePanda(size)
+    from direct.showbase.ShowBase import ShowBase
+    from direct.gui.OnscreenText import OnscreenText
+    from panda3d.core import LPoint3, PNMImage, TextNode
+
+    from AssetCache import AssetCache
+    from Scene import Scene
+    from ShipController import ShipController
+    from main import SailingSimulator, SPRITE_TEXTURES
+    from profiler import NULL_PROFILER
+    from simclock import FixedStepClock
+
+    class ReplayRenderer(ShowBase):
+
+        # sprites are made exactly as the game makes them
+        loadObject = SailingSimulator.loadObject
+
+        def __init__(self):
+            ShowBase.__init__(self)
+            self.disableMouse()
+            self.setBackgroundColor((0, 0, 0, 1))
+            self.profiler = NULL_PROFILER
+            self.physicsClock = FixedStepClock()
+            self.windField = None
+            self.assets = AssetCache(self.loader)
+            for name in SPRITE_TEXTURES:
+                self.assets.texture(name)
+            self.scene = Scene(self)
+            self.scene.setup(coursePath)
+            (x, z), scale = WIND_ARROW
+            self.windArrow = self.loadObject("arrow.png", pos=LPoint3(x, z), scale=scale, depth=50)
+            self.shipController = ShipController(self)
+            self.label = OnscreenText(text="", parent=self.a2dBottomLeft, pos=(.1, .1), fg=(1, 1, 1, 1),
+                                      align=TextNode.ALeft, shadow=(0, 0, 0, .5), scale=.08, mayChange=True)
+
+        # draws the ship where state has it and returns the frame as a PNMImage
+        def draw(self, state, windHeading, label):
+            self.shipController.state = state
+            self.shipController.previous = state.renderState()
+            self.shipController.render(1.0)
+            self.windArrow.setR(windHeading)
+            self.label["text"] = label
+            self.graphicsEngine.renderFrame()
+            image = PNMImage()
+            self.win.getScreenshot(image)
+            return image
+
+        def sheet(self, thumbs, columns):
+            width, height = thumbs[0].getXSize(), thumbs[0].getYSize()
+            rows = -(-len(thumbs) // columns)
+            sheet = PNMImage(width * columns, height * rows)
+            sheet.fill(*SHEET_BACKGROUND)
+            for i, thumb in enumerate(thumbs):
+                sheet.copySubImage(thumb, width * (i % columns), height * (i // columns))
+            return sheet
+
+    return ReplayRenderer()
+
+
+def startWorker(size, coursePath):
+    global renderer
+    renderer = makeRenderer(size, coursePath)
+
+
+# the steps of a run of count steps that are drawn
+def keptSteps(count, frames, every, tiles):
+    if not count:
+        return []
+    if frames:
+        return list(range(0, count, every))
+    return sorted({round(i * (count - 1) / max(tiles - 1, 1)) for i in range(min(tiles, count))})
+
+
+# replays one run and writes its frames or contact sheet; returns a summary
+def renderRun(job):
+    from panda3d.core import Filename
+    from headless import HeadlessSimulator, DEFAULT_DT
+    from recorder import RunReader
+
+    path, options = job
+    name = os.path.splitext(os.path.basename(path))[0]
+    start = time.perf_counter()
+    course = renderer.scene.course
+    with RunReader(path) as reader:
+        metadata = reader.metadata
+        if metadata.get("course", course.hexHash) != course.hexHash:
+            return {"run": path, "error": "recorded on a different course (%s)" % metadata["course"]}
+        windField = None
+        if metadata.get("windField") is not None:
+            from windfield import WindField
+            windField = WindField(metadata["windField"])
+        sim = HeadlessSimulator(course=course, dt=metadata.get("dt", DEFAULT_DT), windField=windField)
+
+        kept = keptSteps(len(reader), options["frames"], options["every"], options["tiles"])
+        images = []
+        step = 0
+        for keep in kept:
+            while step <= keep:
+                sim.step(**reader.inputs(step))
+                step += 1
+            image = renderer.draw(sim.state, sim.windHeading,
+                                  "%s  %.1fs  Score: %d" % (name, sim.time, int(sim.state.score)))
+            if options["frames"]:
+                image.write(Filename.fromOsSpecific(os.path.join(options["out"], name, "%05d.png" % keep)))
+            else:
+                images.append(image)
+
+    if images:
+        sheet = renderer.sheet(images, options["columns"])
+        sheet.write(Filename.fromOsSpecific(os.path.join(options["out"], name + ".png")))
+    return {"run": path, "frames": len(kept), "seconds": time.perf_counter() - start}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Draw recorded races to images without a window")
+    parser.add_argument("runs", nargs="+", help="run files to draw")
+    parser.add_argument("--out", default=DEFAULT_OUT, help="folder the images are written to")
+    parser.add_argument("--frames", action="store_true",
+                        help="write every kept frame to a folder per run instead of a contact sheet")
+    parser.add_argument("--every", type=int, default=DEFAULT_EVERY, help="steps between frames with --frames")
+    parser.add_argument("--tiles", type=int, default=DEFAULT_TILES, help="frames on each contact sheet")
+    parser.add_argument("--columns", type=int, default=DEFAULT_COLUMNS, help="contact sheet columns")
+    parser.add_argument("--thumb-width", type=int, default=THUMB_WIDTH, help="contact sheet frame width in pixels")
+    parser.add_argument("--size", default="%dx%d" % DEFAULT_SIZE,
+                        help="frame size, WIDTHxHEIGHT; contact sheet frames keep its shape")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per core); 0 draws in this process")
+    parser.add_argument("--course", default=None, help="JSON or compiled course file the runs were sailed on")
+    args = parser.parse_args(argv)
+
+    from coursefile import DEFAULT_COURSE_FILE
+    width, height = (int(n) for n in args.size.lower().split("x"))
+    size = (width, height) if args.frames else (args.thumb_width, args.thumb_width * height // width)
+    options = {"out": args.out, "frames": args.frames, "every": max(1, args.every), "tiles": max(1, args.tiles),
+               "columns": max(1, args.columns)}
+    coursePath = os.path.abspath(args.course or DEFAULT_COURSE_FILE)
+    os.makedirs(args.out, exist_ok=True)
+    if args.frames:
+        for path in args.runs:
+            os.makedirs(os.path.join(args.out, os.path.splitext(os.path.basename(path))[0]), exist_ok=True)
+    jobs = [(os.path.abspath(path), options) for path in args.runs]
+    workers = min(os.cpu_count() or 1, len(jobs)) if args.workers is None else min(args.workers, len(jobs))
+
+    start = time.perf_counter()
+    if workers == 0:
+        startWorker(size, coursePath)
+        results = [renderRun(job) for job in jobs]
+    else:
+        # spawned rather than forked, so no worker starts with another's Panda state
+        with multiprocessing.get_context("spawn").Pool(workers, startWorker, (size, coursePath)) as pool:
+            results = list(pool.imap_unordered(renderRun, jobs))
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        if "error" in result:
+            print("%s: %s" % (result["run"], result["error"]))
+    frames = sum(result.get("frames", 0) for result in results)
+    print(json.dumps({"runs": len(results), "failed": sum("error" in result for result in results),
+                      "workers": workers, "frames": frames, "seconds": elapsed,
+                      "framesPerSecond": frames / elapsed if elapsed > 0 else 0}))
+
+
+if __name__ == "__main__":
+    main()
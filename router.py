@@ -0,0 +1,401 @@
+# Isochrone router - the fastest line from the start to the finish for the wind
+# Each isochrone is every place the boat can reach in one more time step,
+# found by sailing a fan of headings from each point of the last one, with the
+# boat's speed closing in on the polar speed for that heading. The grid cells
+# the boat has already swept through are remembered and a new point in one of
+# them is dropped, as the boat got there sooner another way; of the new points
+# in the same cell only the one nearest the finish is kept. Steps that cross
+# land or leave the screen are dropped too. The first step to come within the finish
+# radius ends the search, and following the points' parents back from it gives
+# the line, and the heading and main sheet to sail along each part of it.
+#
+# A long course can be split into legs between points along the course line,
+# which are routed at the same time in a process pool.
+# Usage: python router.py [--course courses/default.json] [--wind 12] [--wind-heading 90]
+#                         [--legs 1] [--workers 4] [--out route.json]
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+
+import numpy as np
+
+from coursefile import loadCourse, DEFAULT_COURSE_FILE, CACHE_DIR
+from headless import DEFAULT_WIND_STRENGTH, DEFAULT_WIND_HEADING
+from polars import PolarResult, parseRange, steadySpeeds
+from sail import BOAT_MASS, WATER_RESISTANCE
+from shipmodel import MAX_VEL, SCREEN_X, SCREEN_Y, REFERENCE_DT
+
+DEFAULT_TIME_STEP = 1.0  # seconds of race time between isochrones
+DEFAULT_HEADINGS = 72  # headings tried from each point, evenly spread round the compass
+DEFAULT_CELL_SIZE = .5  # course units; no two points of a front share a grid cell
+DEFAULT_MAX_TIME = 300.0  # seconds of race time before the search gives up
+POLAR_VERSION = 1  # bump this when the polars are made differently, so cached ones are rebuilt
+POLAR_ANGLES = "0:180:5"
+POLAR_SHEETS = "0:100:5"
+POLAR_WIND_STEP = 1  # polars are made for the wind strength rounded to this
+# seconds the boat's speed takes to close all but 1/e of the gap to the polar
+# speed; the boat's mass over its water resistance, as in Sail.update
+SPEED_TIME_CONSTANT = BOAT_MASS / float(WATER_RESISTANCE)
+
+
+def polarPath(windStrength, cacheDir=CACHE_DIR):
+    key = repr((POLAR_VERSION, POLAR_ANGLES, POLAR_SHEETS, windStrength)).encode()
+    return os.path.join(cacheDir, "polar_w%g_%s.npy" % (windStrength, hashlib.sha1(key).hexdigest()[:12]))
+
+
+# the polar for one wind strength, swept with polars.steadySpeeds the first
+# time (most of a second) and kept in cacheDir, as polars.py would write it
+def loadPolar(windStrength, cacheDir=CACHE_DIR):
+    windStrength = round(windStrength / POLAR_WIND_STEP) * POLAR_WIND_STEP
+    path = polarPath(windStrength, cacheDir) if cacheDir is not None else None
+    if path is not None and os.path.exists(os.path.splitext(path)[0] + ".polar.npz"):
+        return PolarResult.load(path)
+
+    angles = parseRange(POLAR_ANGLES)
+    sheets = parseRange(POLAR_SHEETS)
+    angleGrid, sheetGrid = np.meshgrid(angles, sheets, indexing="ij")
+    speeds, steady = steadySpeeds(angleGrid.ravel(), np.full(angleGrid.size, float(windStrength)), sheetGrid.ravel())
+    result = PolarResult(angles, np.array([float(windStrength)]), sheets,
+                         speeds.reshape(len(angles), 1, len(sheets)).astype(np.float32))
+    if path is not None:
+        os.makedirs(cacheDir, exist_ok=True)
+        # the .polar.npz that loading looks for is written last
+        np.save(path, result.speeds)
+        result.save(path)
+    return result
+
+
+# the headings of a fan of count evenly spread round the compass that the boat
+# makes way on, with the speed (course units per second) and main sheet the
+# polar gives for each in a wind the same everywhere; the polar's angle is
+# off the bow with the wind blowing from the stern at 0
+def headingTable(polar, windStrength, windHeading, count=DEFAULT_HEADINGS):
+    headings = np.arange(count) * (360.0 / count)
+    speeds = np.array([polar.speedAt(windHeading - heading - 180, windStrength) for heading in headings])
+    speeds = np.minimum(speeds * REFERENCE_DT, MAX_VEL)
+    moving = speeds > 0
+    sheets = np.array([polar.sheetAt(windHeading - heading - 180, windStrength) for heading in headings[moving]])
+    return headings[moving], speeds[moving], sheets
+
+
+class Route:
+
+    # points holds (time, x, z) from the start to where the finish is reached,
+    # and headings and sheets what to sail from each point to the next
+    def __init__(self, points, headings, sheets):
+        self.points = points
+        self.headings = headings
+        self.sheets = sheets
+
+    @property
+    def time(self):
+        return self.points[-1][0]
+
+    # (time, heading, sheet) each time the heading or sheet changes
+    def schedule(self):
+        changes = []
+        for (t, x, z), heading, sheet in zip(self.points, self.headings, self.sheets):
+            if not changes or changes[-1][1:] != (heading, sheet):
+                changes.append((t, heading, sheet))
+        return changes
+
+    # the legs of a course, one after the other
+    @classmethod
+    def join(cls, legs):
+        points, headings, sheets = [], [], []
+        offset = 0.0
+        for leg in legs:
+            start = 1 if points else 0
+            points.extend((t + offset, x, z) for t, x, z in leg.points[start:])
+            headings.extend(leg.headings)
+            sheets.extend(leg.sheets)
+            offset = points[-1][0]
+        return cls(points, headings, sheets)
+
+    def toJson(self):
+        return {"time": self.time, "points": self.points,
+                "schedule": [{"time": t, "heading": heading, "mainSheetLength": sheet}
+                             for t, heading, sheet in self.schedule()]}
+
+
+class Router:
+
+    # course is a coursefile.Course, whose obstacle outlines are kept clear of;
+    # polar is a polars.PolarResult, the one for windStrength if not given
+    def __init__(self, course, windStrength=DEFAULT_WIND_STRENGTH, windHeading=DEFAULT_WIND_HEADING, polar=None,
+                 timeStep=DEFAULT_TIME_STEP, headings=DEFAULT_HEADINGS, cellSize=DEFAULT_CELL_SIZE,
+                 maxTime=DEFAULT_MAX_TIME, cacheDir=CACHE_DIR):
+        if polar is None:
+            polar = loadPolar(windStrength, cacheDir)
+        self.course = course
+        self.timeStep = timeStep
+        self.cellSize = cellSize
+        self.maxTime = maxTime
+
+        # the wind is the same everywhere, so each heading has one speed
+        self.headings, self.speeds, self.sheets = headingTable(polar, windStrength, windHeading, headings)
+        self.dirXs = np.sin(np.radians(self.headings))
+        self.dirZs = np.cos(np.radians(self.headings))
+        self.longestStep = float(self.speeds.max()) * timeStep if len(self.speeds) else 0.0
+        # over a step the speed moves exponentially from where it was towards
+        # the polar speed: it keeps decay of the gap, and the gap adds lag
+        # seconds' worth of itself to the distance sailed
+        self.decay = np.exp(-timeStep / SPEED_TIME_CONSTANT)
+        self.lag = SPEED_TIME_CONSTANT * (1 - self.decay)
+
+        # each obstacle outline as its edges, with its bounding box
+        self.obstacles = []
+        for obstacle in course.obstacles:
+            outline = np.array(obstacle.get("outline", []), dtype=float).reshape(-1, 2)
+            if len(outline) < 3:
+                continue
+            ends = np.roll(outline, -1, axis=0)
+            self.obstacles.append((outline[:, 0].min(), outline[:, 1].min(), outline[:, 0].max(), outline[:, 1].max(),
+                                   outline[:, 0], outline[:, 1], ends[:, 0], ends[:, 1]))
+
+        self.cols = int(ceil(2 * SCREEN_X / cellSize))
+        self.rows = int(ceil(2 * SCREEN_Y / cellSize))
+
+    def cells(self, xs, zs):
+        col = np.clip(((xs + SCREEN_X) / self.cellSize).astype(int), 0, self.cols - 1)
+        row = np.clip(((zs + SCREEN_Y) / self.cellSize).astype(int), 0, self.rows - 1)
+        return row * self.cols + col
+
+    # True for each step from (x0s, z0s) to (x1s, z1s) that crosses an obstacle's outline
+    def crossesLand(self, x0s, z0s, x1s, z1s):
+        crosses = np.zeros(len(x0s), dtype=bool)
+        for minX, minZ, maxX, maxZ, ax, az, bx, bz in self.obstacles:
+            near = ((np.minimum(x0s, x1s) <= maxX) & (np.maximum(x0s, x1s) >= minX) &
+                    (np.minimum(z0s, z1s) <= maxZ) & (np.maximum(z0s, z1s) >= minZ))
+            if not near.any():
+                continue
+            px0, pz0 = x0s[near, None], z0s[near, None]
+            px1, pz1 = x1s[near, None], z1s[near, None]
+            # the step's ends are on opposite sides of an edge, and the edge's
+            # ends on opposite sides of the step
+            edgeX, edgeZ = bx - ax, bz - az
+            side0 = edgeX * (pz0 - az) - edgeZ * (px0 - ax)
+            side1 = edgeX * (pz1 - az) - edgeZ * (px1 - ax)
+            stepX, stepZ = px1 - px0, pz1 - pz0
+            sideA = stepX * (az - pz0) - stepZ * (ax - px0)
+            sideB = stepX * (bz - pz0) - stepZ * (bx - px0)
+            crosses[near] |= ((side0 * side1 <= 0) & (sideA * sideB <= 0)).any(axis=1)
+        return crosses
+
+    # marks every cell along each step as reached
+    def sweep(self, reached, x0s, z0s, x1s, z1s):
+        samples = int(ceil(self.longestStep / (self.cellSize * .5))) + 1
+        fractions = np.linspace(0, 1, samples)
+        xs = x0s[:, None] + (x1s - x0s)[:, None] * fractions
+        zs = z0s[:, None] + (z1s - z0s)[:, None] * fractions
+        reached[self.cells(xs.ravel(), zs.ravel())] = True
+
+    # the fastest route from start (x, z) to within radius of finish (x, z),
+    # the course's own start and finish by default; None if there is none
+    # within maxTime. The boat starts at startSpeed (course units per second),
+    # or already at the polar speed of whichever way it sets off if that is None
+    def route(self, start=None, finish=None, radius=None, startSpeed=0.0):
+        course = self.course
+        if start is None:
+            start = course.start[:2]
+        if finish is None:
+            last = course.pathPoints[-1]
+            finish = (last.x, last.z)
+        if radius is None:
+            radius = course.finishRadius
+        finishX, finishZ = finish
+        if len(self.headings) == 0:
+            return None
+
+        # each isochrone as (xs, zs, speeds, parent index in the one before, heading index)
+        fronts = [(np.array([float(start[0])]), np.array([float(start[1])]),
+                   np.array([np.nan if startSpeed is None else float(startSpeed)]), np.array([-1]), np.array([-1]))]
+        reached = np.zeros(self.rows * self.cols, dtype=bool)
+        reached[self.cells(fronts[0][0], fronts[0][1])] = True
+        headingCount = len(self.headings)
+
+        for step in range(int(ceil(self.maxTime / self.timeStep))):
+            xs, zs, speeds = fronts[-1][:3]
+            x0s = np.repeat(xs, headingCount)
+            z0s = np.repeat(zs, headingCount)
+            polarSpeeds = np.tile(self.speeds, len(xs))
+            speeds = np.repeat(speeds, headingCount)
+            speeds = np.where(np.isnan(speeds), polarSpeeds, speeds)
+            distances = polarSpeeds * self.timeStep + (speeds - polarSpeeds) * self.lag
+            x1s = x0s + np.tile(self.dirXs, len(xs)) * distances
+            z1s = z0s + np.tile(self.dirZs, len(xs)) * distances
+
+            arrival = self.arrival(x0s, z0s, x1s, z1s, finishX, finishZ, radius)
+            if arrival is not None:
+                candidate, fraction = arrival
+                return self.trace(fronts, candidate // headingCount, candidate % headingCount,
+                                  (step + fraction) * self.timeStep,
+                                  x0s[candidate] + fraction * (x1s[candidate] - x0s[candidate]),
+                                  z0s[candidate] + fraction * (z1s[candidate] - z0s[candidate]))
+
+            keep = (np.abs(x1s) <= SCREEN_X) & (np.abs(z1s) <= SCREEN_Y)
+            keep[keep] = ~reached[self.cells(x1s[keep], z1s[keep])]
+            keep[keep] = ~self.crossesLand(x0s[keep], z0s[keep], x1s[keep], z1s[keep])
+            chosen = np.flatnonzero(keep)
+            if len(chosen) == 0:
+                return None
+
+            # the point nearest the finish is kept in each cell
+            cells = self.cells(x1s[chosen], z1s[chosen])
+            distances = np.hypot(x1s[chosen] - finishX, z1s[chosen] - finishZ)
+            order = np.lexsort((distances, cells))
+            firsts = np.ones(len(order), dtype=bool)
+            firsts[1:] = cells[order[1:]] != cells[order[:-1]]
+            chosen = chosen[order[firsts]]
+
+            self.sweep(reached, x0s[chosen], z0s[chosen], x1s[chosen], z1s[chosen])
+            speeds = polarSpeeds[chosen] + (speeds[chosen] - polarSpeeds[chosen]) * self.decay
+            fronts.append((x1s[chosen], z1s[chosen], speeds, chosen // headingCount, chosen % headingCount))
+        return None
+
+    # the candidate step that enters the finish circle soonest, as (index,
+    # fraction of the step), if any does without crossing land; the fraction
+    # of the distance is taken as the fraction of the time
+    def arrival(self, x0s, z0s, x1s, z1s, finishX, finishZ, radius):
+        stepX, stepZ = x1s - x0s, z1s - z0s
+        offX, offZ = x0s - finishX, z0s - finishZ
+        a = stepX * stepX + stepZ * stepZ
+        b = stepX * offX + stepZ * offZ
+        c = offX * offX + offZ * offZ - radius * radius
+        discriminant = b * b - a * c
+        hits = np.flatnonzero(discriminant >= 0)
+        if len(hits) == 0:
+            return None
+        fractions = np.where(c[hits] <= 0, 0.0, (-b[hits] - np.sqrt(discriminant[hits])) / a[hits])
+        inside = (fractions >= 0) & (fractions <= 1)
+        hits, fractions = hits[inside], fractions[inside]
+        clear = ~self.crossesLand(x0s[hits], z0s[hits], x0s[hits] + fractions * stepX[hits],
+                                  z0s[hits] + fractions * stepZ[hits])
+        if not clear.any():
+            return None
+        best = np.argmin(np.where(clear, fractions, np.inf))
+        return int(hits[best]), float(fractions[best])
+
+    def trace(self, fronts, parent, heading, arrivalTime, arrivalX, arrivalZ):
+        points = [(arrivalTime, float(arrivalX), float(arrivalZ))]
+        headings = []
+        for step in range(len(fronts) - 1, -1, -1):
+            xs, zs, speeds, parents, headingIndexes = fronts[step]
+            points.append((step * self.timeStep, float(xs[parent]), float(zs[parent])))
+            headings.append(heading)
+            parent, heading = parents[parent], headingIndexes[parent]
+        points.reverse()
+        headings.reverse()
+        return Route(points, [float(self.headings[i]) for i in headings], [float(self.sheets[i]) for i in headings])
+
+
+def routeLeg(task):
+    # one unit of work for the process pool
+    course, windStrength, windHeading, polar, options, start, finish, radius, startSpeed = task
+    return Router(course, windStrength, windHeading, polar, **options).route(start, finish, radius, startSpeed)
+
+
+# waypoints every 1/legs of the way along the course line, then the finish
+def legEnds(course, legs):
+    distances = np.array(course.distances)
+    xs = np.array([point.x for point in course.pathPoints])
+    zs = np.array([point.z for point in course.pathPoints])
+    along = course.length * np.arange(1, legs + 1) / float(legs)
+    return list(zip(np.interp(along, distances, xs).tolist(), np.interp(along, distances, zs).tolist()))
+
+
+# routes a course in legs, each from one waypoint to the next, routed
+# together on workers processes when there is more than one leg; each leg
+# after the first starts from its waypoint, rather than where the last leg
+# came within reach of it, already sailing at speed. options are passed on to
+# Router. None if a leg has no route
+def routeCourse(course, windStrength=DEFAULT_WIND_STRENGTH, windHeading=DEFAULT_WIND_HEADING, legs=1,
+                workers=None, polar=None, cacheDir=CACHE_DIR, **options):
+    if polar is None:
+        polar = loadPolar(windStrength, cacheDir)
+    if legs <= 1:
+        return Router(course, windStrength, windHeading, polar, **options).route()
+
+    ends = legEnds(course, legs)
+    starts = [course.start[:2]] + ends[:-1]
+    tasks = [(course, windStrength, windHeading, polar, options, start, end, course.finishRadius,
+              0.0 if i == 0 else None)
+             for i, (start, end) in enumerate(zip(starts, ends))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        routes = list(pool.map(routeLeg, tasks))
+    if any(route is None for route in routes):
+        return None
+    return Route.join(routes)
+
+
+class LiveRouter:
+
+    # routes on a background thread so a frame never waits for it; request()
+    # starts a route for the wind unless one is already running, and poll(),
+    # called each frame, is True once it has finished
+    def __init__(self, course, **options):
+        self.course = course
+        self.options = options
+        self.thread = None
+        self.route = None  # the last Route found, None if there was none
+        self.wind = None  # (strength, heading) of the last route asked for
+
+    def request(self, windStrength, windHeading):
+        if self.thread is not None or (windStrength, windHeading) == self.wind:
+            return False
+        self.wind = (windStrength, windHeading)
+        self.thread = threading.Thread(target=self.run, args=self.wind, name="Router", daemon=True)
+        self.thread.start()
+        return True
+
+    def run(self, windStrength, windHeading):
+        self.route = Router(self.course, windStrength, windHeading, **self.options).route()
+
+    def poll(self):
+        if self.thread is None or self.thread.is_alive():
+            return False
+        self.thread = None
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the fastest route round a course with isochrones")
+    parser.add_argument("--course", default=DEFAULT_COURSE_FILE, help="JSON or compiled course file")
+    parser.add_argument("--wind", type=float, default=DEFAULT_WIND_STRENGTH, help="wind strength")
+    parser.add_argument("--wind-heading", type=float, default=DEFAULT_WIND_HEADING, help="wind heading in degrees")
+    parser.add_argument("--time-step", type=float, default=DEFAULT_TIME_STEP, help="seconds between isochrones")
+    parser.add_argument("--headings", type=int, default=DEFAULT_HEADINGS, help="headings tried from each point")
+    parser.add_argument("--cell-size", type=float, default=DEFAULT_CELL_SIZE, help="size of the pruning grid's cells")
+    parser.add_argument("--max-time", type=float, default=DEFAULT_MAX_TIME, help="race time to give up after")
+    parser.add_argument("--legs", type=int, default=1, help="route the course in this many legs along its line")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes for the legs")
+    parser.add_argument("--out", help="write the route to this JSON file")
+    args = parser.parse_args(argv)
+
+    course = loadCourse(args.course)
+    polar = loadPolar(args.wind)
+    start = time.perf_counter()
+    route = routeCourse(course, args.wind, args.wind_heading, args.legs, args.workers, polar,
+                        timeStep=args.time_step, headings=args.headings, cellSize=args.cell_size,
+                        maxTime=args.max_time)
+    elapsed = time.perf_counter() - start
+    if route is None:
+        print("No route within %g seconds" % args.max_time)
+        return
+
+    print("Route time %.2f s, %d heading changes, found in %.3f s"
+          % (route.time, len(route.schedule()), elapsed))
+    for t, heading, sheet in route.schedule():
+        print("%8.2f  heading %5.1f  sheet %5.1f" % (t, heading, sheet))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(route.toJson(), f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from math import sin, cos, sqrt, pow, pi, atan2, degrees
 HALF_PI = pi*0.5
 TWO_PI = pi*2
 PI = pi
+BASE_STEP_RATE = 60 # the model was calibrated at 60 steps per second
 
 def placeRound(measure, nDigits = 2):
     rounded = round(measure * pow(10, nDigits)) / pow(10, nDigits)
@@ -21,9 +22,155 @@ def angleMod(someAngle, makePos=1):
 
     return someAngle
 
-class Sail():
+# the drag and lift polynomials of Sail.getFluidCoefs, and the hull's mass and
+# water resistance in Sail.update
+BOAT_MASS = 2000 # assumed mass given J24(similar dimensions)
+WATER_RESISTANCE = 300
+SPEED_SCALE = 10000000 # Sail.update returns the boat velocity times this as the speed
+
+
+class BoatState():
+    # everything one Sail.update changes, in fixed slots, so a step stores its
+    # results without creating any attributes, lists or dicts
+    __slots__ = ("boatAngle", "boatVelocity", "boatAccel", "mainAngle", "x", "y",
+                 "mainAttack2", "flag", "angularVelocity",
+                 "dragForce", "liftForce", "forwardForce", "lateralForce", "boatAttack",
+                 "resistanceForce", "resistanceAccel",
+                 "speed", "sailAngle")
 
     def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0.0)
+        self.flag = True
+
+
+class SailConstants():
+    # the values of a Sail that stay the same from step to step, worked out once
+
+    __slots__ = ("aeroTable", "stepRate", "stepScale", "mainLength", "mainSheetLimit", "sealvlAirDens",
+                 "mainArea", "halfArea", "windPower")
+
+    def __init__(self, sail):
+        self.aeroTable = sail.aeroTable
+        self.stepRate = sail.stepRate
+        self.stepScale = sail.stepScale
+        self.mainLength = sail.mainLength
+        self.mainSheetLimit = sail.mainSheetLimit
+        self.sealvlAirDens = sail.sealvlAirDens
+        self.mainArea = pow(sail.mainLength, 2) / 2
+        self.halfArea = .5 * self.mainArea
+        # Sail.getAngularVelocity passes sealvlAirDens in as appVelocity, so this never changes
+        self.windPower = .5 * self.mainArea * sail.sealvlAirDens * pow(sail.sealvlAirDens, 3)
+
+
+def stepBoat(state, constants, windVelocity, windAngle, mainSheetLength, boatAngle):
+    # one Sail.update on a BoatState, in place. Every method it goes through
+    # is written out here, in the same order and with the same operations, so
+    # the results are the same to the last bit; angleMod is a plain % as
+    # Python's % never gives a negative result for a positive divisor
+    state.boatAngle = boatAngle
+
+    # getAppVector
+    boatVelocity = state.boatVelocity
+    appX = 5 * boatVelocity * sin(boatAngle + PI) + windVelocity * sin(windAngle)
+    appY = 5 * boatVelocity * cos(boatAngle + PI) + windVelocity * cos(windAngle)
+    appVelocity = sqrt(appX * appX + appY * appY)
+    appAngle = atan2(appX, appY) % TWO_PI
+
+    # rotateMainsail
+    mainAngle = (boatAngle + state.mainAngle + PI) % TWO_PI
+    mainAttack = mainAngle - appAngle if mainAngle > appAngle else appAngle - mainAngle
+    mainAttack2 = TWO_PI - mainAttack if mainAttack > PI else mainAttack
+    windPressure = .00256 * (appVelocity * appVelocity)
+    if constants.aeroTable is not None:
+        dragCoef, liftCoef = constants.aeroTable.coefs(mainAttack2, appVelocity)
+    else:
+        square = mainAttack2 * mainAttack2
+        dragCoef = -.45361 * square + 1.64225 * mainAttack2 - .27701
+        if dragCoef < .16:
+            dragCoef = .16
+        liftCoef = .5626 * (square * mainAttack2) - 3.1881 * square + 4.4150 * mainAttack2 - .6614
+    angularVelocity = constants.mainArea * windPressure * dragCoef * sin(mainAttack) * constants.mainLength \
+        / constants.windPower
+
+    # proposeAngle
+    if mainAngle > appAngle:
+        mainAngle = (mainAngle - boatAngle - PI) % TWO_PI - angularVelocity * constants.stepScale
+    elif mainAngle < appAngle:
+        mainAngle = (mainAngle - boatAngle - PI) % TWO_PI + angularVelocity * constants.stepScale
+
+    # limitMainsail
+    limit = (mainSheetLength / constants.mainSheetLimit) * HALF_PI
+    flag = True
+    if mainAngle > limit and mainAngle < PI:
+        mainAngle = limit
+        flag = False
+    elif mainAngle > PI and mainAngle < TWO_PI - limit:
+        mainAngle = TWO_PI - limit
+        flag = False
+
+    # getForces
+    appAngle = (appAngle + PI) % TWO_PI
+    boatAttack = appAngle - boatAngle if appAngle > boatAngle else boatAngle - appAngle
+    if boatAttack > PI:
+        boatAttack = TWO_PI - boatAttack
+    boatAttack %= TWO_PI
+    if flag:
+        dragForce = liftForce = forwardForce = lateralForce = 0.0
+    else:
+        appSquared = appVelocity * appVelocity
+        dragForce = constants.halfArea * dragCoef * constants.sealvlAirDens * appSquared
+        liftForce = constants.halfArea * liftCoef * constants.sealvlAirDens * appSquared
+        sinAttack = sin(boatAttack)
+        cosAttack = cos(boatAttack)
+        forwardForce = liftForce * sinAttack - dragForce * cosAttack
+        lateralForce = liftForce * cosAttack - dragForce * sinAttack
+
+    stepRate = constants.stepRate
+    boatAccel = forwardForce / BOAT_MASS
+    boatVelocity += boatAccel / stepRate
+    resistanceForce = WATER_RESISTANCE * boatVelocity
+    resistanceAccel = resistanceForce / BOAT_MASS
+    boatVelocity -= resistanceAccel / stepRate
+    if boatVelocity < -.03:
+        boatVelocity = -.03
+
+    state.boatVelocity = boatVelocity
+    state.boatAccel = boatAccel
+    state.mainAngle = mainAngle
+    state.mainAttack2 = mainAttack2
+    state.flag = flag
+    state.angularVelocity = angularVelocity
+    state.dragForce = dragForce
+    state.liftForce = liftForce
+    state.forwardForce = forwardForce
+    state.lateralForce = lateralForce
+    state.boatAttack = boatAttack
+    state.resistanceForce = resistanceForce
+    state.resistanceAccel = resistanceAccel
+    # what Sail.update returns
+    state.speed = boatVelocity * SPEED_SCALE
+    state.sailAngle = round(degrees(mainAngle), 2)
+
+
+def stateProperty(name):
+    # a Sail attribute that lives in its BoatState
+    return property(lambda self: getattr(self.state, name), lambda self, value: setattr(self.state, name, value))
+
+
+class Sail():
+
+    def __init__(self, aeroTable=None, stepRate=BASE_STEP_RATE):
+        # an aerotable.AeroTable to look the drag and lift coefficients up in,
+        # instead of evaluating the polynomials below
+        self.aeroTable = aeroTable
+
+        self.state = BoatState()
+
+        # how many times update is called per simulated second
+        self.stepRate = stepRate
+        self.stepScale = BASE_STEP_RATE / float(stepRate)
+
         # hull size
         self.boatWidth = 12 # 1px~ = 1.5 ft(8ft)
         self.boatLength = 36 # 1px~ = 1.5ft(24ft)
@@ -37,14 +184,18 @@ class Sail():
         self.boatVelocity = 0
         self.boatAccel = 0
         self.mainAngle = 0
+        self.constants = SailConstants(self)
+
+    def getFluidCoefs(self, mainAttack2, appVelocity=0):
 
-    def getFluidCoefs(self, mainAttack2):
+        if self.aeroTable is not None:
+            return self.aeroTable.coefs(mainAttack2, appVelocity)
 
         #  based on a degree 2 polynomial regression of estimated data from http://bit.ly/2Jh4mT0
-        dragCoef = max(.16,-.45361 * pow(mainAttack2, 2) + 1.64225 * mainAttack2 - .27701)
+        dragCoef = max(.16,-.45361 * (mainAttack2 * mainAttack2) + 1.64225 * mainAttack2 - .27701)
 
         #  based on a degree 2 polynomial regression of estimated data from http://bit.ly/2Jh4mT0
-        liftCoef = .5626 * pow(mainAttack2, 3) - 3.1881 * pow(mainAttack2, 2) + 4.4150 * mainAttack2 - .6614
+        liftCoef = .5626 * (mainAttack2 * mainAttack2 * mainAttack2) - 3.1881 * (mainAttack2 * mainAttack2) + 4.4150 * mainAttack2 - .6614
 
         return [dragCoef, liftCoef]
 
@@ -64,7 +215,7 @@ class Sail():
     def getWindPressure(self, appVelocity):
         #  given .00256 assumption
 
-        windPressure = .00256 * pow(appVelocity, 2)
+        windPressure = .00256 * (appVelocity * appVelocity)
 
         return windPressure
 
@@ -135,8 +286,9 @@ class Sail():
             forwardForce = 0
             lateralForce = 0
         else:
-            dragForce = .5 * mainArea * dragCoef * sealvlAirDens * pow(appVelocity, 2)
-            liftForce = .5 * mainArea * liftCoef * sealvlAirDens * pow(appVelocity, 2)
+            appSquared = appVelocity * appVelocity
+            dragForce = .5 * mainArea * dragCoef * sealvlAirDens * appSquared
+            liftForce = .5 * mainArea * liftCoef * sealvlAirDens * appSquared
 
             forwardForce = liftForce * sin(boatAttack) - dragForce * cos(boatAttack)
             lateralForce = liftForce * cos(boatAttack) - dragForce * sin(boatAttack)
@@ -154,11 +306,11 @@ class Sail():
         self.mainArea = pow(self.mainLength, 2) / 2
 
         windPressure = self.getWindPressure(appVelocity)
-        [dragCoef, liftCoef] = self.getFluidCoefs(mainAttack2)
+        [dragCoef, liftCoef] = self.getFluidCoefs(mainAttack2, appVelocity)
 
         angularVelocity = self.getAngularVelocity(mainLength, self.mainArea, windPressure, dragCoef, mainAttack,
                                                self.sealvlAirDens, appVelocity)
-        mainAngle = self.proposeAngle(mainAngle, appAngle, angularVelocity)
+        mainAngle = self.proposeAngle(mainAngle, appAngle, angularVelocity * self.stepScale)
 
         [mainAngle, flag] = self.limitMainsail(mainSheetLength, mainAngle)
 
@@ -171,15 +323,13 @@ class Sail():
     def getAppVector(self, boatVelocity, boatAngle, wVelocity, wAngle):
 
         # using boatVelocity multiplier of 5(implication of the adhoc adjustment in the text object above)
-        appVelocity = sqrt(pow(5 * boatVelocity * sin(boatAngle + PI) +
-                           wVelocity * sin(wAngle), 2) +
-                       pow(5 * boatVelocity * cos(boatAngle + PI) +
-                           wVelocity * cos(wAngle), 2))
-
-        appAngle = atan2(5 * boatVelocity * sin(boatAngle + PI) +
-                     wVelocity * sin(wAngle),
-                     5 * boatVelocity * cos(boatAngle + PI) +
-                     wVelocity * cos(wAngle))
+        appX = 5 * boatVelocity * sin(boatAngle + PI) + wVelocity * sin(wAngle)
+        appY = 5 * boatVelocity * cos(boatAngle + PI) + wVelocity * cos(wAngle)
+
+        # squares are plain products so that sailbatch.SailBatch rounds exactly the same way
+        appVelocity = sqrt(appX * appX + appY * appY)
+
+        appAngle = atan2(appX, appY)
         appAngle = angleMod(appAngle)
 
         return [appVelocity, appAngle]
@@ -193,40 +343,14 @@ class Sail():
 
       return [x,y]
 
+    # the step itself is stepBoat, with the constants worked out in __init__
     def update(self,windVelocity, windAngle, mainSheetLength, boatAngle,x, y):
-
-        self.x = x
-        self.y = y
-
-        #[self.x, self.y] = self.moveBoat(self.x, self.y, self.boatVelocity, self.boatAngle)
-        self.boatAngle = boatAngle
-
-        [appVelocity, appAngle] = self.getAppVector(self.boatVelocity, boatAngle, windVelocity, windAngle)
-
-        [self.mainAngle, self.mainAttack2, self.flag,
-         dragCoef, liftCoef,
-         self.mainArea, sealvlAirDens,
-         self.angularVelocity] = self.rotateMainsail(appAngle, appVelocity,
-                                                boatAngle,
-                                                self.mainAngle, self.mainLength,
-                                                mainSheetLength)
-
-        [self.dragForce, self.liftForce,
-         self.forwardForce, self.lateralForce,
-         self.boatAttack] = self.getForces(self.flag, appAngle, self.boatAngle,
-                                      dragCoef, liftCoef,
-                                      self.mainArea, self.sealvlAirDens,
-                                      appVelocity)
-
-        self.boatAccel = self.forwardForce / 2000 # assumed mass given J24(similar dimensions)
-        self.boatVelocity += self.boatAccel / 60 # 60 pixels per sec(calibrates time)
-
-        self.resistanceForce = 300 * self.boatVelocity # a makeshift attempt at correcting for resistance
-        self.resistanceAccel = self.resistanceForce / 2000
-        self.boatVelocity -= self.resistanceAccel / 60
-
-        self.boatVelocity = max(-.03, self.boatVelocity) # ad hoc adjustment
-
-        return [self.boatVelocity*10000000, round(degrees(self.mainAngle),2)]
+        state = self.state
+        state.x = x
+        state.y = y
+        stepBoat(state, self.constants, windVelocity, windAngle, mainSheetLength, boatAngle)
+        return [state.speed, state.sailAngle]
 
 
+for name in BoatState.__slots__:
+    setattr(Sail, name, stateProperty(name))
@@ -0,0 +1,177 @@
+# Vectorised physics engine - steps many boats at once with NumPy
+# Every array holds one value per boat and follows sail.Sail.update line by line,
+# so boat i of a SailBatch gives the same numbers as its own Sail object
+from math import atan2
+
+import numpy as np
+
+from sail import Sail, HALF_PI, TWO_PI, PI, BASE_STEP_RATE, SPEED_SCALE
+
+# NumPy's own arctan2 can differ from the C library in the last bit, and the free
+# mainsail amplifies that within a few steps, so the scalar atan2 is used per boat
+_atan2 = np.frompyfunc(atan2, 2, 1)
+
+
+class SailBatch():
+
+    def __init__(self, count, template=None, aeroTable=None, stepRate=None):
+        # the hull and sail constants are shared with the scalar model
+        if template is None:
+            template = Sail(aeroTable, stepRate if stepRate is not None else BASE_STEP_RATE)
+        self.count = count
+        self.aeroTable = aeroTable if aeroTable is not None else template.aeroTable
+        self.stepRate = stepRate if stepRate is not None else template.stepRate
+        self.stepScale = BASE_STEP_RATE / float(self.stepRate)
+        self.mainLength = template.mainLength
+        self.mainSheetLimit = template.mainSheetLimit
+        self.sealvlAirDens = template.sealvlAirDens
+        self.mainArea = pow(self.mainLength, 2) / 2
+
+        # Sail.getAngularVelocity passes sealvlAirDens in as appVelocity, so the
+        # wind power is the same for every boat and every step
+        self.windPower = .5 * self.mainArea * self.sealvlAirDens * pow(self.sealvlAirDens, 3)
+
+        self.boatAngle = np.zeros(count)
+        self.boatVelocity = np.zeros(count)
+        self.boatAccel = np.zeros(count)
+        self.mainAngle = np.zeros(count)
+
+        # inputs of the last step
+        self.windVelocity = np.zeros(count)
+        self.windAngle = np.zeros(count)
+        self.mainSheetLength = np.zeros(count)
+
+        # results of the last step (the same names Sail.update sets)
+        self.mainAttack2 = np.zeros(count)
+        self.flag = np.ones(count, dtype=bool)
+        self.angularVelocity = np.zeros(count)
+        self.dragForce = np.zeros(count)
+        self.liftForce = np.zeros(count)
+        self.forwardForce = np.zeros(count)
+        self.lateralForce = np.zeros(count)
+        self.boatAttack = np.zeros(count)
+        self.resistanceForce = np.zeros(count)
+        self.resistanceAccel = np.zeros(count)
+
+    @classmethod
+    def fromSails(cls, sails):
+        batch = cls(len(sails), template=sails[0] if sails else None)
+        for i, sail in enumerate(sails):
+            batch.boatAngle[i] = sail.boatAngle
+            batch.boatVelocity[i] = sail.boatVelocity
+            batch.boatAccel[i] = sail.boatAccel
+            batch.mainAngle[i] = sail.mainAngle
+        return batch
+
+    def toSail(self, i):
+        sail = Sail(self.aeroTable, self.stepRate)
+        sail.boatAngle = float(self.boatAngle[i])
+        sail.boatVelocity = float(self.boatVelocity[i])
+        sail.boatAccel = float(self.boatAccel[i])
+        sail.mainAngle = float(self.mainAngle[i])
+        return sail
+
+    def reset(self, mask=None):
+        # puts the chosen boats (all of them by default) back to a standing start
+        if mask is None:
+            mask = slice(None)
+        self.boatAngle[mask] = 0
+        self.boatVelocity[mask] = 0
+        self.boatAccel[mask] = 0
+        self.mainAngle[mask] = 0
+
+    def getFluidCoefs(self, mainAttack2, appVelocity=0):
+        if self.aeroTable is not None:
+            return self.aeroTable.coefsBatch(mainAttack2, appVelocity)
+
+        square = mainAttack2 * mainAttack2
+        dragCoef = np.maximum(.16, -.45361 * square + 1.64225 * mainAttack2 - .27701)
+        liftCoef = .5626 * (square * mainAttack2) - 3.1881 * square + 4.4150 * mainAttack2 - .6614
+        return dragCoef, liftCoef
+
+    def getAppVector(self, boatVelocity, boatAngle, wVelocity, wAngle):
+        # using boatVelocity multiplier of 5, as in Sail.getAppVector
+        appX = 5 * boatVelocity * np.sin(boatAngle + PI) + wVelocity * np.sin(wAngle)
+        appY = 5 * boatVelocity * np.cos(boatAngle + PI) + wVelocity * np.cos(wAngle)
+
+        appVelocity = np.sqrt(appX * appX + appY * appY)
+        appAngle = np.mod(_atan2(appX, appY).astype(float), TWO_PI)
+
+        return appVelocity, appAngle
+
+    def rotateMainsail(self, appAngle, appVelocity, boatAngle, mainAngle, mainSheetLength):
+        # gets the actual angle (vs. respective to boatAngle)
+        mainAngle = np.mod(boatAngle + mainAngle + PI, TWO_PI)
+        mainAttack = np.abs(mainAngle - appAngle)
+        mainAttack2 = np.where(mainAttack > PI, TWO_PI - mainAttack, mainAttack)
+
+        windPressure = .00256 * (appVelocity * appVelocity)
+        dragCoef, liftCoef = self.getFluidCoefs(mainAttack2, appVelocity)
+
+        torque = self.mainArea * windPressure * dragCoef * np.sin(mainAttack) * self.mainLength
+        angularVelocity = torque / self.windPower
+
+        # proposeAngle - the sail swings towards the apparent wind, and is left
+        # untouched when it already points straight at it
+        relative = np.mod(mainAngle - boatAngle - PI, TWO_PI)
+        swing = angularVelocity * self.stepScale
+        mainAngle = np.where(mainAngle > appAngle, relative - swing,
+                             np.where(mainAngle < appAngle, relative + swing, mainAngle))
+
+        # limitMainsail
+        limit = (mainSheetLength / self.mainSheetLimit) * HALF_PI
+        upper = (mainAngle > limit) & (mainAngle < PI)
+        lower = ~upper & (mainAngle > PI) & (mainAngle < TWO_PI - limit)
+        mainAngle = np.where(upper, limit, np.where(lower, TWO_PI - limit, mainAngle))
+        flag = ~(upper | lower)
+
+        return mainAngle, mainAttack2, flag, dragCoef, liftCoef, angularVelocity
+
+    def getForces(self, flag, appAngle, boatAngle, dragCoef, liftCoef, appVelocity):
+        appAngle = np.mod(appAngle + PI, TWO_PI)
+        boatAttack = np.abs(appAngle - boatAngle)
+        boatAttack = np.mod(np.where(boatAttack > PI, TWO_PI - boatAttack, boatAttack), TWO_PI)
+
+        appSquared = appVelocity * appVelocity
+        dragForce = .5 * self.mainArea * dragCoef * self.sealvlAirDens * appSquared
+        liftForce = .5 * self.mainArea * liftCoef * self.sealvlAirDens * appSquared
+        forwardForce = liftForce * np.sin(boatAttack) - dragForce * np.cos(boatAttack)
+        lateralForce = liftForce * np.cos(boatAttack) - dragForce * np.sin(boatAttack)
+
+        # a free (unsheeted) sail gives no force at all
+        dragForce[flag] = 0
+        liftForce[flag] = 0
+        forwardForce[flag] = 0
+        lateralForce[flag] = 0
+
+        return dragForce, liftForce, forwardForce, lateralForce, boatAttack
+
+    def update(self, windVelocity, windAngle, mainSheetLength, boatAngle):
+        # every argument may be a scalar (shared by all boats) or an array of length count
+        count = self.count
+        self.windVelocity = np.broadcast_to(np.asarray(windVelocity, dtype=float), (count,))
+        self.windAngle = np.broadcast_to(np.asarray(windAngle, dtype=float), (count,))
+        self.mainSheetLength = np.broadcast_to(np.asarray(mainSheetLength, dtype=float), (count,))
+        self.boatAngle = np.array(np.broadcast_to(np.asarray(boatAngle, dtype=float), (count,)))
+
+        appVelocity, appAngle = self.getAppVector(self.boatVelocity, self.boatAngle,
+                                                  self.windVelocity, self.windAngle)
+
+        (self.mainAngle, self.mainAttack2, self.flag,
+         dragCoef, liftCoef,
+         self.angularVelocity) = self.rotateMainsail(appAngle, appVelocity, self.boatAngle,
+                                                     self.mainAngle, self.mainSheetLength)
+
+        (self.dragForce, self.liftForce,
+         self.forwardForce, self.lateralForce,
+         self.boatAttack) = self.getForces(self.flag, appAngle, self.boatAngle,
+                                           dragCoef, liftCoef, appVelocity)
+
+        self.boatAccel = self.forwardForce / 2000  # assumed mass given J24(similar dimensions)
+        self.boatVelocity = self.boatVelocity + self.boatAccel / self.stepRate
+
+        self.resistanceForce = 300 * self.boatVelocity
+        self.resistanceAccel = self.resistanceForce / 2000
+        self.boatVelocity = np.maximum(-.03, self.boatVelocity - self.resistanceAccel / self.stepRate)
+
+        return self.boatVelocity * SPEED_SCALE, np.round(np.degrees(self.mainAngle), 2)
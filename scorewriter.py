@@ -0,0 +1,131 @@
+# Score writer - saves scores to the leaderboard on a background thread
+# The game loop only puts scores on a queue, so a slow commit (on a network
+# drive it can take hundreds of milliseconds) never holds up a frame. The
+# writer thread owns the database connection, writes everything that is
+# queued in one transaction, then reads the new top scores and hands them back
+# through a callback, which runs on the game's own thread when it calls poll().
+import queue
+import sqlite3
+import threading
+import time
+
+from leaderboard import Leaderboard, DB_PATH, KEEP_SCORES
+
+TOP_SCORES = 5  # rows passed to the callbacks
+RETRY_DELAY = .05  # seconds before a failed write is tried again
+RETRY_MAX_DELAY = 5.  # longest wait between tries while the database stays unavailable
+RETRY_LIMIT = 20  # tries made on close() before the unsaved rows are given up
+
+STOP = object()  # queued by close() to end the thread
+
+
+class ScoreWriter:
+
+    def __init__(self, path=DB_PATH, keep=KEEP_SCORES, topScores=TOP_SCORES):
+        self.path = path
+        self.keep = keep
+        self.topScores = topScores
+        self.requests = queue.Queue()  # (name, score, callback); a name of None only asks for the top scores
+        self.results = queue.Queue()  # (callback, top scores) waiting for poll()
+        self.unsaved = []  # rows whose write failed, tried again on a timer
+        self.waiting = []  # callbacks whose top scores could not be read yet
+        self.thread = threading.Thread(target=self.run, name="ScoreWriter", daemon=True)
+        self.thread.start()
+
+    # queues a score; callback(topScores) runs from poll() once it is saved
+    def submit(self, name, score, callback=None):
+        self.requests.put((name, score, callback))
+
+    # queues a read of the top scores, behind any scores already queued
+    def requestTop(self, callback):
+        self.requests.put((None, None, callback))
+
+    # runs the callbacks whose writes have finished; call this on the game's thread
+    def poll(self):
+        ran = 0
+        while True:
+            try:
+                callback, topScores = self.results.get_nowait()
+            except queue.Empty:
+                return ran
+            callback(topScores)
+            ran += 1
+
+    # waits until everything queued so far has been tried once; rows that
+    # could not be written stay in unsaved and are tried again on a timer
+    def flush(self):
+        self.requests.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.requests.put(STOP)
+            self.thread.join()
+        self.poll()
+
+    def run(self):
+        # sqlite connections belong to the thread that opened them
+        leaderboard = self.save(None)
+        failures = 0
+        stopping = False
+        while not stopping:
+            batch = self.take(leaderboard, failures)
+            stopping = STOP in batch
+            try:
+                requests = [item for item in batch if item is not STOP]
+                self.unsaved.extend((name, score) for name, score, callback in requests if name is not None)
+                self.waiting.extend(callback for name, score, callback in requests if callback is not None)
+                leaderboard = self.save(leaderboard, RETRY_LIMIT if stopping else 1)
+            finally:
+                # flush() must never wait on a batch that failed
+                for _ in batch:
+                    self.requests.task_done()
+            failures = failures + 1 if self.pending(leaderboard) else 0
+        if self.unsaved:
+            print("Scores could not be saved: %s" % self.unsaved)
+        if leaderboard is not None:
+            leaderboard.close()
+
+    # work left over from a failed try
+    def pending(self, leaderboard):
+        return leaderboard is None or bool(self.unsaved) or bool(self.waiting)
+
+    # the next batch of requests; while a try has failed, gives up waiting
+    # after a growing delay and returns an empty batch so it is tried again
+    def take(self, leaderboard, failures):
+        if self.pending(leaderboard):
+            try:
+                batch = [self.requests.get(timeout=min(RETRY_DELAY * 2 ** failures, RETRY_MAX_DELAY))]
+            except queue.Empty:
+                return []
+        else:
+            batch = [self.requests.get()]
+        # everything else already waiting goes into the same transaction
+        while True:
+            try:
+                batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                return batch
+
+    # opens the database if it is not open yet, writes the unsaved rows and
+    # reads the top scores for the waiting callbacks; returns the leaderboard,
+    # or None while the database cannot be opened
+    def save(self, leaderboard, attempts=1):
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(RETRY_DELAY * attempt)
+            try:
+                if leaderboard is None:
+                    leaderboard = Leaderboard(self.path, keep=self.keep)
+                if self.unsaved:
+                    leaderboard.submitMany(self.unsaved)
+                    self.unsaved = []
+                if self.waiting:
+                    topScores = leaderboard.top(self.topScores)
+                    for callback in self.waiting:
+                        self.results.put((callback, topScores))
+                    self.waiting = []
+                return leaderboard
+            except sqlite3.Error as error:
+                # usually another program holding the database locked
+                print("Score database unavailable (%s), retrying" % error)
+        return leaderboard
@@ -0,0 +1,127 @@
+# Ship movement and scoring - the part of ShipController that needs no Panda3D,
+# so the same rules drive both the game and the headless simulator
+from math import sin, cos, pi, sqrt, radians
+
+from sail import Sail, BASE_STEP_RATE, stepBoat
+from course import CourseIndex
+from profiler import NULL_PROFILER
+
+MAX_VEL = 10  # Maximum ship velocity in units/sec
+MAX_VEL_SQ = MAX_VEL ** 2  # Square of the ship velocity
+DEG_TO_RAD = pi / 180  # translates degrees to radians for sin and cos
+SCREEN_X = 20  # Screen goes from -20 to 20 on X
+SCREEN_Y = 15  # Screen goes from -15 to 15 on Y
+TURN_RATE = 360  # Degrees ship can turn in 1 second
+ACCELERATION = 10  # Ship acceleration in units/sec/sec
+
+START_X = -16  # where the ship starts each race
+START_Z = 0
+START_HEADING = 170
+START_MAIN_SHEET = 10
+START_SCORE = 10000
+SHIP_SCALE = 3  # the ship sprite is loaded with this scale
+FINISH_DISTANCE = 1.5  # how close to the last course point counts as finished
+REFERENCE_DT = 1.0 / BASE_STEP_RATE  # the step length the scoring and movement were tuned for
+
+
+class ShipState:
+
+    def __init__(self, x=START_X, z=START_Z, heading=START_HEADING,
+                 mainSheetLength=START_MAIN_SHEET, score=START_SCORE):
+        self.x = x
+        self.z = z
+        self.heading = heading  # degrees, the roll value of the ship sprite
+        self.mainSheetLength = mainSheetLength
+        self.score = score
+        self.finished = False
+        self.distanceToFinish = None
+        self.time = 0.0  # seconds since the start of the race
+
+        self.velX = 0
+        self.velZ = 0
+        self.boatVelocity = 0
+        self.sailAngle = 0
+
+    # the values the sprites show, remembered before each step so rendering can
+    # interpolate between the last two steps
+    def renderState(self):
+        return (self.x, self.z, self.heading, self.sailAngle)
+
+
+class ShipModel:
+
+    # course is a course.CourseIndex, or the list of sampled course points to build one from
+    # profiler is a profiler.FrameProfiler that times each part of a step
+    # windField is an optional windfield.WindField that the wind varies over
+    def __init__(self, course, sail=None, scale=SHIP_SCALE, profiler=NULL_PROFILER,
+                 finishDistance=FINISH_DISTANCE, windField=None):
+        self.courseIndex = course if isinstance(course, CourseIndex) else CourseIndex(course)
+        self.finishDistance = finishDistance
+        self.windField = windField
+        self.sailBoat = sail if sail is not None else Sail()
+        self.radius = .5 * scale
+        self.profiler = profiler
+
+    # Updates the position of the ship, wrapping it if it goes off the screen
+    def update_pos(self, state, dt):
+        newX = state.x + state.velX * dt
+        newZ = state.z + state.velZ * dt
+
+        radius = self.radius
+        if newX - radius > SCREEN_X:
+            newX = -SCREEN_X
+        elif newX + radius < -SCREEN_X:
+            newX = SCREEN_X
+        if newZ - radius > SCREEN_Y:
+            newZ = -SCREEN_Y
+        elif newZ + radius < -SCREEN_Y:
+            newZ = SCREEN_Y
+
+        state.x = newX
+        state.z = newZ
+
+    # Scores the ship against the course, then moves it on by one step of dt
+    # seconds, which should be 1 / sailBoat.stepRate. The penalty and the
+    # distance moved are scaled to the 60Hz step the game was tuned with, so a
+    # race scores and moves the same whatever the step rate
+    def step(self, state, dt, windStrength, windHeading):
+        dist = self.courseIndex.distance(state)
+        state.score -= (dist * dist) * (dt * BASE_STEP_RATE)
+
+        state.distanceToFinish = self.courseIndex.distanceToEnd(state)
+        if state.distanceToFinish < self.finishDistance:
+            state.finished = True
+        self.profiler.mark("scoring")
+
+        if self.windField is not None:
+            # the wind where the ship is now, around the global wind
+            windStrength, windHeading = self.windField.sample(state.x, state.z, state.time,
+                                                              windStrength, windHeading)
+        # Sail.update without the list it returns
+        boat = self.sailBoat.state
+        boat.x = state.x
+        boat.y = state.z
+        stepBoat(boat, self.sailBoat.constants, (windStrength + .000001) / 1000.0, radians(windHeading),
+                 state.mainSheetLength, radians(state.heading))
+        boatVelocity = boat.speed
+        state.boatVelocity = boatVelocity
+        state.sailAngle = boat.sailAngle
+        self.profiler.mark("sail")
+
+        # the new velocity is relative to the camera, the screen in Panda is the XZ plane
+        heading_rad = DEG_TO_RAD * state.heading
+        velX = sin(heading_rad) * boatVelocity * REFERENCE_DT
+        velZ = cos(heading_rad) * boatVelocity * REFERENCE_DT
+
+        # clips vel to maximum value MAX_VEL_SQ
+        lengthSquared = velX * velX + velZ * velZ
+        if lengthSquared > MAX_VEL_SQ:
+            length = sqrt(lengthSquared)
+            velX = velX / length * MAX_VEL
+            velZ = velZ / length * MAX_VEL
+        state.velX = velX
+        state.velZ = velZ
+
+        self.update_pos(state, dt)
+        state.time += dt
+        self.profiler.mark("position")
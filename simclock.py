@@ -0,0 +1,52 @@
+# Fixed time step simulation clock
+# Rendered frames arrive at whatever rate the machine manages, but the physics
+# always advances in steps of exactly 1/stepRate seconds, so the same inputs
+# give the same race on every machine. The time left over after the last
+# whole step is used to interpolate the rendered positions between two steps.
+
+DEFAULT_STEP_RATE = 60  # physics steps per second
+DEFAULT_MAX_STEPS = 8  # most steps run for one frame; the rest of a long hitch is dropped
+
+
+class FixedStepClock:
+
+    def __init__(self, stepRate=DEFAULT_STEP_RATE, maxSteps=DEFAULT_MAX_STEPS):
+        if stepRate <= 0:
+            raise ValueError("stepRate must be positive")
+        self.stepRate = stepRate
+        self.stepDt = 1.0 / stepRate
+        self.maxSteps = maxSteps
+        self.reset()
+
+    def reset(self):
+        self.accumulator = 0.0
+        self.steps = 0  # whole steps run since the reset
+        self.droppedTime = 0.0  # seconds thrown away after hitches
+
+    # adds a rendered frame's time and returns how many physics steps to run
+    def advance(self, frameDt):
+        self.accumulator += max(frameDt, 0.0)
+        steps = int(self.accumulator * self.stepRate)
+
+        if steps > self.maxSteps:
+            # catching up on a long hitch would make the next frame even
+            # longer, so the simulation slows down for it instead
+            self.droppedTime += (steps - self.maxSteps) * self.stepDt
+            steps = self.maxSteps
+            self.accumulator = self.stepDt * steps + (self.accumulator % self.stepDt)
+
+        self.accumulator -= steps * self.stepDt
+        if self.accumulator < 0:
+            self.accumulator = 0.0
+        self.steps += steps
+        return steps
+
+    # how far the render time is between the last step and the next one (0..1)
+    @property
+    def alpha(self):
+        return min(self.accumulator * self.stepRate, 1.0)
+
+    # simulated time, which is the step count times the step length
+    @property
+    def time(self):
+        return self.steps * self.stepDt
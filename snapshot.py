@@ -0,0 +1,192 @@
+# Simulation snapshots - a race saved part way through and carried on from there
+# capture() packs everything a headless.HeadlessSimulator needs to carry on
+# with a race into a few hundred bytes: the ship (ShipState), every slot of
+# the sail's BoatState, the wind, the step count and the segment the course
+# search starts from. restore() puts it back into a simulator of the same
+# course and step length, and the race then goes on exactly as it would
+# have, to the last bit. A wind field is a fixed function of place and time,
+# so only its seed has to match.
+#
+# Rollouts fork many races from one snapshot, each sailed with its own
+# controls, and return how each ended. They are shared out between worker
+# processes that each build their simulator once and restore the snapshot
+# before every rollout, so exploring alternatives from mid-course costs only
+# the steps after the fork, not a replay from the start every time.
+# Usage: python snapshot.py [--script inputs.json] [--at 30] [--rollouts 64] [--horizon 20] [--workers 4]
+#                           [--course courses/default.json] [--wind-field SEED]
+import argparse
+import json
+import multiprocessing
+import os
+import struct
+import time
+
+from coursefile import loadCourse, DEFAULT_COURSE_FILE
+from headless import HeadlessSimulator, ScriptedInputs, DEFAULT_DT
+from sail import BoatState
+
+MAGIC = b"SAILSNAP"
+VERSION = 1
+NO_SEGMENT = -1
+HEADER = struct.Struct("<8sI20sdq")  # magic, version, course hash, dt, steps
+# the ShipState, in order; finished is packed as a byte and a distanceToFinish
+# of None as NaN
+SHIP_FIELDS = ("x", "z", "heading", "mainSheetLength", "score", "distanceToFinish", "time",
+               "velX", "velZ", "boatVelocity", "sailAngle")
+# the simulator's wind and last course segment, the ship's finished flag and
+# the BoatState's flag
+SIM = struct.Struct("<ddqBB")
+BOAT_FIELDS = tuple(name for name in BoatState.__slots__ if name != "flag")
+FLOATS = struct.Struct("<%dd" % (len(SHIP_FIELDS) + len(BOAT_FIELDS)))
+SIZE = HEADER.size + SIM.size + FLOATS.size
+
+
+# the state of sim, a HeadlessSimulator, as bytes
+def capture(sim):
+    state = sim.state
+    boat = sim.model.sailBoat.state
+    lastSegment = sim.courseIndex.lastSegment
+    ship = [getattr(state, name) for name in SHIP_FIELDS]
+    if state.distanceToFinish is None:
+        ship[SHIP_FIELDS.index("distanceToFinish")] = float("nan")
+    return (HEADER.pack(MAGIC, VERSION, sim.course.hash, sim.dt, sim.steps) +
+            SIM.pack(sim.windStrength, sim.windHeading, NO_SEGMENT if lastSegment is None else lastSegment,
+                     state.finished, boat.flag) +
+            FLOATS.pack(*ship, *(getattr(boat, name) for name in BOAT_FIELDS)))
+
+
+# puts sim back where it was when blob was captured; sim must race the same
+# course with the same step length
+def restore(sim, blob):
+    if len(blob) != SIZE:
+        raise ValueError("a snapshot is %d bytes, not %d" % (SIZE, len(blob)))
+    magic, version, courseHash, dt, steps = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version %d snapshot" % VERSION)
+    if courseHash != sim.course.hash:
+        raise ValueError("the snapshot is of course %s, not %s" % (courseHash.hex(), sim.course.hexHash))
+    if dt != sim.dt:
+        raise ValueError("the snapshot steps %r seconds, not %r" % (dt, sim.dt))
+    windStrength, windHeading, lastSegment, finished, flag = SIM.unpack_from(blob, HEADER.size)
+    values = FLOATS.unpack_from(blob, HEADER.size + SIM.size)
+
+    state = sim.state
+    for name, value in zip(SHIP_FIELDS, values):
+        setattr(state, name, value)
+    if state.distanceToFinish != state.distanceToFinish:
+        state.distanceToFinish = None
+    state.finished = bool(finished)
+    boat = sim.model.sailBoat.state
+    for name, value in zip(BOAT_FIELDS, values[len(SHIP_FIELDS):]):
+        setattr(boat, name, value)
+    boat.flag = bool(flag)
+
+    sim.windStrength = windStrength
+    sim.windHeading = windHeading
+    sim.courseIndex.lastSegment = None if lastSegment == NO_SEGMENT else lastSegment
+    sim.steps = steps
+    sim.time = steps * dt
+
+
+# one worker's simulator, built once
+worker = None
+
+
+def startWorker(course, dt, windFieldSeed):
+    global worker
+    windField = None
+    if windFieldSeed is not None:
+        from windfield import WindField
+        windField = WindField(windFieldSeed)
+    worker = HeadlessSimulator(course=course, dt=dt, windField=windField)
+
+
+# restores the snapshot and sails keyframes, timed from the fork as
+# ScriptedInputs.fromJson reads them, for at most horizon seconds
+def runRollout(job):
+    blob, keyframes, horizon = job
+    restore(worker, blob)
+    forkTime = worker.time
+    inputs = ScriptedInputs([(t + forkTime, values) for t, values in ScriptedInputs.fromJson(keyframes).keyframes])
+    return worker.run(inputs, maxTime=forkTime + horizon)
+
+
+class Rollouts:
+
+    # workers processes, one per core by default; 0 runs every rollout in
+    # this process
+    def __init__(self, course=None, dt=DEFAULT_DT, windFieldSeed=None, workers=None, context=None):
+        if course is None:
+            course = loadCourse()
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.pool = None
+        if workers == 0:
+            startWorker(course, dt, windFieldSeed)
+        else:
+            context = context or multiprocessing.get_context()
+            self.pool = context.Pool(workers, startWorker, (course, dt, windFieldSeed))
+
+    # sails every keyframe list from the snapshot blob for at most horizon
+    # seconds; returns each one's HeadlessSimulator.result, in order
+    def run(self, blob, keyframeLists, horizon):
+        jobs = [(blob, keyframes, horizon) for keyframes in keyframeLists]
+        if self.pool is None:
+            return [runRollout(job) for job in jobs]
+        return self.pool.map(runRollout, jobs, chunksize=max(1, len(jobs) // (4 * self.workers)))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fork rollouts with random headings from part way through a race")
+    parser.add_argument("--script", help="JSON list of timed input keyframes sailed up to the fork")
+    parser.add_argument("--at", type=float, default=30.0, help="race time of the fork in seconds")
+    parser.add_argument("--rollouts", type=int, default=64, help="rollouts forked")
+    parser.add_argument("--horizon", type=float, default=20.0, help="seconds each rollout sails for")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--dt", type=float, default=DEFAULT_DT, help="fixed time step in seconds")
+    parser.add_argument("--course", default=DEFAULT_COURSE_FILE, help="JSON or compiled course file")
+    parser.add_argument("--wind-field", type=int, metavar="SEED",
+                        help="vary the wind over the course and in time, with this random seed")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the rollouts' headings")
+    args = parser.parse_args(argv)
+
+    import random
+    course = loadCourse(args.course)
+    windField = None
+    if args.wind_field is not None:
+        from windfield import WindField
+        windField = WindField(args.wind_field)
+    sim = HeadlessSimulator(course=course, dt=args.dt, windField=windField)
+    inputs = ScriptedInputs.load(args.script) if args.script else None
+    sim.run(inputs, maxTime=args.at)
+    blob = capture(sim)
+
+    rng = random.Random(args.seed)
+    keyframeLists = [[{"time": t, "heading": rng.uniform(0, 360)} for t in range(0, int(args.horizon), 5)]
+                     for _ in range(args.rollouts)]
+    with Rollouts(course, args.dt, args.wind_field, args.workers) as rollouts:
+        start = time.perf_counter()
+        results = rollouts.run(blob, keyframeLists, args.horizon)
+        elapsed = time.perf_counter() - start
+
+    best = max(range(len(results)), key=lambda i: results[i]["score"])
+    print(json.dumps({"forkTime": sim.time, "forkScore": sim.state.score, "snapshotBytes": len(blob),
+                      "rollouts": len(results), "workers": rollouts.workers, "seconds": elapsed,
+                      "best": results[best], "bestKeyframes": keyframeLists[best]}))
+
+
+if __name__ == "__main__":
+    main()
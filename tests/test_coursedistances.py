@@ -0,0 +1,63 @@
+# Course distances - the batched tree search finds what measuring every segment finds
+import math
+
+import numpy as np
+import pytest
+
+from course import CourseIndex, CoursePoint
+from coursefile import loadCourse
+from vecenv import CourseBatchIndex, ShipBatch
+
+
+# every point measured against every segment, as ShipBatch used to
+def bruteForceDistances(index, xs, zs):
+    segments = index.segmentCount
+    segmentXs = np.array(index.xs[:segments])
+    segmentZs = np.array(index.zs[:segments])
+    dxs = np.array(index.dxs)
+    dzs = np.array(index.dzs)
+    lengthsSq = np.array(index.lengthsSq)
+    px = xs[:, None] - segmentXs
+    pz = zs[:, None] - segmentZs
+    t = px * dxs + pz * dzs
+    np.divide(t, lengthsSq, out=t, where=lengthsSq > 0)
+    t[:, lengthsSq == 0] = 0
+    np.clip(t, 0, 1, out=t)
+    px -= t * dxs
+    pz -= t * dzs
+    return np.sqrt((px * px + pz * pz).min(axis=1))
+
+
+# a course that crosses itself many times, so the tree's boxes overlap
+def tangledIndex(count):
+    points = [CoursePoint(20 * math.sin(7 * a), 0, 25 * math.cos(5 * a) + a)
+              for a in np.linspace(0, 1, count)]
+    return CourseIndex(points)
+
+
+@pytest.mark.parametrize("index", [loadCourse().index, tangledIndex(3000),
+                                   CourseIndex([CoursePoint(1, 0, 2)]),
+                                   CourseIndex([CoursePoint(0, 0, 0), CoursePoint(0, 0, 0), CoursePoint(3, 0, 1)])],
+                         ids=["default", "tangled", "point", "repeated"])
+def test_matches_brute_force(index):
+    rng = np.random.default_rng(0)
+    xs = rng.uniform(-30, 30, 2000)
+    zs = rng.uniform(-30, 30, 2000)
+    expected = bruteForceDistances(index, xs, zs)
+    batch = CourseBatchIndex(index)
+
+    segments, distances = batch.nearestSegments(xs, zs)
+    assert np.array_equal(distances, expected)
+    # from the answers' own segments, from ones a little off and from bad guesses
+    for hints in (segments, np.clip(segments + rng.integers(-40, 40, len(xs)), 0, index.segmentCount - 1),
+                  rng.integers(-1, index.segmentCount, len(xs))):
+        assert np.array_equal(batch.nearestSegments(xs, zs, hints)[1], expected)
+
+
+def test_ship_batch_keeps_exact_distances():
+    course = loadCourse()
+    ships = ShipBatch(256, course)
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        ships.step(rng.uniform(-3, 3, ships.count), rng.uniform(-1, 1, ships.count))
+        assert np.array_equal(ships.courseDistance, bruteForceDistances(course.index, ships.x, ships.z))
@@ -0,0 +1,78 @@
+# Integrators - each scheme converges at its order, and no event leaves a floor under the adaptive one
+import math
+
+import pytest
+
+from coursefile import loadCourse
+from headless import HeadlessSimulator, ScriptedInputs
+from integrators import ShipSystem, AdaptiveRK, makeIntegrator
+
+STEPS = (1 / 6, 1 / 12, 1 / 24)
+SECONDS = 3.0
+# how much an error shrinks each time the step is halved, for a first and a
+# fourth order scheme
+ORDERS = {"euler": 2, "semi-implicit": 2, "rk4": 16}
+
+
+@pytest.fixture(scope="module")
+def course():
+    return loadCourse()
+
+
+# SECONDS from the start with the sail against its sheet the whole way, so
+# the forces never switch and the ship stays on screen
+def sail(course, integrator, dt):
+    system = ShipSystem(course.index)
+    x, z, heading = course.start
+    system.setInputs(heading, 10, 12, 90)
+    y = (0.0, system.limit, x, z, 0.0)
+    for i in range(int(round(SECONDS / dt))):
+        y = integrator.step(system, i * dt, y, dt)
+    return y
+
+
+@pytest.mark.parametrize("name", sorted(ORDERS))
+def test_convergence_order(course, name):
+    reference = sail(course, AdaptiveRK(1e-13, 1e-13), 1 / 60)
+    errors = []
+    for dt in STEPS:
+        y = sail(course, makeIntegrator(name), dt)
+        errors.append(math.hypot(y[2] - reference[2], y[3] - reference[3]))
+    for error, halved in zip(errors, errors[1:]):
+        assert ORDERS[name] * .9 < error / halved < ORDERS[name] * 1.1
+
+
+# the wrap at the screen edges, the sail's first swing onto its sheet and a
+# keyframe part way through a step are all met within the tolerance however
+# long the steps are
+@pytest.mark.parametrize("script", [None, [{"time": 0, "heading": 150, "mainSheetLength": 40},
+                                           {"time": 3.05, "heading": 200}]])
+def test_adaptive_has_no_floor(course, script):
+    inputs = ScriptedInputs.fromJson(script) if script else None
+    results = []
+    for rate in (60, 6):
+        sim = HeadlessSimulator(course=course, dt=1.0 / rate, integrator="adaptive")
+        sim.model.integrator = AdaptiveRK(1e-9, 1e-9)
+        sim.run(inputs, maxTime=30)
+        results.append(sim.state)
+    fine, coarse = results
+    assert math.hypot(fine.x - coarse.x, fine.z - coarse.z) < 1e-6
+    assert abs(fine.score - coarse.score) < 1e-2
+
+
+# an integrated batch reports the wind where its boats are, as SailBatch's does
+def test_batch_observes_local_wind(course):
+    import numpy as np
+    from vecenv import ShipBatch, OBS_SIZE, OBS_NAMES
+    from windfield import WindField
+    observations = []
+    for integrator in (None, "rk4"):
+        ships = ShipBatch(2, course, windField=WindField(1), integrator=integrator)
+        for _ in range(120):
+            ships.advance()
+        out = np.zeros((2, OBS_SIZE))
+        ships.observe(out)
+        observations.append(out)
+    wind = [OBS_NAMES.index("windStrength"), OBS_NAMES.index("windHeading")]
+    assert np.allclose(observations[0][:, wind], observations[1][:, wind], atol=.01)
+    assert not np.allclose(observations[1][:, wind], (12, 90))
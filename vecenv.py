@@ -0,0 +1,591 @@
+# Vectorised environment - many races stepped together for training autopilots
+# ShipBatch is ShipModel and ShipState for a whole batch of boats as NumPy
+# arrays, with SailBatch doing the sail physics, so boat i scores, finishes
+# and moves as the game's ship would. BatchEnv wraps it in reset()/step(actions)
+# where an action is a heading change and a main sheet change, and starts each
+# race again by itself when it finishes or runs out of time.
+#
+# VecEnv splits the environments between worker processes. The observations,
+# actions, rewards and flags all live in one block of shared memory that every
+# process sees as NumPy arrays; each worker steps its own slice in place, so a
+# step only passes semaphores between the processes and nothing is pickled.
+# Usage: python vecenv.py [--envs 4096] [--workers 4] [--steps 1000] [--course courses/default.json]
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from coursefile import loadCourse, DEFAULT_COURSE_FILE
+from headless import DEFAULT_DT, DEFAULT_MAX_TIME, DEFAULT_WIND_STRENGTH, DEFAULT_WIND_HEADING
+from sail import BASE_STEP_RATE, PI, TWO_PI, SPEED_SCALE
+from sailbatch import SailBatch
+from shipmodel import (MAX_VEL, MAX_VEL_SQ, DEG_TO_RAD, SCREEN_X, SCREEN_Y, TURN_RATE, START_MAIN_SHEET,
+                       START_SCORE, SHIP_SCALE, REFERENCE_DT)
+
+SHEET_RATE = 10  # main sheet units per second, as the e and r keys move it
+SHEET_MIN = 0  # the main sheet slider's range
+SHEET_MAX = 100
+
+# the columns of an observation
+OBS_NAMES = ("x", "z", "heading", "boatVelocity", "sailAngle", "mainSheetLength",
+             "courseDistance", "finishDistance", "windStrength", "windHeading", "time")
+OBS_SIZE = len(OBS_NAMES)
+ACTION_SIZE = 2  # heading change in degrees, main sheet change
+
+# commands the workers read from shared memory
+RESET = 1
+STEP = 2
+CLOSE = 3
+HINT_WINDOW = 2  # segments either side of a boat's last nearest one measured before searching the tree
+COLD_SAMPLES = 256  # segments measured for a boat with no last nearest segment, before searching the tree
+WORKER_CHECK = 1.0  # seconds between checks that the workers are still alive while waiting
+
+
+class CourseBatchIndex:
+
+    # course.CourseIndex's bounding box tree as NumPy arrays. nearestSegments
+    # finds the nearest segment for many points at once: each point first
+    # measures the segments around its hint, or without one a sample spread
+    # along the whole course, then the tree is searched one level at a time
+    # for every point together, dropping each (point, node) pair whose box is
+    # no nearer than the point's best segment so far
+    def __init__(self, index):
+        self.segmentCount = index.segmentCount
+        self.xs = np.array(index.xs[:self.segmentCount])
+        self.zs = np.array(index.zs[:self.segmentCount])
+        self.dxs = np.array(index.dxs)
+        self.dzs = np.array(index.dzs)
+        # a segment of no length has no direction either, so projecting onto
+        # it gives 0 whatever it is divided by
+        lengthsSq = np.array(index.lengthsSq)
+        self.divisors = np.where(lengthsSq > 0, lengthsSq, 1.0)
+        self.minXs = np.array(index.minXs)
+        self.minZs = np.array(index.minZs)
+        self.maxXs = np.array(index.maxXs)
+        self.maxZs = np.array(index.maxZs)
+        self.lefts = np.array(index.lefts)
+        self.rights = np.array(index.rights)
+        self.firsts = np.array(index.firsts)
+        self.lasts = np.array(index.lasts)
+        self.samples = np.arange(0, self.segmentCount, max(self.segmentCount // COLD_SAMPLES, 1))
+        self.leafSegments = int((self.lasts - self.firsts)[self.lefts < 0].max())
+
+    # squared distance from each (x, z) to the segment of the same position,
+    # measured as CourseIndex.segmentDistanceSq does
+    def segmentDistancesSq(self, segments, xs, zs):
+        px = xs - self.xs[segments]
+        pz = zs - self.zs[segments]
+        dxs = self.dxs[segments]
+        dzs = self.dzs[segments]
+        t = px * dxs + pz * dzs
+        t /= self.divisors[segments]
+        np.clip(t, 0, 1, out=t)
+        px -= t * dxs
+        pz -= t * dzs
+        return px * px + pz * pz
+
+    # keeps the candidate segments that beat each point's best so far;
+    # points, segments and distancesSq are one entry per candidate, and a
+    # point may have more than one
+    @staticmethod
+    def improve(best, bestSq, points, segments, distancesSq):
+        np.minimum.at(bestSq, points, distancesSq)
+        won = distancesSq == bestSq[points]
+        best[points[won]] = segments[won]
+
+    # the nearest segment from each point to the segments in the same row
+    def nearestOf(self, segments, xs, zs):
+        distancesSq = self.segmentDistancesSq(segments, xs[:, None], zs[:, None])
+        column = distancesSq.argmin(axis=1)
+        rows = np.arange(len(segments))
+        return segments[rows, column], distancesSq[rows, column]
+
+    # measures each (point, leaf) pair's point against the leaf's segments
+    def searchLeaves(self, best, bestSq, xs, zs, points, leaves):
+        segments = self.firsts[leaves][:, None] + np.arange(self.leafSegments)
+        # a shorter leaf repeats its last segment
+        np.minimum(segments, self.lasts[leaves][:, None] - 1, out=segments)
+        segments, distancesSq = self.nearestOf(segments, xs[points], zs[points])
+        self.improve(best, bestSq, points, segments, distancesSq)
+
+    # squared distance from each point to its node's box, zero inside it
+    def boxDistancesSq(self, nodes, xs, zs):
+        boxX = np.maximum(np.maximum(self.minXs[nodes] - xs, xs - self.maxXs[nodes]), 0)
+        boxZ = np.maximum(np.maximum(self.minZs[nodes] - zs, zs - self.maxZs[nodes]), 0)
+        return boxX * boxX + boxZ * boxZ
+
+    # returns (segment indices, distances) of the segments nearest each (x, z);
+    # hints are segments that are probably close, -1 for a point without one
+    def nearestSegments(self, xs, zs, hints=None):
+        count = len(xs)
+        best = np.full(count, -1)
+        bestSq = np.full(count, np.inf)
+        if hints is None:
+            hints = best
+
+        hinted = hints >= 0
+        if hinted.any():
+            segments = np.clip(hints[hinted][:, None] + np.arange(-HINT_WINDOW, HINT_WINDOW + 1),
+                               0, self.segmentCount - 1)
+            best[hinted], bestSq[hinted] = self.nearestOf(segments, xs[hinted], zs[hinted])
+        if not hinted.all():
+            # every so many segments along the whole course, for a first bound
+            cold = ~hinted
+            segments = np.broadcast_to(self.samples, (int(cold.sum()), len(self.samples)))
+            best[cold], bestSq[cold] = self.nearestOf(segments, xs[cold], zs[cold])
+
+        points = np.arange(count)
+        nodes = np.zeros(count, dtype=int)
+        while len(points):
+            near = self.boxDistancesSq(nodes, xs[points], zs[points]) < bestSq[points]
+            points = points[near]
+            nodes = nodes[near]
+            leaf = self.lefts[nodes] < 0
+            if leaf.any():
+                self.searchLeaves(best, bestSq, xs, zs, points[leaf], nodes[leaf])
+            inner = ~leaf
+            points = np.concatenate((points[inner], points[inner]))
+            nodes = np.concatenate((self.lefts[nodes[inner]], self.rights[nodes[inner]]))
+        return best, np.sqrt(bestSq)
+
+
+class ShipBatch:
+
+    # course is a coursefile.Course; windStrength and windHeading may be one
+    # value for every boat or an array of one per boat; integrator names one of
+    # integrators.py's schemes to step the physics with instead of SailBatch's
+    def __init__(self, count, course, dt=DEFAULT_DT, windStrength=DEFAULT_WIND_STRENGTH,
+                 windHeading=DEFAULT_WIND_HEADING, windField=None, scale=SHIP_SCALE, integrator=None):
+        self.count = count
+        self.dt = dt
+        self.sail = SailBatch(count, stepRate=1.0 / dt)
+        self.start = course.start
+        self.finishRadius = course.finishRadius
+        self.windField = windField
+        self.radius = .5 * scale
+        self.integrator = None
+        if integrator is not None:
+            from integrators import ShipBatchSystem, makeIntegrator
+            self.integrator = makeIntegrator(integrator)
+            self.system = ShipBatchSystem(self)
+
+        # the course's CourseIndex tree, searched for the whole batch at once
+        self.courseIndex = CourseBatchIndex(course.index)
+        self.endX = course.index.xs[-1]
+        self.endZ = course.index.zs[-1]
+        # the segment each boat was last nearest, where its next search starts
+        self.lastSegment = np.full(count, -1)
+
+        self.windStrength = np.empty(count)
+        self.windStrength[:] = windStrength
+        self.windHeading = np.empty(count)
+        self.windHeading[:] = windHeading
+
+        # the same names as ShipState, one entry per boat
+        self.x = np.zeros(count)
+        self.z = np.zeros(count)
+        self.heading = np.zeros(count)
+        self.mainSheetLength = np.zeros(count)
+        self.score = np.zeros(count)
+        self.finished = np.zeros(count, dtype=bool)
+        self.time = np.zeros(count)
+        self.velX = np.zeros(count)
+        self.velZ = np.zeros(count)
+        self.boatVelocity = np.zeros(count)
+        self.sailAngle = np.zeros(count)
+        # distances from where each boat is now, which the next step scores
+        self.courseDistance = np.zeros(count)
+        self.distanceToFinish = np.zeros(count)
+        # the wind each boat felt on its last step
+        self.localWindStrength = self.windStrength.copy()
+        self.localWindHeading = self.windHeading.copy()
+
+        x, z, heading = self.start
+        startSegment, startDistance = self.courseIndex.nearestSegments(np.array([x]), np.array([z]))
+        self.startSegment = int(startSegment[0])
+        self.startCourseDistance = float(startDistance[0])
+        self.startDistanceToFinish = float(np.hypot(self.endX - x, self.endZ - z))
+        self.reset()
+
+    # distance from each (x, z) to the course line; boats picks the boats
+    # they belong to (all of them by default), whose last nearest segments
+    # start the search and are replaced by the ones found
+    def courseDistances(self, xs, zs, boats=slice(None)):
+        segments, distances = self.courseIndex.nearestSegments(xs, zs, self.lastSegment[boats])
+        self.lastSegment[boats] = segments
+        return distances
+
+    # puts the chosen boats (all of them by default) back on the start line
+    def reset(self, mask=None):
+        if mask is None:
+            mask = slice(None)
+        x, z, heading = self.start
+        self.x[mask] = x
+        self.z[mask] = z
+        self.heading[mask] = heading
+        self.mainSheetLength[mask] = START_MAIN_SHEET
+        self.score[mask] = START_SCORE
+        self.finished[mask] = False
+        self.time[mask] = 0
+        self.velX[mask] = 0
+        self.velZ[mask] = 0
+        self.boatVelocity[mask] = 0
+        self.sailAngle[mask] = 0
+        self.courseDistance[mask] = self.startCourseDistance
+        self.lastSegment[mask] = self.startSegment
+        self.distanceToFinish[mask] = self.startDistanceToFinish
+        self.sail.reset(mask)
+
+    # moves the boats to (xs, zs), measuring the ones that moved against the course there
+    def place(self, xs, zs):
+        xs = np.array(xs, dtype=float)
+        zs = np.array(zs, dtype=float)
+        moved = np.flatnonzero((xs != self.x) | (zs != self.z))
+        self.x = xs
+        self.z = zs
+        if len(moved):
+            self.courseDistance[moved] = self.courseDistances(xs[moved], zs[moved], moved)
+            self.distanceToFinish[moved] = np.hypot(self.endX - xs[moved], self.endZ - zs[moved])
+
+    # turns and sheets every boat by at most what the keys would in one step,
+    # then runs ShipModel.step on them all; returns each boat's change in score
+    def step(self, headingDelta, sheetDelta):
+        self.steer(headingDelta, sheetDelta)
+        return self.advance()
+
+    def steer(self, headingDelta, sheetDelta):
+        dt = self.dt
+        turn = TURN_RATE * dt
+        self.heading = np.mod(self.heading + np.clip(headingDelta, -turn, turn), 360)
+        sheet = SHEET_RATE * dt
+        self.mainSheetLength = np.clip(self.mainSheetLength + np.clip(sheetDelta, -sheet, sheet),
+                                       SHEET_MIN, SHEET_MAX)
+
+    # ShipModel.step for every boat with the heading and sheet they have now
+    def advance(self):
+        if self.integrator is not None:
+            return self.integrate()
+        dt = self.dt
+        penalty = self.courseDistance * self.courseDistance * (dt * BASE_STEP_RATE)
+        self.score -= penalty
+        self.finished |= self.distanceToFinish < self.finishRadius
+
+        windStrength, windHeading = self.windStrength, self.windHeading
+        if self.windField is not None:
+            windStrength, windHeading = self.windField.sampleBatch(self.x, self.z, self.time,
+                                                                   windStrength, windHeading)
+        self.localWindStrength = windStrength
+        self.localWindHeading = windHeading
+        self.boatVelocity, self.sailAngle = self.sail.update((windStrength + .000001) / 1000.0,
+                                                             np.radians(windHeading), self.mainSheetLength,
+                                                             np.radians(self.heading))
+        self.setVelocities()
+
+        # ShipModel.update_pos, wrapping at the screen edges
+        x = self.x + self.velX * dt
+        z = self.z + self.velZ * dt
+        radius = self.radius
+        x[x - radius > SCREEN_X] = -SCREEN_X
+        x[x + radius < -SCREEN_X] = SCREEN_X
+        z[z - radius > SCREEN_Y] = -SCREEN_Y
+        z[z + radius < -SCREEN_Y] = SCREEN_Y
+        self.x = x
+        self.z = z
+        self.time += dt
+
+        self.courseDistance = self.courseDistances(x, z)
+        self.distanceToFinish = np.hypot(self.endX - x, self.endZ - z)
+        return -penalty
+
+    # advance with the physics stepped by the integrator
+    def integrate(self):
+        self.finished |= self.distanceToFinish < self.finishRadius
+        sail = self.sail
+        system = self.system
+        system.setInputs()
+        score = self.score
+        mainAngle = np.where(sail.mainAngle > PI, sail.mainAngle - TWO_PI, sail.mainAngle)
+        (sail.boatVelocity, mainAngle, self.x, self.z,
+         self.score) = self.integrator.step(system, self.time,
+                                            (sail.boatVelocity, mainAngle, self.x, self.z, score), self.dt)
+        sail.mainAngle = np.mod(mainAngle, TWO_PI)
+        self.time += self.dt
+
+        # what SailBatch.update would have left for the step's end, with the
+        # wind where and when each boat ends it
+        system.derivatives(self.time, (sail.boatVelocity, mainAngle, self.x, self.z, self.score))
+        sail.boatAngle = system.boatAngle
+        sail.forwardForce = system.forwardForce
+        self.localWindStrength = system.localWindStrength
+        self.localWindHeading = system.localWindHeading
+        self.courseDistance = system.courseDistance
+        self.boatVelocity = sail.boatVelocity * SPEED_SCALE
+        self.sailAngle = np.round(np.degrees(sail.mainAngle), 2)
+        self.setVelocities()
+        self.distanceToFinish = np.hypot(self.endX - self.x, self.endZ - self.z)
+        return self.score - score
+
+    # ShipModel's velocity for every boat at its speed and heading, limited to MAX_VEL
+    def setVelocities(self):
+        headingRad = DEG_TO_RAD * self.heading
+        velX = np.sin(headingRad) * self.boatVelocity * REFERENCE_DT
+        velZ = np.cos(headingRad) * self.boatVelocity * REFERENCE_DT
+        lengthSquared = velX * velX + velZ * velZ
+        fast = lengthSquared > MAX_VEL_SQ
+        if fast.any():
+            length = np.sqrt(lengthSquared[fast])
+            velX[fast] = velX[fast] / length * MAX_VEL
+            velZ[fast] = velZ[fast] / length * MAX_VEL
+        self.velX = velX
+        self.velZ = velZ
+
+    # writes every boat's observation into out, an array of (count, OBS_SIZE)
+    def observe(self, out):
+        for column, values in enumerate((self.x, self.z, self.heading, self.boatVelocity, self.sailAngle,
+                                         self.mainSheetLength, self.courseDistance, self.distanceToFinish,
+                                         self.localWindStrength, self.localWindHeading, self.time)):
+            out[:, column] = values
+
+
+# the arrays a batch of environments reads and writes, by name: (shape after the env count, dtype)
+ENV_ARRAYS = (("observations", (OBS_SIZE,), np.float64),
+              ("actions", (ACTION_SIZE,), np.float64),
+              ("rewards", (), np.float64),
+              ("finalObservations", (OBS_SIZE,), np.float64),  # the last observation of a race that just ended
+              ("episodeScores", (), np.float64),  # and its final score
+              ("episodeSteps", (), np.int64),  # and how many steps it took
+              ("finished", (), np.bool_),
+              ("truncated", (), np.bool_))
+
+
+def arrayLayout(count):
+    # (name, offset in bytes, shape, dtype) of each array in one shared block
+    layout = []
+    offset = 0
+    for name, shape, dtype in ENV_ARRAYS:
+        shape = (count,) + shape
+        layout.append((name, offset, shape, dtype))
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += size + (-size % 8)
+    return layout, offset
+
+
+def arrayViews(buffer, layout, first=0, last=None):
+    # the arrays in buffer, or just the rows first..last-1 of each
+    views = {}
+    for name, offset, shape, dtype in layout:
+        array = np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+        views[name] = array[first:last]
+    return views
+
+
+class BatchEnv:
+
+    # arrays holds the ENV_ARRAYS this batch works in, made here if not given
+    def __init__(self, count, course=None, dt=DEFAULT_DT, windStrength=DEFAULT_WIND_STRENGTH,
+                 windHeading=DEFAULT_WIND_HEADING, maxTime=DEFAULT_MAX_TIME, windField=None, arrays=None):
+        if course is None:
+            course = loadCourse()
+        if arrays is None:
+            arrays = {name: np.zeros((count,) + shape, dtype) for name, shape, dtype in ENV_ARRAYS}
+        self.count = count
+        self.arrays = arrays
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.ship = ShipBatch(count, course, dt, windStrength, windHeading, windField)
+        self.maxSteps = int(round(maxTime / dt))
+        self.steps = np.zeros(count, dtype=np.int64)
+
+    def reset(self):
+        self.ship.reset()
+        self.steps[:] = 0
+        self.finished[:] = False
+        self.truncated[:] = False
+        self.rewards[:] = 0
+        self.ship.observe(self.observations)
+        return self.observations
+
+    # steps every environment with the actions already in self.actions; a race
+    # that finishes or reaches the time limit is started again, and its last
+    # observation, score and length are left in the final* and episode* arrays
+    def step(self):
+        ship = self.ship
+        self.rewards[:] = ship.step(self.actions[:, 0], self.actions[:, 1])
+        self.steps += 1
+        self.finished[:] = ship.finished
+        np.logical_and(self.steps >= self.maxSteps, ~ship.finished, out=self.truncated)
+        ship.observe(self.observations)
+
+        ended = self.finished | self.truncated
+        if ended.any():
+            self.finalObservations[ended] = self.observations[ended]
+            self.episodeScores[ended] = ship.score[ended]
+            self.episodeSteps[ended] = self.steps[ended]
+            ship.reset(ended)
+            self.steps[ended] = 0
+            ship.observe(self.observations)
+        return self.observations, self.rewards, self.finished, self.truncated
+
+
+def runWorker(buffer, layout, first, last, settings, go, done, command, failed):
+    # one worker process: steps environments first..last-1 whenever go is released
+    try:
+        settings = dict(settings)
+        windFieldSeed = settings.pop("windFieldSeed")
+        if windFieldSeed is not None:
+            from windfield import WindField
+            settings["windField"] = WindField(windFieldSeed)
+        env = BatchEnv(last - first, arrays=arrayViews(buffer, layout, first, last), **settings)
+        done.release()
+        while True:
+            go.acquire()
+            if command.value == CLOSE:
+                break
+            if command.value == RESET:
+                env.reset()
+            else:
+                env.step()
+            done.release()
+    except Exception:
+        traceback.print_exc()
+        failed.value = 1
+        done.release()
+
+
+class VecEnv:
+
+    # runs count environments across workers processes, one per core by
+    # default; with workers=0 they all run in this process instead
+    # windFieldSeed gives every environment a windfield.WindField with that seed
+    def __init__(self, count, workers=None, course=None, dt=DEFAULT_DT, windStrength=DEFAULT_WIND_STRENGTH,
+                 windHeading=DEFAULT_WIND_HEADING, maxTime=DEFAULT_MAX_TIME, windFieldSeed=None, context=None):
+        if course is None:
+            course = loadCourse()
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, count)
+        self.count = count
+        self.workers = workers
+        self.processes = []
+        settings = {"course": course, "dt": dt, "windStrength": windStrength, "windHeading": windHeading,
+                    "maxTime": maxTime, "windFieldSeed": windFieldSeed}
+
+        layout, size = arrayLayout(count)
+        self.buffer = RawArray("b", max(size, 1))
+        self.arrays = arrayViews(self.buffer, layout)
+        for name, array in self.arrays.items():
+            setattr(self, name, array)
+
+        if workers == 0:
+            settings = dict(settings)
+            windFieldSeed = settings.pop("windFieldSeed")
+            if windFieldSeed is not None:
+                from windfield import WindField
+                settings["windField"] = WindField(windFieldSeed)
+            self.local = BatchEnv(count, arrays=self.arrays, **settings)
+            return
+
+        self.local = None
+        context = context or multiprocessing.get_context()
+        self.command = context.RawValue("i", 0)
+        self.failed = context.RawValue("i", 0)
+        self.done = context.Semaphore(0)
+        self.go = []
+        bounds = np.linspace(0, count, workers + 1).astype(int)
+        for i in range(workers):
+            go = context.Semaphore(0)
+            process = context.Process(target=runWorker, name="VecEnvWorker-%d" % i, daemon=True,
+                                      args=(self.buffer, layout, bounds[i], bounds[i + 1], settings,
+                                            go, self.done, self.command, self.failed))
+            process.start()
+            self.go.append(go)
+            self.processes.append(process)
+        # each worker signals once it has built its environments
+        self.wait()
+
+    def wait(self):
+        for _ in self.processes:
+            while not self.done.acquire(timeout=WORKER_CHECK):
+                if not all(process.is_alive() for process in self.processes):
+                    self.close()
+                    raise RuntimeError("an environment worker stopped")
+        if self.failed.value:
+            self.close()
+            raise RuntimeError("an environment worker failed")
+
+    def run(self, command):
+        self.command.value = command
+        for go in self.go:
+            go.release()
+        self.wait()
+
+    # returns the first observations, an array of (count, OBS_SIZE)
+    def reset(self):
+        if self.local is not None:
+            return self.local.reset()
+        self.run(RESET)
+        return self.observations
+
+    # actions is an array of (count, ACTION_SIZE); returns the observations,
+    # rewards, finished and truncated arrays, which the next step overwrites
+    def step(self, actions):
+        np.copyto(self.actions, actions)
+        if self.local is not None:
+            return self.local.step()
+        self.run(STEP)
+        return self.observations, self.rewards, self.finished, self.truncated
+
+    def close(self):
+        if not self.processes:
+            return
+        self.command.value = CLOSE
+        for go in self.go:
+            go.release()
+        for process in self.processes:
+            process.join(WORKER_CHECK)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the vectorised environment with random actions")
+    parser.add_argument("--envs", type=int, default=4096, help="environments stepped together")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--steps", type=int, default=1000, help="steps to time")
+    parser.add_argument("--dt", type=float, default=DEFAULT_DT, help="fixed time step in seconds")
+    parser.add_argument("--course", default=DEFAULT_COURSE_FILE, help="JSON or compiled course file")
+    parser.add_argument("--wind-field", type=int, metavar="SEED",
+                        help="vary the wind over the course and in time, with this random seed")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    limits = np.array([TURN_RATE * args.dt, SHEET_RATE * args.dt])
+    with VecEnv(args.envs, args.workers, loadCourse(args.course), dt=args.dt,
+                windFieldSeed=args.wind_field) as env:
+        env.reset()
+        episodes = 0
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            observations, rewards, finished, truncated = env.step(rng.uniform(-limits, limits, (args.envs, 2)))
+            episodes += int(finished.sum() + truncated.sum())
+        elapsed = time.perf_counter() - start
+
+    steps = args.envs * args.steps
+    print(json.dumps({"envs": args.envs, "workers": env.workers, "steps": steps,
+                      "episodes": episodes, "stepsPerSecond": steps / elapsed if elapsed > 0 else 0}))
+
+
+if __name__ == "__main__":
+    main()
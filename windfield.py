@@ -0,0 +1,120 @@
+# Wind field - wind that varies over the course and over time
+# The gusts (a factor on the wind strength) and the shifts (degrees added to
+# the wind heading) are precomputed on a grid over the course and through one
+# period of time, as smooth random noise that wraps around in x, z and time,
+# so the field tiles with the screen wrapping and repeats seamlessly. Sampling
+# is trilinear between the grid points and frames, either for one boat at a
+# time or for a whole NumPy batch of positions in a single call.
+from math import floor
+
+import numpy as np
+
+from shipmodel import SCREEN_X, SCREEN_Y
+
+DEFAULT_GRID = (32, 24)  # grid points across x and z
+DEFAULT_FRAMES = 64  # frames through one period
+DEFAULT_PERIOD = 120.0  # seconds before the field repeats
+DEFAULT_GUSTINESS = .3  # the strength varies by up to this fraction either way
+DEFAULT_SHIFT = 15.0  # the heading varies by up to this many degrees either way
+SPATIAL_WAVES = 3.0  # roughly how many gusts fit across the course
+TEMPORAL_WAVES = 6.0  # roughly how many times the wind changes in one period
+
+
+def tileableNoise(shape, waves, rng):
+    # smooth noise scaled to -1..1 that wraps around on every axis: random
+    # amplitudes and phases on whole-number wavenumbers only, the higher ones
+    # damped away, turned into values with an inverse FFT
+    spectrum = rng.standard_normal(shape) + 1j * rng.standard_normal(shape)
+    damping = np.zeros(shape)
+    for axis, (size, axisWaves) in enumerate(zip(shape, waves)):
+        wavenumbers = np.fft.fftfreq(size) * size / axisWaves
+        damping = damping + np.expand_dims(wavenumbers * wavenumbers,
+                                           [i for i in range(len(shape)) if i != axis])
+    noise = np.fft.ifftn(spectrum * np.exp(-damping)).real
+    noise -= noise.mean()
+    biggest = np.abs(noise).max()
+    return noise / biggest if biggest > 0 else noise
+
+
+class WindField:
+
+    # covers x in -width/2..width/2 and z in -height/2..height/2, the screen
+    # by default; outside that it wraps around like the ship does
+    def __init__(self, seed=0, grid=DEFAULT_GRID, frames=DEFAULT_FRAMES, period=DEFAULT_PERIOD,
+                 gustiness=DEFAULT_GUSTINESS, shift=DEFAULT_SHIFT, width=2 * SCREEN_X, height=2 * SCREEN_Y):
+        rng = np.random.default_rng(seed)
+        shape = (frames, grid[1], grid[0])
+        waves = (TEMPORAL_WAVES, SPATIAL_WAVES, SPATIAL_WAVES)
+        # [frame, z, x, 0] is the strength factor and [..., 1] the heading shift
+        self.values = np.stack([1 + gustiness * tileableNoise(shape, waves, rng),
+                                shift * tileableNoise(shape, waves, rng)], axis=-1)
+        self.frames, self.rows, self.cols = shape
+        self.period = period
+        self.minX = -width / 2.0
+        self.minZ = -height / 2.0
+        self.scaleX = self.cols / float(width)
+        self.scaleZ = self.rows / float(height)
+        self.scaleT = self.frames / float(period)
+        # plain lists are quicker than NumPy for one sample at a time
+        self.gusts = self.values[..., 0].ravel().tolist()
+        self.shifts = self.values[..., 1].ravel().tolist()
+
+    # the local wind strength and heading at (x, z) and time t, given the
+    # global strength and heading it varies around
+    def sample(self, x, z, t, windStrength, windHeading):
+        fx = (x - self.minX) * self.scaleX
+        fz = (z - self.minZ) * self.scaleZ
+        ft = t * self.scaleT
+        x0 = floor(fx)
+        z0 = floor(fz)
+        t0 = floor(ft)
+        ax = fx - x0
+        az = fz - z0
+        at = ft - t0
+
+        cols, rows, frames = self.cols, self.rows, self.frames
+        x0 %= cols
+        x1 = (x0 + 1) % cols
+        z0 %= rows
+        z1 = (z0 + 1) % rows
+        t0 %= frames
+        t1 = (t0 + 1) % frames
+
+        gust = 0.0
+        shift = 0.0
+        gusts, shifts = self.gusts, self.shifts
+        # the start of each of the four grid rows around the point, with its weight
+        for i, w in (((t0 * rows + z0) * cols, (1 - at) * (1 - az)),
+                     ((t0 * rows + z1) * cols, (1 - at) * az),
+                     ((t1 * rows + z0) * cols, at * (1 - az)),
+                     ((t1 * rows + z1) * cols, at * az)):
+            gust += w * ((1 - ax) * gusts[i + x0] + ax * gusts[i + x1])
+            shift += w * ((1 - ax) * shifts[i + x0] + ax * shifts[i + x1])
+        return windStrength * gust, windHeading + shift
+
+    # the same for arrays of positions; t, windStrength and windHeading can be
+    # scalars or arrays. Returns (strengths, headings) arrays
+    def sampleBatch(self, xs, zs, t, windStrength, windHeading):
+        fx = (np.asarray(xs, dtype=float) - self.minX) * self.scaleX
+        fz = (np.asarray(zs, dtype=float) - self.minZ) * self.scaleZ
+        ft = np.asarray(t, dtype=float) * self.scaleT
+        x0 = np.floor(fx)
+        z0 = np.floor(fz)
+        t0 = np.floor(ft)
+        ax = (fx - x0)[..., None]
+        az = (fz - z0)[..., None]
+        at = (ft - t0)[..., None]
+        x0 = x0.astype(int) % self.cols
+        z0 = z0.astype(int) % self.rows
+        t0 = t0.astype(int) % self.frames
+        x1 = (x0 + 1) % self.cols
+        z1 = (z0 + 1) % self.rows
+        t1 = (t0 + 1) % self.frames
+
+        values = self.values
+        near = ((1 - az) * ((1 - ax) * values[t0, z0, x0] + ax * values[t0, z0, x1]) +
+                az * ((1 - ax) * values[t0, z1, x0] + ax * values[t0, z1, x1]))
+        far = ((1 - az) * ((1 - ax) * values[t1, z0, x0] + ax * values[t1, z0, x1]) +
+               az * ((1 - ax) * values[t1, z1, x0] + ax * values[t1, z1, x1]))
+        sampled = (1 - at) * near + at * far
+        return np.asarray(windStrength) * sampled[..., 0], np.asarray(windHeading) + sampled[..., 1]